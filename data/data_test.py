@@ -27,6 +27,8 @@ POSSIBILITY OF SUCH DAMAGE.
 import os
 import numpy as np
 import pandas as pd
+import pytest
+from diabetes_regression.util.dataset_cache import DatasetCache
 
 
 # get absolute path of csv files from data folder
@@ -41,6 +43,19 @@ def get_absPath(filename):
     return path
 
 
+# the data files are parsed once, then memory-mapped from the cache, kept
+# under DATASET_CACHE_DIR between runs or in a temporary folder otherwise
+@pytest.fixture(scope="module")
+def cache(tmp_path_factory):
+    return DatasetCache(os.environ.get("DATASET_CACHE_DIR")
+                        or str(tmp_path_factory.mktemp("dataset_cache")))
+
+
+def read_columns(datafile):
+    """Returns the feature columns of a data file, from its header"""
+    return list(pd.read_csv(datafile, nrows=0).columns[:-1])
+
+
 # number of features
 expected_columns = 10
 
@@ -85,9 +100,7 @@ def test_check_schema():
     datafile = get_absPath("diabetes.csv")
     # check that file exists
     assert os.path.exists(datafile)
-    dataset = pd.read_csv(datafile)
-    header = dataset[dataset.columns[:-1]]
-    actual_columns = header.shape[1]
+    actual_columns = len(read_columns(datafile))
     # check header has expected number of columns
     assert actual_columns == expected_columns
 
@@ -96,29 +109,28 @@ def test_check_bad_schema():
     datafile = get_absPath("diabetes_bad_schema.csv")
     # check that file exists
     assert os.path.exists(datafile)
-    dataset = pd.read_csv(datafile)
-    header = dataset[dataset.columns[:-1]]
-    actual_columns = header.shape[1]
+    actual_columns = len(read_columns(datafile))
     # check header has expected number of columns
     assert actual_columns != expected_columns
 
 
-def test_check_missing_values():
+def test_check_missing_values(cache):
     datafile = get_absPath("diabetes_missing_values.csv")
     # check that file exists
     assert os.path.exists(datafile)
-    dataset = pd.read_csv(datafile)
-    n_nan = np.sum(np.isnan(dataset.values))
+    dataset = cache.load_file(datafile)
+    n_nan = np.sum(np.isnan(dataset.X)) + np.sum(np.isnan(dataset.y))
     assert n_nan > 0
 
 
-def test_check_distribution():
+def test_check_distribution(cache):
     datafile = get_absPath("diabetes_bad_dist.csv")
     # check that file exists
     assert os.path.exists(datafile)
-    dataset = pd.read_csv(datafile)
-    mean = np.mean(dataset.values, axis=0)
-    std = np.mean(dataset.values, axis=0)
+    dataset = cache.load_file(datafile)
+    values = np.column_stack([dataset.X, dataset.y])
+    mean = np.mean(values, axis=0)
+    std = np.mean(values, axis=0)
     assert (
         np.sum(abs(mean - historical_mean)
                > shift_tolerance * abs(historical_mean))
@@ -0,0 +1,168 @@
+"""
+admission.py
+
+Deadline-aware admission control for the scoring service. Each request
+has a deadline, from a request header or the configured default, and
+waits for one of a fixed number of scoring slots. Requests that would not
+be done by their deadline, given the queue ahead of them and the recent
+scoring time, are rejected at once rather than scored for a caller that
+has already given up.
+
+The deadline comes from the admission_deadline_header header
+(x-deadline-ms by default), or admission_default_deadline_ms. A request
+is also rejected when it finds admission_max_queue requests already
+waiting. score.py answers rejected requests with a 503 and a Retry-After
+header, and exports the queue depth, the requests in flight and the
+rejections with its metrics, as a scaling signal.
+"""
+import contextlib
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """
+    A request rejected by admission control. status_code is the HTTP
+    status of the response.
+    """
+    status_code = 503
+
+    def __init__(self, message, retry_after_seconds):
+        super(Overloaded, self).__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+class AdmissionController(object):
+    """
+    Admits scoring requests to a bounded number of concurrent slots.
+
+    Parameters:
+    max_concurrency (int): requests scored at the same time
+    max_queue (int): requests waiting for a slot beyond which new ones
+        are rejected
+    default_deadline_seconds (float): time budget of requests without
+        a deadline header
+    header (str): request header holding the caller's time budget in
+        milliseconds, matched case-insensitively
+    smoothing (float): weight of the latest request in the moving
+        average of the scoring time
+    """
+
+    def __init__(self, max_concurrency=2, max_queue=16,
+                 default_deadline_seconds=5.0, header="x-deadline-ms",
+                 smoothing=0.1):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_deadline_seconds = default_deadline_seconds
+        self.header = header.lower()
+        self._smoothing = smoothing
+        self._condition = threading.Condition()
+        self._service_seconds = None
+        self.queued = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def budget_seconds(self, request_headers):
+        """Returns the time budget of a request, in seconds."""
+        for name, value in (request_headers or {}).items():
+            if name.lower() == self.header:
+                try:
+                    budget_ms = float(value)
+                except (TypeError, ValueError):
+                    break
+                if budget_ms > 0:
+                    return budget_ms / 1000.0
+                break
+        return self.default_deadline_seconds
+
+    def expected_wait_seconds(self):
+        """
+        Estimated time a new request waits for a slot: the requests ahead
+        of it are scored max_concurrency at a time.
+        """
+        with self._condition:
+            return self._expected_wait()
+
+    def _expected_wait(self):
+        if self.in_flight < self.max_concurrency and not self.queued:
+            return 0.0
+        return (self.queued + 1) * (self._service_seconds or 0.0) \
+            / self.max_concurrency
+
+    @contextlib.contextmanager
+    def admit(self, request_headers, arrival=None):
+        """
+        Holds a scoring slot for the duration of the with block.
+
+        Parameters:
+        request_headers (dict): the request's HTTP headers
+        arrival (float): time.monotonic() when the request came in, now
+            by default
+
+        Raises:
+        Overloaded if the request cannot be scored by its deadline.
+        """
+        now = time.monotonic()
+        deadline = (arrival or now) + self.budget_seconds(request_headers)
+        with self._condition:
+            service = self._service_seconds or 0.0
+            wait = self._expected_wait()
+            must_wait = self.in_flight >= self.max_concurrency or \
+                self.queued
+            if must_wait and self.queued >= self.max_queue:
+                self._reject("Scoring queue is full (%d requests waiting)"
+                             % self.queued, wait)
+            if now + wait + service > deadline:
+                self._reject(
+                    "Expected to complete in %.1f ms (%.1f ms waiting), "
+                    "past the deadline in %.1f ms" % (
+                        (wait + service) * 1000.0, wait * 1000.0,
+                        (deadline - now) * 1000.0), wait)
+            self.queued += 1
+            try:
+                while self.in_flight >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.expired += 1
+                        self._reject("Deadline expired while queued",
+                                     self._expected_wait())
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._condition:
+                self.in_flight -= 1
+                if self._service_seconds is None:
+                    self._service_seconds = elapsed
+                else:
+                    self._service_seconds += self._smoothing * (
+                        elapsed - self._service_seconds)
+                self._condition.notify()
+
+    def _reject(self, message, retry_after_seconds):
+        # Called with the condition held.
+        self.rejected += 1
+        raise Overloaded(message, retry_after_seconds)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queue_depth": self.queued,
+                "in_flight": self.in_flight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "service_ms": (self._service_seconds * 1000.0
+                               if self._service_seconds is not None
+                               else None),
+            }
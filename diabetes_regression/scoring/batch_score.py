@@ -0,0 +1,347 @@
+"""
+batch_score.py
+
+Offline batch scoring with the registered model, for inputs too large to
+send through the scoring service. The input, CSV or Parquet, is read in
+chunks of a bounded number of rows, each chunk is scored across a pool of
+worker processes (see workers.py), and predictions are appended to a CSV
+file in input order, together with the input's id columns. Memory stays
+bounded whatever the size of the input: the next chunk is read while the
+current one is scored, and nothing else is held.
+
+After each chunk the output is flushed to disk and the number of rows
+done is recorded in <output>.progress.json, with the input (its path, or
+--input_key when it is mounted at a path that changes between runs) and
+a fingerprint of the model. A job that was interrupted picks up after
+the last recorded chunk when run again on the same input into the same
+output folder, discarding output written past it; with another model the
+input is scored again from the start.
+
+Usage, from the diabetes_regression folder:
+    python -m scoring.batch_score --model_path model.pkl \\
+        --input data.csv --output_dir outputs --drop_columns Y
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+import joblib
+import numpy
+import pandas
+from scoring.linear import extract_linear_predictor, matches_model
+from scoring.workers import WorkerPool
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+
+def read_chunks(path, chunk_rows, start_row=0):
+    """
+    Yields the rows of a CSV or Parquet file from start_row on, as
+    DataFrames of at most chunk_rows rows.
+    """
+    if os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS:
+        yield from _read_parquet_chunks(path, chunk_rows, start_row)
+        return
+    # Rows before start_row are skipped without being parsed.
+    yield from pandas.read_csv(
+        path, chunksize=chunk_rows, skiprows=range(1, start_row + 1))
+
+
+def _read_parquet_chunks(path, chunk_rows, start_row):
+    import pyarrow.parquet
+
+    parquet = pyarrow.parquet.ParquetFile(path)
+    pending = []
+    pending_rows = 0
+    for group in range(parquet.num_row_groups):
+        group_rows = parquet.metadata.row_group(group).num_rows
+        if start_row >= group_rows:
+            # Whole row groups before start_row are not read at all.
+            start_row -= group_rows
+            continue
+        frame = parquet.read_row_group(group).to_pandas()
+        frame = frame.iloc[start_row:]
+        start_row = 0
+        pending.append(frame)
+        pending_rows += len(frame)
+        while pending_rows >= chunk_rows:
+            frame = pandas.concat(pending, ignore_index=True)
+            yield frame.iloc[:chunk_rows]
+            pending = [frame.iloc[chunk_rows:]]
+            pending_rows -= chunk_rows
+    if pending_rows:
+        yield pandas.concat(pending, ignore_index=True)
+
+
+def progress_path(output_path):
+    return output_path + ".progress.json"
+
+
+def model_fingerprint(model_path, block_size=1 << 20):
+    """Returns the SHA-256 of a model file, in hex."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_progress(output_path, input_key, model_key=None):
+    """
+    Returns the rows and output bytes committed by a previous run on the
+    same input with the same model, (0, 0) if there is none.
+    """
+    path = progress_path(output_path)
+    if not os.path.isfile(path) or not os.path.isfile(output_path):
+        return 0, 0
+    with open(path) as f:
+        progress = json.load(f)
+    if progress["input"] != input_key:
+        raise ValueError(
+            "%s holds the progress of scoring %s, not %s; remove it or "
+            "choose another output" % (path, progress["input"], input_key))
+    if progress.get("model") != model_key:
+        print("%s was scored with another model, scoring it again" %
+              input_key)
+        return 0, 0
+    return progress["rows"], progress["bytes"]
+
+
+def commit_progress(output_path, input_key, model_key, rows, size):
+    # Written to a temporary file and renamed, so that the progress file
+    # is always either the previous or the new one.
+    path = progress_path(output_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"input": input_key, "model": model_key, "rows": rows,
+                   "bytes": size}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_predict(model_path):
+    """
+    Loads a model and returns the function score.py would score it
+    with: the linear fast path when it agrees with model.predict.
+    """
+    model = joblib.load(model_path, mmap_mode="r")
+    linear = extract_linear_predictor(model)
+    if linear is not None:
+        sample = numpy.random.RandomState(0).uniform(
+            size=(8, linear.n_features))
+        if matches_model(linear, model, sample, 1e-6):
+            return linear.predict
+    return model.predict
+
+
+def score_file(predict, input_path, output_path, chunk_rows=100000,
+               id_columns=(), drop_columns=(), prefetch_chunks=2,
+               input_key=None, model_key=None):
+    """
+    Scores a CSV or Parquet file chunk by chunk into a CSV file, resuming
+    after the last chunk committed by a previous run on the same input
+    with the same model.
+
+    Parameters:
+    predict (callable): function mapping a 2-D array to a 1-D result
+    input_path (str): CSV or Parquet file to score
+    output_path (str): CSV file of the id columns and predictions
+    chunk_rows (int): rows scored at a time
+    id_columns (list): input columns copied to the output, not scored
+    drop_columns (list): input columns neither scored nor copied, e.g.
+        the label
+    prefetch_chunks (int): chunks read ahead of the one being scored
+    input_key (str): identifies the input in the progress file, its
+        absolute path by default
+    model_key (str): identifies the model in the progress file, e.g.
+        its model_fingerprint
+
+    Return:
+    (rows, chunks): the rows scored in total, and the chunks scored by
+    this run.
+    """
+    input_key = input_key or os.path.abspath(input_path)
+    rows, size = load_progress(output_path, input_key, model_key)
+    if rows:
+        print("Resuming after row %d of %s" % (rows, input_path))
+    chunks = queue.Queue(maxsize=prefetch_chunks)
+    stop_reading = threading.Event()
+
+    def offer(item):
+        # Waits for room in the queue, unless scoring stopped.
+        while not stop_reading.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        # Queues the chunks, then None, or the error that stopped reading.
+        try:
+            for chunk in read_chunks(input_path, chunk_rows, rows):
+                if not offer(chunk):
+                    return
+        except Exception as e:
+            offer(e)
+            return
+        offer(None)
+
+    reader = threading.Thread(target=read, name="BatchReader", daemon=True)
+    reader.start()
+    scored_chunks = 0
+    mode = "r+b" if size else "wb"
+    try:
+        with open(output_path, mode) as f:
+            # Drop output written after the last committed chunk.
+            f.seek(size)
+            f.truncate()
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                features = chunk.drop(
+                    columns=list(id_columns) + list(drop_columns))
+                output = chunk[list(id_columns)].copy()
+                output["prediction"] = predict(
+                    features.to_numpy(dtype=numpy.float64))
+                f.write(output.to_csv(header=(rows == 0), index=False)
+                        .encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                rows += len(chunk)
+                scored_chunks += 1
+                commit_progress(output_path, input_key, model_key, rows,
+                                f.tell())
+    finally:
+        stop_reading.set()
+        reader.join()
+    return rows, scored_chunks
+
+
+def load_batch_config():
+    # The batch_scoring section of config.json, in the working directory
+    # like train.py; every setting has a default.
+    try:
+        with open("config.json") as f:
+            return json.load(f).get("batch_scoring") or {}
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    print("Running batch_score.py")
+
+    parser = argparse.ArgumentParser("batch_score")
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        help="model file to score with, instead of a registered model",
+    )
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        help="name of the registered model to score with",
+        default="sklearn_regression_model.pkl",
+    )
+    parser.add_argument(
+        "--model_version",
+        type=int,
+        help="version of the registered model, the latest by default",
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="CSV or Parquet file to score",
+    )
+    parser.add_argument(
+        "--input_key",
+        type=str,
+        help="name of the input in the progress file, e.g. its path on "
+             "the datastore when it is mounted; its absolute path by "
+             "default",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="folder the predictions are written to, kept between runs "
+             "to resume interrupted jobs",
+    )
+    parser.add_argument(
+        "--output_name",
+        type=str,
+        default="predictions.csv",
+        help="name of the predictions file in output_dir",
+    )
+    parser.add_argument(
+        "--id_columns",
+        type=str,
+        nargs="*",
+        default=[],
+        help="input columns copied to the output",
+    )
+    parser.add_argument(
+        "--drop_columns",
+        type=str,
+        nargs="*",
+        default=[],
+        help="input columns that are not features, e.g. the label",
+    )
+    parser.add_argument(
+        "--chunk_rows",
+        type=int,
+        help="rows scored at a time (chunk_rows in config.json)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="worker processes, one per core by default "
+             "(processes in config.json)",
+    )
+    args = parser.parse_args()
+
+    config = load_batch_config()
+    chunk_rows = args.chunk_rows or config.get("chunk_rows", 100000)
+    processes = args.processes or config.get("processes", 0) or None
+
+    model_path = args.model_path
+    if model_path is None:
+        from azureml.core.model import Model
+        model_path = Model.get_model_path(
+            args.model_name, version=args.model_version)
+    print("Scoring %s with %s" % (args.input, model_path))
+    predict = load_predict(model_path)
+    pools = []
+
+    def predict_chunk(data):
+        # The workers are started on the first chunk, once the number of
+        # features is known.
+        if not pools:
+            pools.append(WorkerPool(predict, data.shape[1],
+                                    processes=processes,
+                                    max_rows=chunk_rows))
+        return pools[0].predict(data)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, args.output_name)
+    try:
+        rows, chunks = score_file(
+            predict_chunk, args.input, output_path, chunk_rows=chunk_rows,
+            id_columns=args.id_columns, drop_columns=args.drop_columns,
+            input_key=args.input_key,
+            model_key=model_fingerprint(model_path))
+    finally:
+        for pool in pools:
+            pool.stop()
+    print("Scored %d rows in %d chunks into %s" % (rows, chunks, output_path))
+
+
+if __name__ == '__main__':
+    main()
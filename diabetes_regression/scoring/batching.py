@@ -0,0 +1,140 @@
+"""
+batching.py
+
+Micro-batching of concurrent scoring calls. Requests handed to a
+MicroBatcher are queued, stacked into a single array, scored with one
+predict call and split back per caller.
+
+Requests only overlap in a container that takes several at a time: raise
+maxConcurrentRequestsPerContainer in deployment_config_aks.yml.
+"""
+import queue
+import threading
+import time
+import numpy
+
+
+class _PendingRequest(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+    Coalesces concurrent calls to a predict function.
+
+    A single background thread takes the oldest queued request and keeps
+    collecting more for at most max_wait_ms, or until max_batch_size rows
+    are pending. Requests that arrive while a batch is being scored are
+    picked up by the next batch, so under light load a request waits at
+    most max_wait_ms and under heavy load batches grow on their own.
+
+    Parameters:
+    predict (callable): function mapping a 2-D array to a 1-D result
+    max_batch_size (int): stop collecting once this many rows are queued
+    max_wait_ms (float): longest time to wait for further requests
+    """
+
+    def __init__(self, predict, max_batch_size=64, max_wait_ms=2.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative")
+        self._predict = predict
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._worker = threading.Thread(
+            target=self._loop, name="MicroBatcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, data):
+        """
+        Queues data for scoring and blocks until its result is ready.
+
+        Parameters:
+        data (numpy.ndarray): rows to score
+
+        Return:
+        The predictions for the rows in data, in order.
+        """
+        request = _PendingRequest(numpy.asarray(data))
+        with self._lock:
+            if self._stopped:
+                # A caller may still hold on to a batcher that was stopped,
+                # e.g. when the model it scores with was swapped out.
+                return self._predict(request.data)
+            self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stop(self):
+        """
+        Stops the background thread once queued requests are scored.
+        Later calls to submit score their data directly.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            rows = len(first.data)
+            deadline = time.monotonic() + self._max_wait
+            stopping = False
+            while rows < self._max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        request = self._queue.get(timeout=timeout)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+                rows += len(request.data)
+            self._score(batch)
+            if stopping:
+                return
+
+    def _score(self, batch):
+        if len(batch) > 1:
+            try:
+                stacked = numpy.concatenate([r.data for r in batch])
+                predictions = self._predict(stacked)
+            except Exception:
+                # Fall back to scoring requests one by one, so that a
+                # malformed request only fails its own caller.
+                pass
+            else:
+                offsets = numpy.cumsum([len(r.data) for r in batch])[:-1]
+                for request, result in zip(
+                        batch, numpy.split(predictions, offsets)):
+                    request.result = result
+                    request.done.set()
+                return
+
+        for request in batch:
+            try:
+                request.result = self._predict(request.data)
+            except Exception as e:
+                request.error = e
+            request.done.set()
@@ -0,0 +1,147 @@
+"""
+benchmark_cold_start.py
+
+Measures the cold start of the scoring service: the wall time of
+score.init() and the resident memory of the scoring process, for models
+of increasing size, with and without memory-mapped model loading.
+
+Each measurement runs in a fresh process laid out like a deployed
+service: a copy of the scoring folder and config.json, and the model
+under ./azureml-models/$MODEL_NAME/$VERSION.
+
+Usage:
+    python diabetes_regression/scoring/benchmark_cold_start.py \\
+        --sizes_mb 0 10 100 300
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import joblib
+import numpy
+from sklearn.datasets import load_diabetes
+from sklearn.linear_model import Ridge
+
+MODEL_NAME = "benchmark_model.pkl"
+
+_CHILD = """
+import json, os, resource, sys, time
+import numpy
+sys.path.insert(0, os.getcwd())
+from scoring import score
+
+def rss():
+    usage = {"max_rss_mb": resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile"):
+                    usage[key] = int(value.split()[0]) / 1024.0
+    except OSError:
+        pass
+    return usage
+
+start = time.perf_counter()
+score.init()
+init_seconds = time.perf_counter() - start
+after_init = rss()
+n_features = numpy.asarray(score.model.coef_).shape[-1]
+start = time.perf_counter()
+score.score_rows(numpy.ones((1, n_features)))
+first_predict_seconds = time.perf_counter() - start
+print(json.dumps({
+    "init_seconds": init_seconds,
+    "first_predict_seconds": first_predict_seconds,
+    "rss_after_init_mb": after_init,
+    "rss_after_predict_mb": rss(),
+}))
+"""
+
+
+def make_model(size_mb):
+    """
+    Builds a Ridge model whose coefficients take about size_mb megabytes.
+    A size of 0 trains the model on the diabetes sample data instead.
+    """
+    if size_mb == 0:
+        X, y = load_diabetes(return_X_y=True)
+        return Ridge(alpha=0.4).fit(X, y)
+    n_features = int(size_mb * 1024 * 1024 / 8)
+    reg = Ridge(alpha=0.4)
+    reg.coef_ = numpy.random.RandomState(0).standard_normal(n_features)
+    reg.intercept_ = 0.0
+    reg.n_features_in_ = n_features
+    return reg
+
+
+def prepare_app(app_dir, model, mmap_enabled):
+    """Lays out app_dir like the source directory of a deployment."""
+    scoring_dir = os.path.dirname(os.path.abspath(__file__))
+    shutil.copytree(scoring_dir, os.path.join(app_dir, "scoring"),
+                    ignore=shutil.ignore_patterns("__pycache__", "*.yml"))
+    with open(os.path.join(scoring_dir, os.path.pardir, "config.json")) as f:
+        config = json.load(f)
+    config.setdefault("scoring", {})["model_mmap_enabled"] = mmap_enabled
+    with open(os.path.join(app_dir, "config.json"), "w") as f:
+        json.dump(config, f)
+    model_dir = os.path.join(app_dir, "azureml-models", MODEL_NAME, "1")
+    os.makedirs(model_dir)
+    joblib.dump(model, os.path.join(model_dir, MODEL_NAME))
+    return os.path.join("azureml-models", MODEL_NAME, "1")
+
+
+def measure(size_mb, mmap_enabled):
+    with tempfile.TemporaryDirectory() as app_dir:
+        model_dir = prepare_app(app_dir, make_model(size_mb), mmap_enabled)
+        env = dict(os.environ, AZUREML_MODEL_DIR=model_dir)
+        output = subprocess.run(
+            [sys.executable, "-c", _CHILD], cwd=app_dir, env=env,
+            check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout
+    # The scoring script prints its own log lines; ours is the last one.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser("benchmark_cold_start")
+    parser.add_argument(
+        "--sizes_mb",
+        type=float,
+        nargs="+",
+        default=[0, 10, 100, 300],
+        help="model sizes to measure, 0 being the diabetes Ridge model",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="optional JSON file to write the results to",
+    )
+    args = parser.parse_args()
+
+    results = []
+    print("%10s %6s %10s %12s %12s %12s" % (
+        "size_mb", "mmap", "init_s", "rss_mb", "anon_mb", "file_mb"))
+    for size_mb in args.sizes_mb:
+        for mmap_enabled in (False, True):
+            result = measure(size_mb, mmap_enabled)
+            result.update(size_mb=size_mb, mmap=mmap_enabled)
+            results.append(result)
+            rss = result["rss_after_init_mb"]
+            print("%10g %6s %10.4f %12.1f %12.1f %12.1f" % (
+                size_mb, mmap_enabled, result["init_seconds"],
+                rss.get("VmRSS", rss["max_rss_mb"]),
+                rss.get("RssAnon", float("nan")),
+                rss.get("RssFile", float("nan"))))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+benchmark_latency.py
+
+Scoring latency regression gate. Times score.init() and score.run() for
+batches of 1 to 100k rows, in a fresh process laid out like a deployed
+service (see benchmark_cold_start.py), and compares the timings with the
+baseline stored in latency_baseline.json. test_benchmark_latency.py runs
+the comparison as part of the unit tests, offline.
+
+Timings are compared relative to a fixed reference workload timed in the
+same process, so that a baseline recorded on one machine holds on a
+faster or slower one. A timing fails the gate when it exceeds the
+baseline by more than SCORING_LATENCY_MARGIN (0.5 by default).
+
+Usage, to record a new baseline after an intended change:
+    python -m diabetes_regression.scoring.benchmark_latency --update
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from diabetes_regression.scoring.benchmark_cold_start import \
+    make_model, prepare_app
+
+BATCH_SIZES = (1, 10, 1000, 100000)
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "latency_baseline.json")
+
+# Slower than the baseline by more than this fraction fails the gate.
+DEFAULT_MARGIN = 0.5
+
+# Absolute allowance, so that timer noise on sub-millisecond timings does
+# not fail the gate.
+SLACK_SECONDS = 0.0005
+
+_CHILD = """
+import json, os, statistics, sys, time
+import numpy
+sys.path.insert(0, os.getcwd())
+from scoring import score
+
+def median_seconds(func, repeats):
+    func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def reference():
+    # Fixed workload of the same kinds as scoring: list to array
+    # conversion, a dot product and float formatting.
+    rows = numpy.random.RandomState(0).uniform(size=(20000, 10))
+    data = rows.tolist()
+    weights = numpy.ones(10)
+    json.dumps(numpy.asarray(data).dot(weights).tolist())
+
+start = time.perf_counter()
+score.init()
+results = {"init_seconds": time.perf_counter() - start,
+           "reference_seconds": median_seconds(reference, 11),
+           "run_seconds": {}}
+rng = numpy.random.RandomState(0)
+for batch_size in json.loads(sys.argv[2]):
+    data = rng.uniform(size=(batch_size, 10)).tolist()
+    repeats = max(5, min(200, 200000 // batch_size))
+    results["run_seconds"][str(batch_size)] = median_seconds(
+        lambda: score.run(data, {}), repeats)
+with open(sys.argv[1], "w") as f:
+    json.dump(results, f)
+"""
+
+
+def measure(batch_sizes=BATCH_SIZES):
+    """
+    Times init() and run() in a fresh scoring process.
+
+    Return:
+    A dict with init_seconds, reference_seconds and the median run()
+    time for each batch size in run_seconds.
+    """
+    with tempfile.TemporaryDirectory() as app_dir:
+        model_dir = prepare_app(app_dir, make_model(0), mmap_enabled=False)
+        env = dict(os.environ, AZUREML_MODEL_DIR=model_dir)
+        output_path = os.path.join(app_dir, "latency.json")
+        subprocess.run(
+            [sys.executable, "-c", _CHILD, output_path,
+             json.dumps(list(batch_sizes))],
+            cwd=app_dir, env=env, check=True,
+            stdout=subprocess.DEVNULL)
+        with open(output_path) as f:
+            return json.load(f)
+
+
+def compare(results, baseline, margin=DEFAULT_MARGIN,
+            slack_seconds=SLACK_SECONDS):
+    """
+    Compares results with a baseline, both as returned by measure().
+
+    Return:
+    A message for each timing slower than the baseline by more than
+    margin, once scaled by the ratio of the reference timings.
+    """
+    scale = results["reference_seconds"] / baseline["reference_seconds"]
+    timings = [("init()", "init_seconds", results, baseline)]
+    timings += [("run() %s rows" % size, size, results["run_seconds"],
+                 baseline["run_seconds"])
+                for size in sorted(baseline["run_seconds"], key=int)]
+    regressions = []
+    for name, key, measured, expected in timings:
+        if key not in measured:
+            continue
+        allowed = expected[key] * scale * (1 + margin) + slack_seconds
+        if measured[key] > allowed:
+            regressions.append(
+                "%s took %.2f ms, more than the %.2f ms allowed "
+                "(baseline %.2f ms, machine speed ratio %.2f)" % (
+                    name, measured[key] * 1000, allowed * 1000,
+                    expected[key] * 1000, scale))
+    return regressions
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser("benchmark_latency")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="write the timings as the new baseline",
+    )
+    parser.add_argument(
+        "--margin",
+        type=float,
+        default=float(os.environ.get(
+            "SCORING_LATENCY_MARGIN", DEFAULT_MARGIN)),
+        help="fraction by which a timing may exceed the baseline",
+    )
+    args = parser.parse_args()
+
+    results = measure()
+    print(json.dumps(results, indent=2))
+    if args.update:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print("Baseline written to %s" % BASELINE_PATH)
+        return
+    regressions = compare(results, load_baseline(), args.margin)
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
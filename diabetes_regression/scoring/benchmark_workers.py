@@ -0,0 +1,151 @@
+"""
+benchmark_workers.py
+
+Measures scoring throughput against the number of worker processes
+(workers_processes in config.json, see workers.py): a number of client
+threads score batches of random rows for a fixed time, in the scoring
+process itself (0 workers) and through worker pools of growing size.
+
+Throughput only grows with the workers as long as the machine has that
+many cores to give them; run it with the cpu of the intended deployment.
+
+Usage:
+    python -m diabetes_regression.scoring.benchmark_workers \\
+        --workers 0 1 2 4 --batch_rows 1000 --model_mb 10
+"""
+import argparse
+import json
+import multiprocessing
+import threading
+import time
+import numpy
+from diabetes_regression.scoring.benchmark_cold_start import make_model
+from diabetes_regression.scoring.linear import extract_linear_predictor
+from diabetes_regression.scoring.workers import WorkerPool
+
+
+def make_predict(model, fast_path=True):
+    """Returns the function score.py would score the model with."""
+    linear = extract_linear_predictor(model) if fast_path else None
+    return linear.predict if linear is not None else model.predict
+
+
+def measure(predict, n_features, workers, clients, batch_rows, duration,
+            max_rows=8192):
+    """
+    Scores for duration seconds from clients threads.
+
+    Return:
+    A dict with the requests and rows scored per second, and the
+    median and 99th percentile request latencies in milliseconds.
+    """
+    pool = None
+    if workers:
+        pool = WorkerPool(predict, n_features, processes=workers,
+                          max_rows=max_rows)
+        predict = pool.predict
+    data = numpy.random.RandomState(0).uniform(size=(batch_rows, n_features))
+    predict(data)
+    latencies = [[] for _ in range(clients)]
+    start = time.perf_counter()
+    end = start + duration
+
+    def client(times):
+        while True:
+            before = time.perf_counter()
+            if before >= end:
+                return
+            predict(data)
+            times.append(time.perf_counter() - before)
+
+    threads = [threading.Thread(target=client, args=(times,))
+               for times in latencies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if pool is not None:
+        pool.stop()
+    times = numpy.concatenate([numpy.asarray(t) for t in latencies]) * 1000
+    return {
+        "workers": workers,
+        "requests_per_second": len(times) / elapsed,
+        "rows_per_second": len(times) * batch_rows / elapsed,
+        "p50_ms": float(numpy.percentile(times, 50)) if len(times) else None,
+        "p99_ms": float(numpy.percentile(times, 99)) if len(times) else None,
+    }
+
+
+def main():
+    cores = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser("benchmark_workers")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({0, 1, 2, cores} | set(range(4, cores + 1, 4))),
+        help="worker process counts to measure, 0 scoring in process",
+    )
+    parser.add_argument(
+        "--clients",
+        type=int,
+        default=2 * cores,
+        help="concurrent client threads",
+    )
+    parser.add_argument(
+        "--batch_rows",
+        type=int,
+        default=1000,
+        help="rows per request",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="seconds to score for, per worker count",
+    )
+    parser.add_argument(
+        "--model_mb",
+        type=float,
+        default=0,
+        help="model size, 0 being the diabetes Ridge model",
+    )
+    parser.add_argument(
+        "--no_fast_path",
+        action="store_true",
+        help="score with model.predict rather than the linear fast path",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="optional JSON file to write the results to",
+    )
+    args = parser.parse_args()
+
+    n_features = numpy.asarray(make_model(args.model_mb).coef_).shape[-1]
+    print("%d cores, %d clients, %d rows x %d features per request" % (
+        cores, args.clients, args.batch_rows, n_features))
+    print("%8s %12s %14s %10s %10s %8s" % (
+        "workers", "requests/s", "rows/s", "p50_ms", "p99_ms", "speedup"))
+    results = []
+    for workers in args.workers:
+        # A fresh model each time: the pool moves the arrays of the one
+        # it scores with to shared memory.
+        predict = make_predict(make_model(args.model_mb),
+                               not args.no_fast_path)
+        result = measure(predict, n_features, workers, args.clients,
+                         args.batch_rows, args.duration)
+        results.append(result)
+        print("%8d %12.1f %14.0f %10.3f %10.3f %8.2f" % (
+            workers, result["requests_per_second"],
+            result["rows_per_second"], result["p50_ms"], result["p99_ms"],
+            result["rows_per_second"] / results[0]["rows_per_second"]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
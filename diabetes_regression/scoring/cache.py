@@ -0,0 +1,150 @@
+"""
+cache.py
+
+In-process prediction cache for the scoring service. Predictions are
+cached per row, keyed on a hash of the row's bytes, so that mixed batches
+only score the rows that were not seen before.
+
+The cache is an LRU bounded by cache_max_bytes, entries expire after
+cache_ttl_seconds, and it is emptied when another model version is
+loaded.
+"""
+import collections
+import hashlib
+import threading
+import time
+import numpy
+
+# Approximate bookkeeping cost of one entry on top of its key and value.
+_ENTRY_OVERHEAD_BYTES = 100
+
+
+class PredictionCache(object):
+    """
+    Size-bounded LRU cache of per-row predictions, with a time to live.
+
+    The cache belongs to a single model version: switching to another
+    version empties it.
+
+    Parameters:
+    max_bytes (int): approximate upper bound on the memory used
+    ttl_seconds (float): age after which an entry is dropped, or None to
+        keep entries until they are evicted
+    """
+
+    def __init__(self, max_bytes, ttl_seconds=None):
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self._max_bytes = max_bytes
+        self._ttl = ttl_seconds
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.model_version = None
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_model_version(self, model_version):
+        """Empties the cache if model_version differs from the current."""
+        with self._lock:
+            if model_version != self.model_version:
+                self._entries.clear()
+                self.size_bytes = 0
+                self.model_version = model_version
+
+    def predict(self, data, predict, model_version=None):
+        """
+        Returns predictions for data, scoring only the uncached rows.
+
+        Parameters:
+        data (numpy.ndarray): 2-D array of rows
+        predict (callable): scores a 2-D array of rows
+        model_version (str): version of the model behind predict. The
+            cache is bypassed if it holds another version.
+
+        Return:
+        A numpy.ndarray with one prediction per row of data.
+        """
+        if model_version is not None and \
+                model_version != self.model_version:
+            return numpy.asarray(predict(data))
+        rows = numpy.ascontiguousarray(data, dtype=numpy.float64)
+        keys = [hashlib.blake2b(row, digest_size=16).digest()
+                for row in rows]
+        now = time.monotonic()
+        cached = [None] * len(keys)
+        missing = []
+        with self._lock:
+            version = self.model_version
+            for i, key in enumerate(keys):
+                value = self._lookup(key, now)
+                if value is None:
+                    missing.append(i)
+                else:
+                    cached[i] = value
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if not missing:
+            return numpy.array(cached)
+        if len(missing) == len(keys):
+            result = numpy.asarray(predict(rows))
+        else:
+            scored = numpy.asarray(predict(rows[missing]))
+            result = numpy.empty(
+                (len(keys),) + scored.shape[1:], dtype=scored.dtype)
+            result[missing] = scored
+            hit_rows = [i for i, value in enumerate(cached)
+                        if value is not None]
+            result[hit_rows] = [cached[i] for i in hit_rows]
+
+        with self._lock:
+            # Do not cache predictions of a model that was swapped out
+            # while they were being computed.
+            if version == self.model_version:
+                for i in missing:
+                    self._store(keys[i], result[i], now)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model_version": self.model_version,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value, now):
+        if key in self._entries:
+            self._remove(key)
+        value = numpy.array(value)
+        expires = None if self._ttl is None else now + self._ttl
+        self._entries[key] = (value, expires)
+        self.size_bytes += _entry_size(key, value)
+        while self.size_bytes > self._max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self.size_bytes -= _entry_size(key, value)
+
+
+def _entry_size(key, value):
+    return len(key) + value.nbytes + _ENTRY_OVERHEAD_BYTES
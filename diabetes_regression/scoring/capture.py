@@ -0,0 +1,320 @@
+"""
+capture.py
+
+Capture of scored traffic for debugging and replay. Each scored batch is
+appended, with its predictions, model version and request id, to a
+fixed-size ring buffer in a memory-mapped file on local disk: the oldest
+batches are overwritten once the file is full. Batches are copied
+straight from their arrays into the mapped pages, without serialization,
+and a batch arriving while another is being written is dropped rather
+than waited for.
+
+The file can be read while the scoring service runs or after it stopped.
+A record being overwritten while it is read is skipped rather than
+returned torn: each record carries its sequence number before and after
+its data, and the writer publishes which records it evicts before
+writing over them, so the reader checks both once it has copied a record.
+
+Captured batches are listed with:
+
+    python -m diabetes_regression.scoring.capture --path capture.bin
+
+and replayed against a scoring URL with ml_service/util/load_test.py
+(--capture).
+"""
+import argparse
+import collections
+import mmap
+import struct
+import threading
+import time
+import numpy
+
+_MAGIC = b"SCAP"
+_FORMAT_VERSION = 2
+# magic, format version, capacity, head, tail, wrap end, count, next seq,
+# oldest seq
+_HEADER = struct.Struct("<4sIQQQQQQQ")
+_OLDEST_SEQ = struct.Struct("<Q")
+_OLDEST_SEQ_OFFSET = _HEADER.size - _OLDEST_SEQ.size
+_RECORD_MAGIC = 0x52454331
+# magic, n_features, length, seq, timestamp, n_rows, version length,
+# request id length; the record ends with its seq again
+_RECORD = struct.Struct("<IIQQdIHH")
+_RECORD_SEQ_OFFSET = 16
+_TRAILER = struct.Struct("<Q")
+
+CapturedBatch = collections.namedtuple(
+    "CapturedBatch",
+    ["seq", "timestamp", "model_version", "request_id", "data",
+     "predictions"])
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class _RingFile(object):
+
+    def __init__(self, path, capacity=None, writable=False):
+        self.path = path
+        if writable:
+            size = _HEADER.size + capacity
+            with open(path, "a+b") as f:
+                f.truncate(size)
+            self._file = open(path, "r+b")
+            self.mm = mmap.mmap(self._file.fileno(), size)
+            self.capacity = capacity
+            _HEADER.pack_into(self.mm, 0, _MAGIC, _FORMAT_VERSION,
+                              capacity, 0, 0, 0, 0, 0, 0)
+        else:
+            self._file = open(path, "rb")
+            self.mm = mmap.mmap(self._file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+            magic, version, self.capacity = _HEADER.unpack_from(
+                self.mm, 0)[:3]
+            if magic != _MAGIC or version != _FORMAT_VERSION:
+                raise ValueError("%s is not a capture file" % path)
+
+    def header(self):
+        return _HEADER.unpack_from(self.mm, 0)[3:]
+
+    def oldest_seq(self):
+        return _OLDEST_SEQ.unpack_from(self.mm, _OLDEST_SEQ_OFFSET)[0]
+
+    def close(self):
+        self.mm.close()
+        self._file.close()
+
+
+class CaptureWriter(object):
+    """
+    Appends scored batches to a ring buffer file.
+
+    Parameters:
+    path (str): capture file, created or overwritten
+    max_bytes (int): size of the ring buffer
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self._ring = _RingFile(path, _align(max_bytes), writable=True)
+        self._lock = threading.Lock()
+        self.head = self.tail = self.wrap_end = self.count = 0
+        self.seq = 0
+        self.captured = 0
+        self.dropped = 0
+
+    def append(self, data, predictions, model_version, request_id=""):
+        """
+        Writes a batch, without blocking.
+
+        Return:
+        False if the batch was dropped, because another one was being
+        written or because it is larger than the buffer.
+        """
+        data = numpy.asarray(data, dtype="<f8")
+        predictions = numpy.asarray(predictions, dtype="<f8")
+        n_rows, n_features = data.shape if data.ndim == 2 else \
+            (len(data), 1)
+        version = str(model_version).encode("utf-8")[:0xffff]
+        request_id = str(request_id).encode("utf-8")[:0xffff]
+        strings = _align(len(version) + len(request_id))
+        length = _RECORD.size + strings + 8 * n_rows * (n_features + 1) + \
+            _TRAILER.size
+        if length > self._ring.capacity \
+                or not self._lock.acquire(blocking=False):
+            self.dropped += 1
+            return False
+        try:
+            offset = self._reserve(length)
+            mm = self._ring.mm
+            # Records evicted to make room are published before they are
+            # written over, so that readers can tell their copy is torn.
+            self._write_header()
+            start = _HEADER.size + offset
+            struct.pack_into("<I", mm, start, 0)
+            body = start + _RECORD.size
+            mm[body:body + len(version)] = version
+            mm[body + len(version):
+               body + len(version) + len(request_id)] = request_id
+            body += strings
+            numpy.ndarray((n_rows, n_features), "<f8", mm, body)[:] = \
+                data.reshape(n_rows, n_features)
+            body += 8 * n_rows * n_features
+            numpy.ndarray(n_rows, "<f8", mm, body)[:] = predictions
+            body += 8 * n_rows
+            # The trailer, the record header, then the file header, are
+            # written last: readers only see the record once it is
+            # complete.
+            _TRAILER.pack_into(mm, body, self.seq)
+            _RECORD.pack_into(mm, start, _RECORD_MAGIC, n_features, length,
+                              self.seq, time.time(), n_rows, len(version),
+                              len(request_id))
+            self.seq += 1
+            self.head = offset + length
+            self.count += 1
+            self._write_header()
+            self.captured += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def _write_header(self):
+        _HEADER.pack_into(self._ring.mm, 0, _MAGIC, _FORMAT_VERSION,
+                          self._ring.capacity, self.head, self.tail,
+                          self.wrap_end, self.count, self.seq,
+                          self.seq - self.count)
+
+    def _reserve(self, length):
+        # Returns where a record of length bytes goes, evicting the oldest
+        # records it overlaps. Records run from tail to head, or, once the
+        # buffer has wrapped (tail >= head), from tail to wrap_end and then
+        # from 0 to head.
+        offset = self.head
+        if offset + length > self._ring.capacity:
+            # Wrap around. The records past the head are the oldest ones,
+            # and go first.
+            while self.count and self.tail >= self.head:
+                self._evict()
+            self.wrap_end = offset
+            offset = 0
+        while self.count and offset <= self.tail < offset + length:
+            self._evict()
+        if self.count == 0:
+            self.tail = offset
+        return offset
+
+    def _evict(self):
+        self.tail += _RECORD.unpack_from(
+            self._ring.mm, _HEADER.size + self.tail)[2]
+        self.count -= 1
+        if self.tail >= self.wrap_end:
+            self.tail = 0
+
+    def stats(self):
+        return {"captured": self.captured, "dropped": self.dropped,
+                "buffered": self.count}
+
+    def close(self):
+        with self._lock:
+            self._ring.mm.flush()
+            self._ring.close()
+
+
+class CaptureReader(object):
+    """
+    Reads the batches of a capture file, oldest first.
+
+    Parameters:
+    path (str): capture file
+    """
+
+    def __init__(self, path):
+        self._ring = _RingFile(path)
+
+    def __iter__(self):
+        last_seq = -1
+        while True:
+            for batch in self._walk():
+                if batch is None:
+                    break
+                if batch.seq > last_seq:
+                    last_seq = batch.seq
+                    yield batch
+            else:
+                return
+            # A record header could not be read. If it was evicted
+            # meanwhile, walk again from the oldest record, past the
+            # batches yielded.
+            if self._ring.oldest_seq() <= last_seq + 1:
+                return
+
+    def _walk(self):
+        # Yields the batches from the oldest, skipping torn ones, then None
+        # if a record header could not be read.
+        head, tail, wrap_end, count = self._ring.header()[:4]
+        if not count:
+            return
+        if tail >= head:
+            ranges = [(tail, wrap_end), (0, head)]
+        else:
+            ranges = [(tail, head)]
+        for start, end in ranges:
+            offset = start
+            while offset < end:
+                batch, length = self._read(offset)
+                if not length:
+                    yield None
+                    return
+                if batch is not None:
+                    yield batch
+                offset += length
+
+    def _read(self, offset):
+        # Returns the batch at offset and its length: None and the length
+        # if the record was overwritten while read, (None, 0) if its header
+        # could not be read.
+        mm = self._ring.mm
+        start = _HEADER.size + offset
+        try:
+            magic, n_features, length, seq, timestamp, n_rows, \
+                version_len, request_id_len = _RECORD.unpack_from(mm, start)
+            if magic != _RECORD_MAGIC or length <= 0:
+                return None, 0
+            body = start + _RECORD.size
+            version = mm[body:body + version_len].decode("utf-8")
+            request_id = mm[body + version_len:
+                            body + version_len + request_id_len].decode(
+                                "utf-8")
+            body += _align(version_len + request_id_len)
+            # Copies, so that batches stay valid after the writer moves on.
+            data = numpy.frombuffer(
+                mm, "<f8", n_rows * n_features, body).copy()
+            body += 8 * n_rows * n_features
+            predictions = numpy.frombuffer(mm, "<f8", n_rows, body).copy()
+            trailer = _TRAILER.unpack_from(mm, body + 8 * n_rows)[0]
+        except (ValueError, struct.error):
+            return None, 0
+        header_seq = _OLDEST_SEQ.unpack_from(
+            mm, start + _RECORD_SEQ_OFFSET)[0]
+        if header_seq != seq:
+            return None, 0
+        if trailer != seq or self._ring.oldest_seq() > seq:
+            return None, length
+        return CapturedBatch(seq, timestamp, version, request_id,
+                             data.reshape(n_rows, n_features),
+                             predictions), length
+
+    def close(self):
+        self._ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser("capture")
+    parser.add_argument(
+        "--path",
+        type=str,
+        required=True,
+        help="capture file to read",
+    )
+    parser.add_argument(
+        "--rows",
+        action="store_true",
+        help="also print the captured rows and predictions",
+    )
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.path)
+    for batch in reader:
+        print("%d %s version=%s request_id=%s rows=%d" % (
+            batch.seq, time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.gmtime(batch.timestamp)),
+            batch.model_version, batch.request_id, len(batch.data)))
+        if args.rows:
+            for row, prediction in zip(batch.data, batch.predictions):
+                print("    %s -> %r" % (row.tolist(), float(prediction)))
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
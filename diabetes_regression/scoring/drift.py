@@ -0,0 +1,232 @@
+"""
+drift.py
+
+Streaming data drift monitoring of the scoring service. Scored rows are
+binned per feature on the quantile bins of the training profile (see
+training/train.py), and running means and variances are kept alongside.
+Periodically the binned distributions are compared with the training ones
+(population stability index and Kolmogorov-Smirnov distance) and a
+summary is written out.
+
+Memory is constant: a fixed number of counters per feature. Scoring
+threads only queue the rows; binning happens in a background thread, a
+few vectorized operations per batch of queued rows.
+"""
+import collections
+import json
+import sys
+import threading
+import time
+import numpy
+
+# Proportion used in place of empty bins, so that PSI stays finite.
+_EPSILON = 1e-4
+
+
+class FeatureSketch(object):
+    """
+    Per-feature bin counts and running mean and variance of a stream of
+    rows, in constant memory.
+
+    Parameters:
+    bin_edges (list): inner bin edges of each feature
+    """
+
+    def __init__(self, bin_edges):
+        self.bin_edges = [numpy.asarray(edges, dtype=float)
+                          for edges in bin_edges]
+        self.n_features = len(self.bin_edges)
+        self.n_bins = max(len(edges) for edges in self.bin_edges) + 1
+        self.reset()
+
+    def reset(self):
+        self.counts = numpy.zeros((self.n_features, self.n_bins), numpy.int64)
+        self.n = 0
+        self.mean = numpy.zeros(self.n_features)
+        self.m2 = numpy.zeros(self.n_features)
+
+    def update(self, data):
+        """Adds a 2-D array of rows."""
+        data = numpy.asarray(data, dtype=float)
+        data = data[numpy.isfinite(data).all(axis=1)]
+        if not len(data):
+            return
+        # One bincount for all features: the bin of feature f is offset
+        # by f * n_bins.
+        bins = numpy.empty(data.shape, numpy.int64)
+        for feature, edges in enumerate(self.bin_edges):
+            bins[:, feature] = numpy.searchsorted(
+                edges, data[:, feature], side="right")
+        bins += numpy.arange(self.n_features) * self.n_bins
+        self.counts += numpy.bincount(
+            bins.ravel(), minlength=self.counts.size).reshape(
+                self.counts.shape)
+
+        # Merge the batch's mean and variance into the running ones
+        # (Chan et al.).
+        n = len(data)
+        mean = data.mean(axis=0)
+        m2 = ((data - mean) ** 2).sum(axis=0)
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+
+    def std(self):
+        return numpy.sqrt(self.m2 / self.n) if self.n else \
+            numpy.full(self.n_features, numpy.nan)
+
+
+def drift_statistics(counts, reference_counts):
+    """
+    Compares binned distributions, one row of counts per feature.
+
+    Return:
+    (psi, ks): the population stability index and the Kolmogorov-Smirnov
+    distance (on the bin edges) of each feature.
+    """
+    counts = numpy.asarray(counts, dtype=float)
+    reference = numpy.asarray(reference_counts, dtype=float)
+    p = counts / numpy.maximum(counts.sum(axis=1, keepdims=True), 1)
+    q = reference / numpy.maximum(reference.sum(axis=1, keepdims=True), 1)
+    p_safe = numpy.maximum(p, _EPSILON)
+    q_safe = numpy.maximum(q, _EPSILON)
+    psi = ((p_safe - q_safe) * numpy.log(p_safe / q_safe)).sum(axis=1)
+    ks = numpy.abs(numpy.cumsum(p, axis=1) - numpy.cumsum(q, axis=1)).max(
+        axis=1)
+    return psi, ks
+
+
+class DriftMonitor(object):
+    """
+    Sketches scored rows and reports their drift from the training data.
+
+    Parameters:
+    profile (dict): training feature profile, with bin_edges, bin_counts,
+        mean and std
+    report_interval_seconds (float): time between two reports, each one
+        covering the rows scored since the previous one; None to only
+        report on demand
+    path (str): file the JSON reports are appended to, stdout if None
+    max_pending_rows (int): rows queued for sketching beyond which new
+        batches are dropped and counted
+    aggregate_interval_seconds (float): how often queued rows are added
+        to the sketches
+    """
+
+    def __init__(self, profile, report_interval_seconds=300, path=None,
+                 max_pending_rows=100000, aggregate_interval_seconds=1.0):
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._pending_rows = 0
+        self._max_pending_rows = max_pending_rows
+        self._path = path
+        self.dropped_rows = 0
+        self.last_report = None
+        self.set_profile(profile)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._loop, args=(
+                aggregate_interval_seconds, report_interval_seconds),
+            name="DriftMonitor", daemon=True)
+        self._thread.start()
+
+    def set_profile(self, profile):
+        """Starts over against a new training profile, e.g. a new model."""
+        with self._lock:
+            self.reference_counts = numpy.asarray(profile["bin_counts"])
+            self.reference_mean = numpy.asarray(profile["mean"])
+            self.reference_std = numpy.asarray(profile["std"])
+            self.window = FeatureSketch(profile["bin_edges"])
+            self.total = FeatureSketch(profile["bin_edges"])
+
+    def submit(self, data):
+        """
+        Queues scored rows for sketching, without blocking.
+
+        Return:
+        False if the rows were dropped because too many are queued.
+        """
+        with self._lock:
+            if self._pending_rows + len(data) > self._max_pending_rows:
+                self.dropped_rows += len(data)
+                return False
+            self._pending.append(data)
+            self._pending_rows += len(data)
+        return True
+
+    def aggregate(self):
+        """Adds the queued rows to the sketches."""
+        with self._lock:
+            batches = list(self._pending)
+            self._pending.clear()
+            self._pending_rows = 0
+        if not batches:
+            return
+        data = numpy.concatenate(
+            [numpy.asarray(batch, dtype=float) for batch in batches])
+        with self._lock:
+            self.window.update(data)
+            self.total.update(data)
+
+    def report(self):
+        """
+        Summarizes the drift of the rows scored since the last report,
+        and of all rows, then starts a new window.
+        """
+        self.aggregate()
+        with self._lock:
+            window = self.window
+            summary = {
+                "window_rows": window.n,
+                "total_rows": self.total.n,
+                "dropped_rows": self.dropped_rows,
+                "window": self._summarize(window),
+                "total": self._summarize(self.total),
+            }
+            self.window = FeatureSketch(window.bin_edges)
+            self.last_report = summary
+        return summary
+
+    def _summarize(self, sketch):
+        if not sketch.n:
+            return None
+        psi, ks = drift_statistics(sketch.counts, self.reference_counts)
+        std = sketch.std()
+        shift = (sketch.mean - self.reference_mean) / numpy.where(
+            self.reference_std > 0, self.reference_std, 1.0)
+        return {
+            "max_psi": float(psi.max()),
+            "max_ks": float(ks.max()),
+            "features": [
+                {"feature": i, "psi": float(psi[i]), "ks": float(ks[i]),
+                 "mean": float(sketch.mean[i]), "std": float(std[i]),
+                 "mean_shift_in_std": float(shift[i])}
+                for i in range(sketch.n_features)],
+        }
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def _loop(self, aggregate_interval, report_interval):
+        next_report = None if report_interval is None else \
+            time.monotonic() + report_interval
+        while not self._stopping.wait(aggregate_interval):
+            try:
+                self.aggregate()
+                if next_report is not None and \
+                        time.monotonic() >= next_report:
+                    next_report = time.monotonic() + report_interval
+                    self._write(self.report())
+            except Exception as e:
+                print("Drift monitoring failed: %s" % e, file=sys.stderr)
+
+    def _write(self, summary):
+        line = json.dumps({"DataDrift": summary})
+        if self._path is None:
+            print(line)
+        else:
+            with open(self._path, "a") as f:
+                f.write(line + "\n")
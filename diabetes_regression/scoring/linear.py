@@ -0,0 +1,85 @@
+"""
+linear.py
+
+Closed-form scoring of linear regression models. A fitted linear model
+reduces to a coefficient vector and an intercept, so predictions are a
+single dot product instead of a trip through the estimator's predict.
+
+score.py only takes this path when it agrees with model.predict on
+input_sample, within linear_fast_path_tolerance, and falls back to
+model.predict otherwise.
+"""
+import numpy
+from sklearn.base import is_regressor
+
+
+class LinearPredictor(object):
+    """
+    Scores rows as X @ coef + intercept.
+
+    Parameters:
+    coef (numpy.ndarray): coefficients, shape (n_features,) or
+        (n_targets, n_features)
+    intercept (float or numpy.ndarray): intercept per target
+    """
+
+    def __init__(self, coef, intercept):
+        coef = numpy.asarray(coef, dtype=numpy.float64)
+        # Store coefficients as (n_features,) or (n_features, n_targets)
+        # so that predict is a plain X @ coef.
+        self.coef = numpy.ascontiguousarray(coef.T)
+        self.intercept = numpy.asarray(intercept, dtype=numpy.float64)
+        self.n_features = self.coef.shape[0]
+
+    def predict(self, X):
+        X = numpy.asarray(X, dtype=numpy.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(
+                "X has shape {0}, expected (n_rows, {1})".format(
+                    X.shape, self.n_features))
+        return X @ self.coef + self.intercept
+
+
+def extract_linear_predictor(model):
+    """
+    Builds a LinearPredictor from a fitted scikit-learn linear regressor.
+
+    Parameters:
+    model: the loaded model object
+
+    Return:
+    A LinearPredictor, or None if the model is not a linear regressor.
+    """
+    if not is_regressor(model):
+        return None
+    coef = getattr(model, "coef_", None)
+    intercept = getattr(model, "intercept_", None)
+    if coef is None or intercept is None:
+        return None
+    coef = numpy.asarray(coef)
+    if coef.ndim not in (1, 2) or not numpy.issubdtype(
+            coef.dtype, numpy.number):
+        return None
+    return LinearPredictor(coef, intercept)
+
+
+def matches_model(predictor, model, sample, tolerance):
+    """
+    Checks that predictor agrees with model.predict on sample.
+
+    Parameters:
+    predictor (LinearPredictor): the fast path to check
+    model: the model it was extracted from
+    sample (numpy.ndarray): rows to compare predictions on
+    tolerance (float): maximal relative and absolute difference
+
+    Return:
+    True if all predictions agree within tolerance.
+    """
+    try:
+        fast = predictor.predict(sample)
+    except ValueError:
+        return False
+    expected = numpy.asarray(model.predict(sample))
+    return fast.shape == expected.shape and numpy.allclose(
+        fast, expected, rtol=tolerance, atol=tolerance)
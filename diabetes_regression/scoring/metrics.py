@@ -0,0 +1,351 @@
+"""
+metrics.py
+
+Latency and throughput instrumentation of the scoring service. Each
+phase of a request is timed into a fixed-memory log-linear histogram
+(HDR-style), cheap enough to stay on in production. Metrics are exported
+in the Prometheus text format, and as JSON.
+
+score.py dumps the JSON every metrics_dump_interval_seconds when it is
+set, to metrics_dump_path or stdout, and serves the Prometheus format at
+/metrics when metrics_port is set. Observations are folded in by a
+background aggregator; those it could not take before its queue filled
+up are counted in scoring_observations_dropped_total.
+"""
+import collections
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Histograms cover 2^-20 s (about 1 microsecond) to 2^8 s, with 32
+# sub-buckets per power of two, i.e. a relative error below 3%.
+_MIN_EXPONENT = -19
+_MAX_EXPONENT = 8
+_SUB_BUCKETS = 32
+_N_BUCKETS = (_MAX_EXPONENT - _MIN_EXPONENT + 1) * _SUB_BUCKETS
+
+# Bucket bounds, in seconds, of the exported Prometheus histograms.
+PROMETHEUS_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                     0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def _upper_bound(index):
+    exponent, sub_bucket = divmod(index, _SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub_bucket + 1) / (2.0 * _SUB_BUCKETS),
+                      exponent + _MIN_EXPONENT)
+
+
+_UPPER_BOUNDS = [_upper_bound(i) for i in range(_N_BUCKETS)]
+
+
+class LatencyHistogram(object):
+    """
+    Log-linear histogram of durations in seconds, in constant memory.
+
+    Not thread-safe on its own: ScoringMetrics serializes the updates.
+    """
+
+    def __init__(self):
+        self.counts = [0] * _N_BUCKETS
+        self.total = 0
+        self.sum = 0.0
+
+    def record(self, seconds):
+        if seconds > 0:
+            mantissa, exponent = math.frexp(seconds)
+            index = (exponent - _MIN_EXPONENT) * _SUB_BUCKETS + \
+                int((mantissa - 0.5) * 2 * _SUB_BUCKETS)
+            if index < 0:
+                index = 0
+            elif index >= _N_BUCKETS:
+                index = _N_BUCKETS - 1
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding quantile q."""
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                return _UPPER_BOUNDS[index]
+        return _UPPER_BOUNDS[-1]
+
+    def cumulative_counts(self, bounds):
+        """Returns the number of durations at most each of bounds."""
+        result = []
+        cumulative = 0
+        index = 0
+        counts = list(self.counts)
+        for bound in bounds:
+            while index < _N_BUCKETS and _UPPER_BOUNDS[index] <= bound:
+                cumulative += counts[index]
+                index += 1
+            result.append(cumulative)
+        return result
+
+
+class ScoringMetrics(object):
+    """
+    Per-phase latency histograms and request and row counters.
+
+    observe() only appends to a queue, which keeps its cost on the request
+    path well under a microsecond. Observations are folded into the
+    histograms by a background thread, from start() to stop(), and before
+    each export.
+
+    Parameters:
+    max_pending (int): observations kept while waiting to be folded in;
+        older ones are discarded beyond that, and counted as dropped
+    aggregate_interval_seconds (float): how often observations are folded
+        in by the background thread
+    """
+
+    def __init__(self, max_pending=100000, aggregate_interval_seconds=0.1):
+        self.phases = {}
+        self.requests = 0
+        self.rows = 0
+        self.dropped = 0
+        self.started = time.time()
+        self._gauges = {}
+        self._max_pending = max_pending
+        self._pending = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._dropped_lock = threading.Lock()
+        self._interval = aggregate_interval_seconds
+        self._stopping = threading.Event()
+        self._aggregator = None
+
+    def start(self):
+        """Starts the background thread, if it is not running yet."""
+        with self._lock:
+            if self._aggregator is not None:
+                return
+            self._stopping.clear()
+            self._aggregator = threading.Thread(
+                target=self._loop, name="ScoringMetrics", daemon=True)
+            self._aggregator.start()
+
+    def stop(self):
+        """Stops the background thread, folding in what is pending."""
+        with self._lock:
+            aggregator, self._aggregator = self._aggregator, None
+        if aggregator is not None:
+            self._stopping.set()
+            aggregator.join()
+        self.aggregate()
+
+    def observe(self, timings, n_rows):
+        """
+        Records one request.
+
+        Parameters:
+        timings (dict): phase name -> duration in seconds
+        n_rows (int): number of rows scored
+        """
+        if len(self._pending) >= self._max_pending:
+            # The aggregator fell behind: the append evicts the oldest
+            # observation.
+            with self._dropped_lock:
+                self.dropped += 1
+        self._pending.append((timings, n_rows))
+
+    def register_gauge(self, name, help_text, read, metric_type="gauge"):
+        """
+        Exports the value returned by read() under name, e.g. a queue
+        depth, read at each export. Registering a name again replaces it.
+        The name may carry Prometheus labels, e.g.
+        'scoring_version_requests_total{version="blue"}'; gauges of the
+        same metric share its help_text and metric_type.
+        """
+        self._gauges[name] = (help_text, read, metric_type)
+
+    def _read_gauges(self):
+        values = {}
+        for name, (help_text, read, metric_type) in sorted(
+                self._gauges.items()):
+            try:
+                values[name] = (help_text, float(read()), metric_type)
+            except Exception:
+                continue
+        return values
+
+    def aggregate(self):
+        """Folds pending observations into the histograms and counters."""
+        with self._lock:
+            pending = self._pending
+            while pending:
+                timings, n_rows = pending.popleft()
+                for phase, seconds in timings.items():
+                    histogram = self.phases.get(phase)
+                    if histogram is None:
+                        histogram = self.phases[phase] = LatencyHistogram()
+                    histogram.record(seconds)
+                self.requests += 1
+                self.rows += n_rows
+
+    def _loop(self):
+        while not self._stopping.wait(self._interval):
+            self.aggregate()
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        self.aggregate()
+        lines = [
+            "# HELP scoring_requests_total Scoring requests served.",
+            "# TYPE scoring_requests_total counter",
+            "scoring_requests_total %d" % self.requests,
+            "# HELP scoring_rows_total Rows scored.",
+            "# TYPE scoring_rows_total counter",
+            "scoring_rows_total %d" % self.rows,
+            "# HELP scoring_observations_dropped_total Requests left out "
+            "of the latency histograms, as the aggregator fell behind.",
+            "# TYPE scoring_observations_dropped_total counter",
+            "scoring_observations_dropped_total %d" % self.dropped,
+        ]
+        described = set()
+        for name, (help_text, value, metric_type) in \
+                self._read_gauges().items():
+            metric = name.split("{", 1)[0]
+            if metric not in described:
+                described.add(metric)
+                lines.extend(["# HELP %s %s" % (metric, help_text),
+                              "# TYPE %s %s" % (metric, metric_type)])
+            lines.append("%s %g" % (name, value))
+        lines.extend([
+            "# HELP scoring_phase_seconds Duration of each scoring phase.",
+            "# TYPE scoring_phase_seconds histogram",
+        ])
+        for phase, histogram in sorted(self.phases.items()):
+            counts = histogram.cumulative_counts(PROMETHEUS_BOUNDS)
+            for bound, count in zip(PROMETHEUS_BOUNDS, counts):
+                lines.append(
+                    'scoring_phase_seconds_bucket{phase="%s",le="%g"} %d'
+                    % (phase, bound, count))
+            lines.append(
+                'scoring_phase_seconds_bucket{phase="%s",le="+Inf"} %d'
+                % (phase, histogram.total))
+            lines.append('scoring_phase_seconds_sum{phase="%s"} %.9f'
+                         % (phase, histogram.sum))
+            lines.append('scoring_phase_seconds_count{phase="%s"} %d'
+                         % (phase, histogram.total))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Returns counters, throughput and latency quantiles."""
+        self.aggregate()
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "requests": self.requests,
+            "rows": self.rows,
+            "dropped_observations": self.dropped,
+            "requests_per_second": self.requests / elapsed,
+            "rows_per_second": self.rows / elapsed,
+            "phases_ms": {
+                phase: dict(
+                    count=histogram.total,
+                    mean=(histogram.sum / histogram.total * 1000.0
+                          if histogram.total else None),
+                    **{"p%g" % (q * 100): _to_ms(histogram.quantile(q))
+                       for q in QUANTILES})
+                for phase, histogram in sorted(self.phases.items())
+            },
+            "gauges": {name: value for name, (_, value, _)
+                       in self._read_gauges().items()},
+        }
+
+
+def _to_ms(seconds):
+    return None if seconds is None else seconds * 1000.0
+
+
+class MetricsDumper(object):
+    """
+    Periodically writes the metrics as a JSON line, to a file or stdout.
+
+    Parameters:
+    metrics (ScoringMetrics): the metrics to dump
+    interval_seconds (float): time between two dumps
+    path (str): file the JSON is appended to, stdout if None
+    """
+
+    def __init__(self, metrics, interval_seconds=60, path=None):
+        self._metrics = metrics
+        self._interval = interval_seconds
+        self._path = path
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._loop, name="MetricsDumper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def dump(self):
+        line = json.dumps({"ScoringMetrics": self._metrics.to_dict()})
+        if self._path is None:
+            print(line)
+        else:
+            with open(self._path, "a") as f:
+                f.write(line + "\n")
+
+    def _loop(self):
+        while not self._stopping.wait(self._interval):
+            try:
+                self.dump()
+            except Exception as e:
+                print("Metrics dump failed: %s" % e)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve_metrics(metrics, port, host="0.0.0.0"):
+    """
+    Serves GET /metrics (Prometheus) and GET /metrics.json from a
+    background thread.
+
+    Return:
+    The HTTP server, whose shutdown() method stops it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.to_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body = json.dumps(metrics.to_dict()).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(
+        target=server.serve_forever, name="MetricsServer",
+        daemon=True).start()
+    return server
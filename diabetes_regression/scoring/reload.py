@@ -0,0 +1,115 @@
+"""
+reload.py
+
+Background detection of new model versions for the scoring service, so
+that a new registered model can be served without restarting the
+container.
+
+score.py polls the model folder, or the version written in the pointer
+file of model_reload_pointer, loads a new version in the background,
+warms it up on input_sample and swaps it in. Requests in flight finish on
+the previous version. A version that fails to load or warm up is stopped
+while the previous one keeps serving, and is not tried again until the
+folder or pointer moves to another version.
+"""
+import os
+import threading
+
+
+def latest_version(models_dir):
+    """
+    Returns the highest numeric version folder in models_dir, e.g. "3"
+    for ./azureml-models/$MODEL_NAME holding the folders 1, 2 and 3.
+
+    Parameters:
+    models_dir (str): folder holding one subfolder per model version
+
+    Return:
+    The version as a string, or None if there is none.
+    """
+    try:
+        names = os.listdir(models_dir)
+    except FileNotFoundError:
+        return None
+    versions = [int(name) for name in names
+                if name.isdigit()
+                and os.path.isdir(os.path.join(models_dir, name))]
+    if not versions:
+        return None
+    return str(max(versions))
+
+
+def read_version_pointer(pointer_path):
+    """
+    Returns the model version written in the file pointer_path.
+
+    Parameters:
+    pointer_path (str): text file holding a model version
+
+    Return:
+    The version as a string, or None if the file is missing or empty.
+    """
+    try:
+        with open(pointer_path) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+class ModelWatcher(object):
+    """
+    Polls for a new model version on a background thread.
+
+    When resolve_version returns a version other than the one being
+    served, on_new_version is called with it. If that call raises, e.g.
+    because the new model failed its warm-up prediction, the current
+    version stays in service, and the failed version is not tried again
+    until another one is resolved in between.
+
+    Parameters:
+    resolve_version (callable): returns the version that should be served
+    on_new_version (callable): loads and swaps in the given version
+    current_version (str): the version being served
+    interval_seconds (float): time between two polls
+    """
+
+    def __init__(self, resolve_version, on_new_version, current_version,
+                 interval_seconds=30):
+        self._resolve_version = resolve_version
+        self._on_new_version = on_new_version
+        self.current_version = current_version
+        self.failed_version = None
+        self._interval = interval_seconds
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._loop, name="ModelWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def poll(self):
+        """Checks for a new version once, swapping it in if found."""
+        version = self._resolve_version()
+        if version is None or version == self.current_version:
+            self.failed_version = None
+            return False
+        if version == self.failed_version:
+            return False
+        try:
+            self._on_new_version(version)
+        except Exception:
+            self.failed_version = version
+            raise
+        self.current_version = version
+        self.failed_version = None
+        return True
+
+    def _loop(self):
+        while not self._stopping.wait(self._interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print("Model reload failed: %s" % e)
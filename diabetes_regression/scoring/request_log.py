@@ -0,0 +1,123 @@
+"""
+request_log.py
+
+Buffered, sampled structured logging for the scoring service. Records are
+appended to an in-memory buffer and written as JSON lines by a background
+thread, so that writing to stdout (and from there to Application
+Insights) never blocks a scoring thread. Records that arrive while the
+buffer is full are dropped and counted.
+"""
+import collections
+import json
+import random
+import sys
+import threading
+
+
+class RequestLogger(object):
+    """
+    Writes sampled request records in batches from a background thread.
+
+    When the buffer is full new records are dropped and counted rather
+    than waited for.
+
+    Parameters:
+    sample_rate (float): fraction of records kept, between 0 and 1
+    batch_size (int): maximal number of records per write
+    buffer_size (int): maximal number of records waiting to be written
+    flush_interval_seconds (float): longest time a record waits
+    stream: file-like object written to, stdout by default
+    """
+
+    def __init__(self, sample_rate=1.0, batch_size=100, buffer_size=10000,
+                 flush_interval_seconds=1.0, stream=None):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self._sample_rate = sample_rate
+        self._batch_size = batch_size
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval_seconds
+        self._stream = stream
+        self._buffer = collections.deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self.logged = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self._writer = threading.Thread(
+            target=self._loop, name="RequestLogger", daemon=True)
+        self._writer.start()
+
+    def sample(self):
+        """
+        Decides whether the current request is logged. Call this before
+        building its record, to skip that work for unsampled requests.
+        """
+        if self._sample_rate >= 1 or random.random() < self._sample_rate:
+            return True
+        with self._condition:
+            self.sampled_out += 1
+        return False
+
+    def log(self, record):
+        """
+        Queues a record (a JSON serializable dict) for writing.
+
+        Return:
+        False if the record was dropped because the buffer is full.
+        """
+        with self._condition:
+            if len(self._buffer) >= self._buffer_size:
+                self.dropped += 1
+                return False
+            self._buffer.append(record)
+            if len(self._buffer) >= self._batch_size:
+                self._condition.notify()
+        return True
+
+    def stop(self):
+        """Writes the buffered records and stops the background thread."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._writer.join()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "logged": self.logged,
+                "sampled_out": self.sampled_out,
+                "dropped": self.dropped,
+                "buffered": len(self._buffer),
+            }
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                if not self._stopping and \
+                        len(self._buffer) < self._batch_size:
+                    self._condition.wait(self._flush_interval)
+                batch = [self._buffer.popleft() for _ in range(
+                    min(self._batch_size, len(self._buffer)))]
+                stopping = self._stopping and not self._buffer
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(json.dumps(record))
+            except (TypeError, ValueError):
+                lines.append(json.dumps({"UnloggableRecord": repr(record)}))
+        stream = self._stream or sys.stdout
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except Exception as e:
+            print("Request logging failed: %s" % e, file=sys.stderr)
+            return
+        with self._condition:
+            self.logged += len(batch)
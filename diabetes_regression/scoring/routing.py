@@ -0,0 +1,82 @@
+"""
+routing.py
+
+In-process routing of scoring requests between several model versions,
+as an alternative to one deployment per version behind an Istio
+VirtualService (see charts/abtest-istio).
+
+A request is routed by its x-api-version header, or else by a weighted
+split of the versions. score.py exports the requests and rows routed to
+each version as scoring_version_requests_total and
+scoring_version_rows_total, labelled with the version.
+"""
+import random
+import threading
+
+
+class VersionRouter(object):
+    """
+    Picks the target serving each request.
+
+    A request whose routing header names a known label (e.g.
+    "x-api-version: blue") goes to that label's target. Other requests
+    are split at random between the labels according to their weights.
+
+    Parameters:
+    targets (dict): label -> target serving that label, e.g. a model
+    weights (dict): label -> relative share of unlabelled requests;
+        labels without a weight get none
+    header (str): name of the routing header, matched case-insensitively
+    rng (random.Random): optional source of randomness
+    """
+
+    def __init__(self, targets, weights, header="x-api-version", rng=None):
+        if not targets:
+            raise ValueError("At least one routing target is required")
+        unknown = set(weights) - set(targets)
+        if unknown:
+            raise ValueError(
+                "Weights for unknown labels: %s" % sorted(unknown))
+        self.targets = dict(targets)
+        self.header = header.lower()
+        self._labels = [label for label in targets if weights.get(label)]
+        self._weights = [weights[label] for label in self._labels]
+        if not self._labels:
+            raise ValueError("At least one label needs a positive weight")
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._counters = {label: {"requests": 0, "rows": 0}
+                          for label in targets}
+
+    @property
+    def default_label(self):
+        """The label receiving the largest share of unlabelled requests."""
+        return max(zip(self._weights, self._labels))[1]
+
+    def choose(self, request_headers):
+        """
+        Returns the (label, target) pair serving a request.
+
+        Parameters:
+        request_headers (dict): the request's HTTP headers
+        """
+        label = None
+        for name, value in (request_headers or {}).items():
+            if name.lower() == self.header:
+                label = value.strip()
+                break
+        if label not in self.targets:
+            label = self._rng.choices(self._labels, self._weights)[0]
+        return label, self.targets[label]
+
+    def record(self, label, n_rows):
+        with self._lock:
+            counters = self._counters[label]
+            counters["requests"] += 1
+            counters["rows"] += n_rows
+
+    def stats(self):
+        """Returns the request and row counters of each label."""
+        with self._lock:
+            return {label: dict(counters)
+                    for label, counters in self._counters.items()}
@@ -23,28 +23,404 @@ IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 ARISING IN ANY WAY OUT OF THE USE OF THE SOFTWARE CODE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
+import collections
+import functools
 import numpy
 import joblib
+import json
 import os
+import threading
+import time
 from azureml.core.model import Model
 from inference_schema.schema_decorators \
     import input_schema, output_schema
 from inference_schema.parameter_types.numpy_parameter_type \
     import NumpyParameterType
+from scoring.admission import AdmissionController, Overloaded
+from scoring.batching import MicroBatcher
+from scoring.cache import PredictionCache
+from scoring.capture import CaptureWriter
+from scoring.drift import DriftMonitor
+from scoring.linear import extract_linear_predictor, matches_model
+from scoring.metrics import MetricsDumper, ScoringMetrics, serve_metrics
+from scoring.request_log import RequestLogger
+from scoring.reload import ModelWatcher, latest_version, read_version_pointer
+from scoring.routing import VersionRouter
+from scoring.shadow import ShadowScorer
+from scoring.validation import FeatureValidator, load_profile
+from scoring.wire import decode_request, encode_response
+from scoring.workers import WorkerPool
+
+
+def load_scoring_config():
+    # The scoring section of config.json sits next to the scoring folder,
+    # and is optional: every setting has a default.
+    config_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        os.path.pardir, "config.json")
+    try:
+        with open(config_path) as f:
+            return json.load(f).get("scoring") or {}
+    except FileNotFoundError:
+        return {}
+
+
+# A model version ready to serve: the loaded model, the function scoring
+# rows with it, its optional request batcher, the profile of its training
+# features (or None), its optional input validator and its optional pool
+# of worker processes. Requests read the
+# global served model once, so that swapping in a new version does not
+# affect requests already in flight.
+ServedModel = collections.namedtuple(
+    "ServedModel",
+    ["version", "model", "predict", "batcher", "profile", "validator",
+     "workers"])
+
+# The outcome of scoring a batch: the predictions (NaN for rejected rows),
+# the model version that made them, the mask of the rows that passed
+# validation (None when all did) and the reasons the others were rejected.
+ScoredRows = collections.namedtuple(
+    "ScoredRows", ["result", "version", "valid", "rejected"])
+
+# The prediction cache and the model watcher outlive init(), so that the
+# cache can tell whether a different model version was loaded.
+cache = None
+watcher = None
+router = None
+shadow = None
+request_logger = None
+admission = None
+drift = None
+capture = None
+
+# Latency histograms and throughput counters of every request. Cheap
+# enough to stay on in production. Its background thread is started by
+# init().
+metrics = ScoringMetrics()
+metrics_dumper = None
+metrics_server = None
 
 
 def init():
     # load the model from file into a global object
     global model
+    global served
+    global scoring_config
+    global cache
+    global watcher
+    global router
+    global shadow
+    global request_logger
+    global metrics_dumper
+    global metrics_server
+    global admission
+    global drift
+    global capture
+
+    scoring_config = load_scoring_config()
+
+    # Optionally bound the requests scored at the same time, and reject
+    # early those that would miss their deadline (admission_deadline_header
+    # or admission_default_deadline_ms) rather than score them for callers
+    # that have timed out. The queue depth is exported as a scaling signal.
+    if scoring_config.get("admission_enabled", False):
+        admission = AdmissionController(
+            max_concurrency=scoring_config.get(
+                "admission_max_concurrency", 2),
+            max_queue=scoring_config.get("admission_max_queue", 16),
+            default_deadline_seconds=scoring_config.get(
+                "admission_default_deadline_ms", 5000) / 1000.0,
+            header=scoring_config.get(
+                "admission_deadline_header", "x-deadline-ms"))
+        controller = admission
+        metrics.register_gauge(
+            "scoring_queue_depth", "Requests waiting for a scoring slot.",
+            lambda: controller.stats()["queue_depth"])
+        metrics.register_gauge(
+            "scoring_in_flight", "Requests being scored.",
+            lambda: controller.stats()["in_flight"])
+        metrics.register_gauge(
+            "scoring_rejected_total", "Requests rejected as overloaded.",
+            lambda: controller.stats()["rejected"], metric_type="counter")
+    else:
+        admission = None
+
+    metrics.start()
+
+    # Optionally expose the metrics as a periodic JSON dump (to
+    # metrics_dump_path, or stdout) every metrics_dump_interval_seconds
+    # and, if metrics_port is set, over HTTP for Prometheus.
+    dump_interval = scoring_config.get("metrics_dump_interval_seconds", 0)
+    if dump_interval and metrics_dumper is None:
+        metrics_dumper = MetricsDumper(
+            metrics, interval_seconds=dump_interval,
+            path=scoring_config.get("metrics_dump_path") or None)
+    metrics_port = scoring_config.get("metrics_port", 0)
+    if metrics_port and metrics_server is None:
+        metrics_server = serve_metrics(metrics, metrics_port)
+
+    # Request records are written in batches by a background thread, so
+    # that logging never blocks scoring.
+    if request_logger is not None:
+        request_logger.stop()
+    request_logger = RequestLogger(
+        sample_rate=scoring_config.get("request_log_sample_rate", 1.0),
+        batch_size=scoring_config.get("request_log_batch_size", 100),
+        buffer_size=scoring_config.get("request_log_buffer_size", 10000),
+        flush_interval_seconds=scoring_config.get(
+            "request_log_flush_interval_seconds", 1.0))
+    model_dir = os.getenv("AZUREML_MODEL_DIR")
+    if scoring_config.get("routing_enabled", False):
+        # Several versions of the model are deployed together, and requests
+        # are routed between them. The most weighted one is the default.
+        router = load_router(scoring_config)
+        served = router.targets[router.default_label]
+        model_name = scoring_config["routing_model_name"]
+        register_router_counters(router)
+    else:
+        # we assume that we have just one model
+        # AZUREML_MODEL_DIR is an environment variable created during
+        # deployment. It is the path to the model folder
+        # (./azureml-models/$MODEL_NAME/$VERSION)
+        router = None
+        model_name = model_dir.split('/')[-2]
+        model_version = model_dir.split('/')[-1]
+        # Ask for this version explicitly: without a version the latest
+        # one deployed is loaded, e.g. a shadow or a newer model.
+        model_path = Model.get_model_path(
+            model_name, version=int(model_version))
+        served = load_model(model_path, model_version, scoring_config)
+    model = served.model
+
+    # Optionally cache predictions per row, for callers that re-score the
+    # same feature vectors. Only rows that miss the cache are scored.
+    if scoring_config.get("cache_enabled", False):
+        if cache is None:
+            cache = PredictionCache(
+                scoring_config.get("cache_max_bytes", 16 * 1024 * 1024),
+                ttl_seconds=scoring_config.get("cache_ttl_seconds", 300))
+        cache.set_model_version(served.version)
+    else:
+        cache = None
+
+    # Optionally watch for new model versions, either the highest version
+    # folder next to AZUREML_MODEL_DIR or the version written in a pointer
+    # file, and swap them in without restarting the container.
+    if scoring_config.get("model_reload_enabled", False) \
+            and router is None and watcher is None:
+        pointer = scoring_config.get("model_reload_pointer")
+        if pointer:
+            def resolve_version():
+                return read_version_pointer(pointer)
+        else:
+            models_dir = os.path.dirname(model_dir)
+
+            def resolve_version():
+                return latest_version(models_dir)
+        watcher = ModelWatcher(
+            resolve_version,
+            lambda version: reload_model(model_name, version),
+            model_version,
+            interval_seconds=scoring_config.get(
+                "model_reload_interval_seconds", 30))
+
+    # Optionally capture every scored batch, with its predictions, model
+    # version and request id, in a fixed-size memory-mapped ring buffer
+    # (capture_path, capture_max_bytes) for debugging and replay.
+    if scoring_config.get("capture_enabled", False):
+        if capture is None:
+            capture = CaptureWriter(
+                scoring_config.get("capture_path", "/tmp/scoring_capture.bin"),
+                max_bytes=scoring_config.get(
+                    "capture_max_bytes", 256 * 1024 * 1024))
+    elif capture is not None:
+        capture.close()
+        capture = None
+
+    # Optionally sketch the distribution of the scored features, and
+    # report their drift from the training data (PSI and KS on the bins of
+    # the model's feature profile) every drift_report_interval_seconds.
+    if drift is not None:
+        drift.stop()
+        drift = None
+    if scoring_config.get("drift_enabled", False):
+        if served.profile is not None and "bin_edges" in served.profile:
+            drift = DriftMonitor(
+                served.profile,
+                report_interval_seconds=scoring_config.get(
+                    "drift_report_interval_seconds", 300),
+                path=scoring_config.get("drift_report_path") or None,
+                max_pending_rows=scoring_config.get(
+                    "drift_max_pending_rows", 100000))
+            monitor = drift
+            metrics.register_gauge(
+                "scoring_drift_max_psi",
+                "Largest feature PSI of the last drift report.",
+                lambda: monitor.last_report["window"]["max_psi"])
+            metrics.register_gauge(
+                "scoring_drift_max_ks",
+                "Largest feature KS distance of the last drift report.",
+                lambda: monitor.last_report["window"]["max_ks"])
+        else:
+            print("No feature histogram in the profile of model version "
+                  "%s, drift is not monitored" % served.version)
+
+    # Optionally score requests again with a candidate model version, off
+    # the request path, to compare its predictions with the served ones.
+    if shadow is not None:
+        shadow.stop()
+        shadow = None
+    if scoring_config.get("shadow_enabled", False):
+        shadow_version = str(scoring_config["shadow_model_version"])
+        candidate = load_model(
+            Model.get_model_path(model_name, version=int(shadow_version)),
+            shadow_version,
+            dict(scoring_config, batching_enabled=False,
+                 workers_enabled=False))
+        shadow = ShadowScorer(
+            candidate.predict, shadow_version,
+            max_queue=scoring_config.get("shadow_queue_size", 100),
+            report_interval_seconds=scoring_config.get(
+                "shadow_report_interval_seconds", 60))
+
+
+def load_model(model_path, model_version, scoring_config):
+    # Memory-mapping the model's arrays lets worker processes on a node
+    # share their pages, and makes cold start independent of model size.
+    # This needs a model saved without joblib compression.
+    if scoring_config.get("model_mmap_enabled", False):
+        model = joblib.load(model_path, mmap_mode="r")
+    else:
+        model = joblib.load(model_path)
+
+    # Linear models are scored with a single dot product rather than
+    # through model.predict and its input checks, as long as both agree
+    # on input_sample.
+    predict = model.predict
+    if scoring_config.get("linear_fast_path_enabled", True):
+        linear = extract_linear_predictor(model)
+        tolerance = scoring_config.get("linear_fast_path_tolerance", 1e-6)
+        if linear is not None and matches_model(
+                linear, model, input_sample, tolerance):
+            predict = linear.predict
+        elif linear is not None:
+            print("Linear fast path disagrees with model.predict, "
+                  "falling back to model.predict")
+
+    # Optionally score in workers_processes worker processes (when null,
+    # one per CPU of the container's cpu limit) started from a fork server
+    # once the model is loaded, so that one container with several cores
+    # scores requests in parallel. The model's arrays and the request and
+    # response rows are shared with the workers, not copied. Raise cpu and
+    # maxConcurrentRequestsPerContainer in deployment_config_aks.yml to
+    # match.
+    workers = None
+    batcher = None
+    try:
+        if scoring_config.get("workers_enabled", False):
+            workers = WorkerPool(
+                predict, input_sample.shape[1],
+                processes=scoring_config.get("workers_processes"),
+                max_rows=scoring_config.get("workers_max_rows", 8192))
+            predict = workers.predict
+
+        # Optionally coalesce concurrent requests into a single predict
+        # call. This only pays off when the container accepts several
+        # concurrent requests (maxConcurrentRequestsPerContainer).
+        if scoring_config.get("batching_enabled", False):
+            batcher = MicroBatcher(
+                predict,
+                max_batch_size=scoring_config.get("batch_max_size", 64),
+                max_wait_ms=scoring_config.get("batch_max_wait_ms", 2))
+
+        # Optionally check each batch against the feature profile saved at
+        # training time. Rows with missing or out of range features get a
+        # reject reason rather than a prediction; the other rows are
+        # scored.
+        profile = load_profile(model, model_path)
+        validator = None
+        if scoring_config.get("validation_enabled", False):
+            if profile is not None:
+                validator = FeatureValidator(
+                    profile, range_tolerance=scoring_config.get(
+                        "validation_range_tolerance", 0.5))
+            else:
+                print("No feature profile found for model version %s, "
+                      "inputs are not validated" % model_version)
+    except Exception:
+        stop_model(ServedModel(model_version, model, predict, batcher, None,
+                               None, workers))
+        raise
+
+    return ServedModel(
+        model_version, model, predict, batcher, profile, validator, workers)
+
+
+def stop_model(served_model):
+    # Stops the background threads and processes of a served model.
+    if served_model.batcher is not None:
+        served_model.batcher.stop()
+    if served_model.workers is not None:
+        served_model.workers.stop()
+
 
-    # we assume that we have just one model
-    # AZUREML_MODEL_DIR is an environment variable created during deployment.
-    # It is the path to the model folder
-    # (./azureml-models/$MODEL_NAME/$VERSION)
-    model_path = Model.get_model_path(
-        os.getenv("AZUREML_MODEL_DIR").split('/')[-2])
+def register_router_counters(router):
+    # The requests and rows routed to each version are exported as
+    # counters labelled with the version.
+    for label in router.targets:
+        for counter, help_text in (
+                ("requests", "Scoring requests routed to each version."),
+                ("rows", "Rows scored by each version.")):
+            def read(label=label, counter=counter):
+                return router.stats()[label][counter]
 
-    model = joblib.load(model_path)
+            metrics.register_gauge(
+                'scoring_version_%s_total{version="%s"}' % (counter, label),
+                help_text, read, metric_type="counter")
+
+
+def load_router(scoring_config):
+    # In a deployment of several model versions AZUREML_MODEL_DIR is the
+    # ./azureml-models folder, so the model name comes from config.json.
+    # Each version gets its own batcher: a micro-batch holds requests for
+    # a single version and is scored in one call.
+    model_name = scoring_config["routing_model_name"]
+    targets = {}
+    for label, version in scoring_config["routing_versions"].items():
+        model_path = Model.get_model_path(model_name, version=int(version))
+        targets[label] = load_model(model_path, str(version), scoring_config)
+    weights = scoring_config.get("routing_weights") or \
+        {label: 1 for label in targets}
+    return VersionRouter(
+        targets, weights,
+        header=scoring_config.get("routing_header", "x-api-version"))
+
+
+def reload_model(model_name, model_version):
+    global model
+    global served
+
+    model_path = Model.get_model_path(model_name, version=int(model_version))
+    new = load_model(model_path, model_version, scoring_config)
+    # Warm up the new model before it serves requests. If this fails the
+    # previous version stays in service, and the new one is stopped.
+    try:
+        new.predict(input_sample)
+    except Exception:
+        stop_model(new)
+        raise
+
+    previous = served
+    served = new
+    model = new.model
+    if cache is not None:
+        cache.set_model_version(model_version)
+    if drift is not None and new.profile is not None \
+            and "bin_edges" in new.profile:
+        drift.set_profile(new.profile)
+    stop_model(previous)
+    print("Now serving model version %s (was %s)" % (
+        model_version, previous.version))
 
 
 input_sample = numpy.array([
@@ -55,14 +431,166 @@ output_sample = numpy.array([
     3693.645386402646])
 
 
+_request_timer = threading.local()
+
+
+def admitted(func):
+    # Outermost decorator of run(): admission control happens before
+    # inference_schema decodes the request, so that rejected requests
+    # cost next to nothing.
+    @functools.wraps(func)
+    def wrapper(data, request_headers):
+        if admission is None:
+            return func(data, request_headers)
+        try:
+            with admission.admit(request_headers):
+                return func(data, request_headers)
+        except Overloaded as e:
+            return overload_response(e)
+    return wrapper
+
+
+def overload_response(error):
+    # 503 with a Retry-After header, so that callers and load balancers
+    # back off. Without the AML response class (outside the scoring
+    # container) the error is raised to the caller instead.
+    try:
+        from azureml.contrib.services.aml_response import AMLResponse
+    except ImportError:
+        raise error
+    response = AMLResponse(json.dumps({
+        "error": "Overloaded: %s" % error,
+        "retry_after_ms": round(error.retry_after_seconds * 1000.0)}),
+        Overloaded.status_code)
+    response.headers["Retry-After"] = str(
+        max(1, int(numpy.ceil(error.retry_after_seconds))))
+    return response
+
+
+def timed(func):
+    # Applied inside admitted() and outside inference_schema: records when
+    # the request was admitted, so that run() can tell how long
+    # inference_schema took to decode it. Time spent waiting for
+    # admission is not part of it.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _request_timer.start = time.perf_counter()
+        return func(*args, **kwargs)
+    return wrapper
+
+
 # Inference_schema generates a schema for your web service
 # It then creates an OpenAPI (Swagger) specification for the web service
 # at http://<scoring_base_url>/swagger.json
+@admitted
+@timed
 @input_schema('data', NumpyParameterType(input_sample))
 @output_schema(NumpyParameterType(output_sample))
 def run(data, request_headers):
-    result = model.predict(data)
+    start = time.perf_counter()
+    scored_rows = score_rows(data, request_headers)
+    scored = time.perf_counter()
+    result = scored_rows.result.tolist()
+    if scored_rows.rejected:
+        for rejection in scored_rows.rejected:
+            result[rejection["row"]] = None
+        response = {"result": result, "rejected": scored_rows.rejected}
+    else:
+        response = {"result": result}
+    timings = {"decode": start - getattr(_request_timer, "start", start),
+               "predict": scored - start,
+               "serialize": time.perf_counter() - scored}
+    finish_request(data, scored_rows, request_headers, timings)
+    return response
+
+
+def run_binary(body, request_headers):
+    # Binary counterpart of run() for large batches. The request body is
+    # either raw little-endian float rows or an Arrow IPC stream, selected
+    # by the Content-Type header (see scoring/wire.py), and predictions
+    # are returned in the same format, skipping JSON entirely. Overloaded
+    # is raised to the front end when admission control rejects it.
+    # Only local_scoring_server.py calls it: the Azure ML front end only
+    # calls run(), and only with JSON bodies.
+    if admission is not None:
+        with admission.admit(request_headers):
+            return _run_binary(body, request_headers)
+    return _run_binary(body, request_headers)
+
+
+def _run_binary(body, request_headers):
+    start = time.perf_counter()
+    content_type = request_headers.get("Content-Type", "")
+    data = decode_request(body, content_type, input_sample.shape[1])
+    decoded = time.perf_counter()
+    scored_rows = score_rows(data, request_headers)
+    scored = time.perf_counter()
+    # Rejected rows are NaN in binary responses.
+    response = encode_response(scored_rows.result, content_type)
+    timings = {"decode": decoded - start,
+               "predict": scored - decoded,
+               "serialize": time.perf_counter() - scored}
+    finish_request(data, scored_rows, request_headers, timings)
+    return response
+
+
+def score_rows(data, request_headers=None):
+    # Returns the ScoredRows of data. The served model is read once: a
+    # version swapped in meanwhile only serves later requests.
+    if router is not None:
+        label, current = router.choose(request_headers)
+        router.record(label, len(data))
+    else:
+        current = served
+    valid, rejected = None, []
+    if current.validator is not None:
+        valid, rejected = current.validator.validate(data)
+    if valid is None:
+        return ScoredRows(predict_rows(current, data), current.version,
+                          None, [])
+    result = numpy.full(len(data), numpy.nan)
+    if valid.any():
+        result[valid] = predict_rows(current, data[valid])
+    return ScoredRows(result, current.version, valid, rejected)
 
+
+def predict_rows(current, data):
+    if current.batcher is not None:
+        predict = current.batcher.submit
+    else:
+        predict = current.predict
+    if cache is not None:
+        return cache.predict(data, predict, current.version)
+    return predict(data)
+
+
+def finish_request(data, scored_rows, request_headers, timings):
+    # Bookkeeping once the response is ready: metrics, request log,
+    # capture, and drift monitoring and shadow scoring of the rows that
+    # were scored.
+    metrics.observe(timings, len(scored_rows.result))
+    log_request(request_headers, scored_rows.result, scored_rows.version,
+                timings, len(scored_rows.rejected))
+    if capture is not None:
+        capture.append(data, scored_rows.result, scored_rows.version,
+                       request_headers.get("X-Ms-Request-Id", ""))
+    if shadow is None and drift is None:
+        return
+    if scored_rows.valid is None:
+        data, result = data, scored_rows.result
+    elif scored_rows.valid.any():
+        data = data[scored_rows.valid]
+        result = scored_rows.result[scored_rows.valid]
+    else:
+        return
+    if drift is not None:
+        drift.submit(data)
+    if shadow is not None:
+        shadow.submit(data, result)
+
+
+def log_request(request_headers, result, model_version, timings,
+                rejected_rows=0):
     # Demonstrate how we can log custom data into the Application Insights
     # traces collection.
     # The 'X-Ms-Request-id' value is generated internally and can be used to
@@ -70,16 +598,19 @@ def run(data, request_headers):
     # The HTTP 'traceparent' header may be set by the caller to implement
     # distributed tracing (per the W3C Trace Context proposed specification)
     # and can be used to correlate the request to external systems.
-    print(('{{"RequestId":"{0}", '
-           '"TraceParent":"{1}", '
-           '"NumberOfPredictions":{2}}}'
-           ).format(
-               request_headers.get("X-Ms-Request-Id", ""),
-               request_headers.get("Traceparent", ""),
-               len(result)
-    ))
-
-    return {"result": result.tolist()}
+    # Records are sampled (request_log_sample_rate) and written by a
+    # background thread; timings are in milliseconds.
+    if not request_logger.sample():
+        return
+    request_logger.log({
+        "RequestId": request_headers.get("X-Ms-Request-Id", ""),
+        "TraceParent": request_headers.get("Traceparent", ""),
+        "NumberOfPredictions": len(result),
+        "ModelVersion": model_version,
+        "RejectedRows": rejected_rows,
+        "TimingsMs": {phase: round(seconds * 1000.0, 3)
+                      for phase, seconds in timings.items()},
+    })
 
 
 if __name__ == "__main__":
@@ -88,3 +619,4 @@ if __name__ == "__main__":
     test_row = '{"data":[[1,2,3,4,5,6,7,8,9,10],[10,9,8,7,6,5,4,3,2,1]]}'
     prediction = run(test_row, {})
     print("Test result: ", prediction)
+    request_logger.stop()
@@ -0,0 +1,161 @@
+"""
+shadow.py
+
+Shadow scoring of a candidate model on live traffic. The inputs of
+scored requests are handed to a background thread that scores them again
+with the candidate, after the primary response has gone out, and keeps
+statistics of how far the candidate's predictions are from the primary
+ones: the mean, maximum and quantiles of their absolute difference, and
+the shadow latency. Work is dropped when the bounded queue is full.
+"""
+import json
+import queue
+import threading
+import time
+import numpy
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Reservoir(object):
+    """
+    Fixed-size uniform sample of a stream of values, used to estimate
+    quantiles in constant memory.
+
+    Parameters:
+    size (int): number of values kept
+    seed (int): optional random seed
+    """
+
+    def __init__(self, size=10000, seed=None):
+        self._values = numpy.empty(size)
+        self._rng = numpy.random.RandomState(seed)
+        self.seen = 0
+
+    def add(self, values):
+        values = numpy.ravel(values)
+        size = len(self._values)
+        filled = min(self.seen, size)
+        # Fill the free slots first, then replace kept values with the
+        # probability that keeps the sample uniform (Algorithm R).
+        direct = min(size - filled, len(values))
+        self._values[filled:filled + direct] = values[:direct]
+        rest = values[direct:]
+        if len(rest):
+            positions = self.seen + direct + numpy.arange(len(rest))
+            slots = (self._rng.random_sample(len(rest))
+                     * (positions + 1)).astype(numpy.int64)
+            keep = slots < size
+            self._values[slots[keep]] = rest[keep]
+        self.seen += len(values)
+
+    def quantiles(self, quantiles=QUANTILES):
+        kept = self._values[:min(self.seen, len(self._values))]
+        if not len(kept):
+            return {str(q): None for q in quantiles}
+        return dict(zip(
+            (str(q) for q in quantiles),
+            numpy.quantile(kept, quantiles).tolist()))
+
+
+class ShadowScorer(object):
+    """
+    Scores copies of primary requests with a candidate model.
+
+    Work is queued without blocking: when the queue is full the request is
+    dropped and counted, so that the shadow never slows the primary path.
+
+    Parameters:
+    predict (callable): scores a 2-D array with the candidate model
+    version (str): the candidate's model version, for reporting
+    max_queue (int): requests waiting to be shadowed before dropping
+    report_interval_seconds (float): how often a summary is printed, or
+        None to never print one
+    """
+
+    def __init__(self, predict, version, max_queue=100,
+                 report_interval_seconds=60):
+        self._predict = predict
+        self.version = version
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._report_interval = report_interval_seconds
+        self._lock = threading.Lock()
+        self._abs_diffs = Reservoir()
+        self._latencies = Reservoir()
+        self.requests = 0
+        self.rows = 0
+        self.dropped = 0
+        self.errors = 0
+        self._sum_abs_diff = 0.0
+        self._max_abs_diff = 0.0
+        self._worker = threading.Thread(
+            target=self._loop, name="ShadowScorer", daemon=True)
+        self._worker.start()
+
+    def submit(self, data, primary_result):
+        """
+        Queues data and the primary predictions for shadow scoring.
+
+        Return:
+        False if the request was dropped because the queue is full.
+        """
+        try:
+            self._queue.put_nowait((data, primary_result))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def stop(self):
+        """Stops the background thread once queued requests are scored."""
+        self._queue.put((None, None))
+        self._worker.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "shadow_version": self.version,
+                "requests": self.requests,
+                "rows": self.rows,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "mean_abs_diff": (self._sum_abs_diff / self.rows
+                                  if self.rows else None),
+                "max_abs_diff": self._max_abs_diff if self.rows else None,
+                "abs_diff_quantiles": self._abs_diffs.quantiles(),
+                "latency_ms_quantiles": self._latencies.quantiles(),
+            }
+
+    def _loop(self):
+        last_report = time.monotonic()
+        while True:
+            data, primary_result = self._queue.get()
+            if data is None:
+                return
+            self._score(data, primary_result)
+            if self._report_interval is not None and \
+                    time.monotonic() - last_report >= self._report_interval:
+                last_report = time.monotonic()
+                print(json.dumps({"ShadowScoring": self.stats()}))
+
+    def _score(self, data, primary_result):
+        start = time.perf_counter()
+        try:
+            result = numpy.asarray(self._predict(data))
+            abs_diff = numpy.abs(
+                result - numpy.asarray(primary_result)).ravel()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self.requests += 1
+            self.rows += len(abs_diff)
+            if len(abs_diff):
+                self._sum_abs_diff += float(abs_diff.sum())
+                self._max_abs_diff = max(
+                    self._max_abs_diff, float(abs_diff.max()))
+            self._abs_diffs.add(abs_diff)
+            self._latencies.add(latency_ms)
@@ -0,0 +1,104 @@
+import threading
+import time
+import pytest
+from diabetes_regression.scoring.admission import \
+    AdmissionController, Overloaded
+
+
+def test_deadline_header_overrides_default():
+    admission = AdmissionController(default_deadline_seconds=5.0)
+
+    assert admission.budget_seconds({"X-Deadline-Ms": "250"}) == 0.25
+    assert admission.budget_seconds({"X-Deadline-Ms": "soon"}) == 5.0
+    assert admission.budget_seconds(None) == 5.0
+
+
+def test_requests_within_capacity_are_admitted():
+    admission = AdmissionController(max_concurrency=2)
+
+    with admission.admit({}):
+        with admission.admit({}):
+            assert admission.stats()["in_flight"] == 2
+
+    stats = admission.stats()
+    assert stats["admitted"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["service_ms"] is not None
+
+
+def hold_slot(admission, entered, release):
+    with admission.admit({}):
+        entered.set()
+        release.wait()
+
+
+def test_full_queue_rejects_at_once():
+    admission = AdmissionController(max_concurrency=1, max_queue=0)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(
+        target=hold_slot, args=(admission, entered, release))
+    holder.start()
+    entered.wait()
+
+    with pytest.raises(Overloaded):
+        with admission.admit({}):
+            pass
+    release.set()
+    holder.join()
+
+    assert admission.stats()["rejected"] == 1
+
+
+def test_expected_wait_beyond_deadline_is_rejected():
+    admission = AdmissionController(max_concurrency=1)
+    admission._service_seconds = 1.0
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(
+        target=hold_slot, args=(admission, entered, release))
+    holder.start()
+    entered.wait()
+
+    start = time.monotonic()
+    with pytest.raises(Overloaded) as error:
+        with admission.admit({"x-deadline-ms": "500"}):
+            pass
+    release.set()
+    holder.join()
+
+    assert time.monotonic() - start < 0.1
+    assert error.value.retry_after_seconds > 0
+
+
+def test_queued_request_expires_at_its_deadline():
+    admission = AdmissionController(max_concurrency=1)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(
+        target=hold_slot, args=(admission, entered, release))
+    holder.start()
+    entered.wait()
+
+    with pytest.raises(Overloaded):
+        with admission.admit({"x-deadline-ms": "50"}):
+            pass
+    release.set()
+    holder.join()
+
+    stats = admission.stats()
+    assert stats["expired"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_queued_request_gets_a_freed_slot():
+    admission = AdmissionController(max_concurrency=1)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(
+        target=hold_slot, args=(admission, entered, release))
+    holder.start()
+    entered.wait()
+    threading.Timer(0.05, release.set).start()
+
+    with admission.admit({"x-deadline-ms": "2000"}):
+        pass
+    holder.join()
+
+    assert admission.stats()["admitted"] == 2
@@ -0,0 +1,141 @@
+import json
+import os
+import subprocess
+import sys
+import joblib
+import numpy
+import pandas
+import pytest
+from sklearn.datasets import load_diabetes
+from sklearn.linear_model import Ridge
+
+# batch_score.py imports its siblings as scoring.*, like score.py, so it
+# runs from the diabetes_regression folder.
+SOURCES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.path.pardir)
+
+
+def make_inputs(tmp_path):
+    X, y = load_diabetes(return_X_y=True)
+    model = Ridge(alpha=0.4).fit(X, y)
+    model_path = str(tmp_path / "model.pkl")
+    joblib.dump(model, model_path)
+    frame = pandas.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    frame.insert(0, "id", numpy.arange(len(frame)) * 10)
+    frame["Y"] = y
+    return model, model_path, frame
+
+
+def batch_score(model_path, input_path, output_dir, chunk_rows, *args):
+    return subprocess.run(
+        [sys.executable, "-m", "scoring.batch_score",
+         "--model_path", model_path, "--input", input_path,
+         "--output_dir", output_dir, "--id_columns", "id",
+         "--drop_columns", "Y", "--chunk_rows", str(chunk_rows),
+         "--processes", "2"] + list(args),
+        cwd=SOURCES_DIR, check=True, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def check_predictions(output_path, model, frame):
+    output = pandas.read_csv(output_path)
+    assert list(output.columns) == ["id", "prediction"]
+    numpy.testing.assert_array_equal(output["id"], frame["id"])
+    numpy.testing.assert_allclose(
+        output["prediction"], model.predict(frame.iloc[:, 1:11].values))
+
+
+def test_csv_is_scored_in_order(tmp_path):
+    model, model_path, frame = make_inputs(tmp_path)
+    input_path = str(tmp_path / "input.csv")
+    frame.to_csv(input_path, index=False)
+
+    stdout = batch_score(model_path, input_path, str(tmp_path / "out"), 50)
+
+    assert "Scored 442 rows in 9 chunks" in stdout
+    check_predictions(str(tmp_path / "out" / "predictions.csv"),
+                      model, frame)
+
+
+def test_parquet_is_scored_across_row_groups(tmp_path):
+    model, model_path, frame = make_inputs(tmp_path)
+    input_path = str(tmp_path / "input.parquet")
+    frame.to_parquet(input_path, index=False, row_group_size=70)
+
+    batch_score(model_path, input_path, str(tmp_path / "out"), 50)
+
+    check_predictions(str(tmp_path / "out" / "predictions.csv"),
+                      model, frame)
+
+
+def test_interrupted_job_resumes_after_last_committed_chunk(tmp_path):
+    model, model_path, frame = make_inputs(tmp_path)
+    input_path = str(tmp_path / "input.csv")
+    frame.to_csv(input_path, index=False)
+    output_path = str(tmp_path / "out" / "predictions.csv")
+    batch_score(model_path, input_path, str(tmp_path / "out"), 100)
+    with open(output_path, "rb") as f:
+        complete = f.read()
+
+    # Two chunks were committed, and part of a third written, when the
+    # job stopped.
+    committed = len(b"".join(complete.splitlines(True)[:201]))
+    with open(output_path, "wb") as f:
+        f.write(complete[:committed + 25])
+    with open(output_path + ".progress.json") as f:
+        progress = json.load(f)
+    progress.update(rows=200, bytes=committed)
+    with open(output_path + ".progress.json", "w") as f:
+        json.dump(progress, f)
+    stdout = batch_score(model_path, input_path, str(tmp_path / "out"), 100)
+
+    assert "Resuming after row 200" in stdout
+    assert "in 3 chunks" in stdout
+    with open(output_path, "rb") as f:
+        assert f.read() == complete
+
+
+def test_job_interrupted_in_a_pipeline_resumes_from_another_mount(tmp_path):
+    # The pipeline mounts the input at a new path on every run, and names
+    # it by its datastore path instead.
+    model, model_path, frame = make_inputs(tmp_path)
+    output_dir = str(tmp_path / "out")
+    broken = frame.astype(object)
+    broken.loc[250, "f3"] = "garbled"
+    os.makedirs(str(tmp_path / "mount1"))
+    broken.to_csv(str(tmp_path / "mount1" / "input.csv"), index=False)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        batch_score(model_path, str(tmp_path / "mount1" / "input.csv"),
+                    output_dir, 100, "--input_key", "data/input.csv")
+    with open(os.path.join(output_dir, "predictions.csv.progress.json")) \
+            as f:
+        assert json.load(f)["rows"] == 200
+
+    os.makedirs(str(tmp_path / "mount2"))
+    frame.to_csv(str(tmp_path / "mount2" / "input.csv"), index=False)
+    stdout = batch_score(model_path, str(tmp_path / "mount2" / "input.csv"),
+                         output_dir, 100, "--input_key", "data/input.csv")
+
+    assert "Resuming after row 200" in stdout
+    assert "in 3 chunks" in stdout
+    check_predictions(os.path.join(output_dir, "predictions.csv"),
+                      model, frame)
+
+
+def test_new_model_scores_the_input_again(tmp_path):
+    _, model_path, frame = make_inputs(tmp_path)
+    input_path = str(tmp_path / "input.csv")
+    frame.to_csv(input_path, index=False)
+    batch_score(model_path, input_path, str(tmp_path / "out"), 100)
+    new_model = Ridge(alpha=2.0).fit(frame.iloc[:, 1:11].values, frame["Y"])
+    new_model_path = str(tmp_path / "new_model.pkl")
+    joblib.dump(new_model, new_model_path)
+
+    stdout = batch_score(new_model_path, input_path, str(tmp_path / "out"),
+                         100)
+
+    assert "scoring it again" in stdout
+    assert "Scored 442 rows in 5 chunks" in stdout
+    check_predictions(str(tmp_path / "out" / "predictions.csv"),
+                      new_model, frame)
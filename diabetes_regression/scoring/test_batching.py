@@ -0,0 +1,86 @@
+import threading
+import numpy as np
+import pytest
+from diabetes_regression.scoring.batching import MicroBatcher
+
+
+class RecordingModel(object):
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, X):
+        X = np.asarray(X)
+        if X.shape[1] != 2:
+            raise ValueError("expected 2 features")
+        self.batch_sizes.append(len(X))
+        return X.sum(axis=1)
+
+
+def test_submit_returns_rows_in_order():
+    model = RecordingModel()
+    batcher = MicroBatcher(model.predict, max_batch_size=8, max_wait_ms=0)
+    try:
+        result = batcher.submit(np.array([[1, 2], [3, 4]]))
+    finally:
+        batcher.stop()
+    np.testing.assert_equal(result, [3, 7])
+
+
+def test_concurrent_requests_are_coalesced():
+    model = RecordingModel()
+    batcher = MicroBatcher(model.predict, max_batch_size=64, max_wait_ms=200)
+    results = {}
+
+    def call(i):
+        results[i] = batcher.submit(np.array([[i, i], [i, 0]]))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.stop()
+
+    for i in range(8):
+        np.testing.assert_equal(results[i], [2 * i, i])
+    assert sum(model.batch_sizes) == 16
+    assert len(model.batch_sizes) < 8
+
+
+def test_bad_request_only_fails_its_caller():
+    model = RecordingModel()
+    batcher = MicroBatcher(model.predict, max_batch_size=64, max_wait_ms=200)
+    outcomes = {}
+
+    def call(name, data):
+        try:
+            outcomes[name] = batcher.submit(data)
+        except ValueError as e:
+            outcomes[name] = e
+
+    good = threading.Thread(target=call, args=("good", np.ones((1, 2))))
+    bad = threading.Thread(target=call, args=("bad", np.ones((1, 3))))
+    good.start()
+    bad.start()
+    good.join()
+    bad.join()
+    batcher.stop()
+
+    np.testing.assert_equal(outcomes["good"], [2])
+    assert isinstance(outcomes["bad"], ValueError)
+
+
+def test_submit_after_stop_scores_directly():
+    model = RecordingModel()
+    batcher = MicroBatcher(model.predict, max_batch_size=8, max_wait_ms=0)
+    batcher.stop()
+
+    result = batcher.submit(np.array([[1, 2]]))
+
+    np.testing.assert_equal(result, [3])
+
+
+def test_invalid_settings_are_rejected():
+    with pytest.raises(ValueError):
+        MicroBatcher(len, max_batch_size=0)
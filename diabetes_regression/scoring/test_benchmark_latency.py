@@ -0,0 +1,39 @@
+import os
+from diabetes_regression.scoring.benchmark_latency import \
+    DEFAULT_MARGIN, compare, load_baseline, measure
+
+baseline = {"init_seconds": 0.1, "reference_seconds": 0.05,
+            "run_seconds": {"1": 0.001, "1000": 0.01}}
+
+
+def test_compare_accepts_timings_within_margin():
+    results = {"init_seconds": 0.14, "reference_seconds": 0.05,
+               "run_seconds": {"1": 0.0012, "1000": 0.0149}}
+
+    assert compare(results, baseline, margin=0.5, slack_seconds=0) == []
+
+
+def test_compare_flags_slower_timings():
+    results = {"init_seconds": 0.1, "reference_seconds": 0.05,
+               "run_seconds": {"1": 0.001, "1000": 0.02}}
+
+    regressions = compare(results, baseline, margin=0.5, slack_seconds=0)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("run() 1000 rows")
+
+
+def test_compare_scales_with_machine_speed():
+    # Twice as slow a machine: twice the baseline timings are expected.
+    results = {"init_seconds": 0.2, "reference_seconds": 0.1,
+               "run_seconds": {"1": 0.002, "1000": 0.02}}
+
+    assert compare(results, baseline, margin=0.1, slack_seconds=0) == []
+
+
+def test_scoring_latency_within_baseline():
+    margin = float(os.environ.get("SCORING_LATENCY_MARGIN", DEFAULT_MARGIN))
+
+    regressions = compare(measure(), load_baseline(), margin)
+
+    assert regressions == []
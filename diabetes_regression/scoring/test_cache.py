@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from unittest.mock import Mock
+from diabetes_regression.scoring.cache import PredictionCache
+
+
+def row_sums(X):
+    return np.asarray(X).sum(axis=1)
+
+
+def test_only_missing_rows_are_scored():
+    cache = PredictionCache(max_bytes=1 << 20)
+    cache.set_model_version("1")
+    predict = Mock(side_effect=row_sums)
+
+    cache.predict(np.array([[1.0, 2.0], [3.0, 4.0]]), predict)
+    result = cache.predict(np.array([[3.0, 4.0], [5.0, 6.0]]), predict)
+
+    np.testing.assert_equal(result, [7.0, 11.0])
+    np.testing.assert_equal(predict.call_args[0][0], [[5.0, 6.0]])
+    assert cache.hits == 1
+    assert cache.misses == 3
+
+
+def test_new_model_version_clears_the_cache():
+    cache = PredictionCache(max_bytes=1 << 20)
+    cache.set_model_version("1")
+    predict = Mock(side_effect=row_sums)
+    cache.predict(np.array([[1.0, 2.0]]), predict)
+
+    cache.set_model_version("1")
+    cache.predict(np.array([[1.0, 2.0]]), predict)
+    cache.set_model_version("2")
+    cache.predict(np.array([[1.0, 2.0]]), predict)
+
+    assert predict.call_count == 2
+    assert cache.stats()["model_version"] == "2"
+
+
+def test_other_model_version_bypasses_the_cache():
+    cache = PredictionCache(max_bytes=1 << 20)
+    cache.set_model_version("2")
+    predict = Mock(side_effect=row_sums)
+
+    cache.predict(np.array([[1.0, 2.0]]), predict, model_version="1")
+
+    assert cache.stats()["entries"] == 0
+    assert cache.misses == 0
+
+
+def test_size_bound_evicts_least_recently_used():
+    cache = PredictionCache(max_bytes=300)
+    predict = Mock(side_effect=row_sums)
+
+    for i in range(5):
+        cache.predict(np.array([[float(i), 0.0]]), predict)
+
+    stats = cache.stats()
+    assert stats["size_bytes"] <= 300
+    assert stats["evictions"] == 5 - stats["entries"]
+    cache.predict(np.array([[4.0, 0.0]]), predict)
+    assert cache.hits == 1
+
+
+def test_expired_entries_are_rescored():
+    cache = PredictionCache(max_bytes=1 << 20, ttl_seconds=0)
+    predict = Mock(side_effect=row_sums)
+
+    cache.predict(np.array([[1.0, 2.0]]), predict)
+    cache.predict(np.array([[1.0, 2.0]]), predict)
+
+    assert predict.call_count == 2
+
+
+def test_invalid_size_is_rejected():
+    with pytest.raises(ValueError):
+        PredictionCache(max_bytes=0)
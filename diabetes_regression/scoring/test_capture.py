@@ -0,0 +1,118 @@
+import struct
+import threading
+import time
+import numpy as np
+from diabetes_regression.scoring.capture import (
+    _HEADER, CaptureReader, CaptureWriter)
+
+
+def test_batches_round_trip(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path, max_bytes=4096)
+    data = np.arange(20.0).reshape(2, 10)
+
+    assert writer.append(data, [1.5, 2.5], "3", "request-1")
+    writer.close()
+    reader = CaptureReader(path)
+    batches = list(reader)
+    reader.close()
+
+    assert len(batches) == 1
+    assert batches[0].model_version == "3"
+    assert batches[0].request_id == "request-1"
+    np.testing.assert_equal(batches[0].data, data)
+    np.testing.assert_equal(batches[0].predictions, [1.5, 2.5])
+
+
+def test_ring_keeps_the_latest_batches(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path, max_bytes=8192)
+    rng = np.random.RandomState(0)
+    written = []
+
+    for i in range(500):
+        rows = rng.randint(1, 20)
+        data = np.full((rows, 3), float(i))
+        assert writer.append(data, np.full(rows, -float(i)), "1", str(i))
+        written.append(i)
+        reader = CaptureReader(path)
+        batches = list(reader)
+        reader.close()
+        seqs = [int(batch.request_id) for batch in batches]
+        # Consecutive batches, ending with the latest one
+        assert seqs == written[-len(seqs):]
+        assert len(seqs) == writer.count
+        assert all((batch.data == int(batch.request_id)).all()
+                   for batch in batches)
+    assert 5 < writer.count < 100
+    writer.close()
+
+
+def test_oversized_batch_is_dropped(tmp_path):
+    writer = CaptureWriter(str(tmp_path / "capture.bin"), max_bytes=1024)
+
+    assert not writer.append(np.zeros((100, 10)), np.zeros(100), "1")
+    writer.close()
+
+    assert writer.stats()["dropped"] == 1
+
+
+def test_torn_records_are_skipped(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path, max_bytes=4096)
+    ends = []
+    for i in range(3):
+        writer.append(np.full((2, 3), float(i)), [0.0, 0.0], "1", str(i))
+        ends.append(writer.head)
+    mm = writer._ring.mm
+
+    def read():
+        reader = CaptureReader(path)
+        request_ids = [batch.request_id for batch in reader]
+        reader.close()
+        return request_ids
+
+    # The data of the second record overwritten up to its trailer, as by
+    # a record written over it
+    trailer = _HEADER.size + ends[1] - 8
+    mm[trailer - 16:trailer + 8] = b"\xff" * 24
+    assert read() == ["0", "2"]
+    # The first two records evicted by a writer about to reuse their space
+    struct.pack_into("<Q", mm, _HEADER.size - 8, 2)
+    assert read() == ["2"]
+    writer.close()
+
+
+def test_batches_read_while_written_are_consistent(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path, max_bytes=4096)
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            rows = 1 + i % 7
+            writer.append(np.full((rows, 5), float(i)),
+                          np.full(rows, float(i)), "1", str(i))
+            i += 1
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        reader = CaptureReader(path)
+        deadline = time.time() + 2
+        reads = 0
+        while time.time() < deadline:
+            seqs = []
+            for batch in reader:
+                assert (batch.data == float(batch.request_id)).all()
+                assert (batch.predictions == batch.data[:, 0]).all()
+                seqs.append(batch.seq)
+            assert seqs == sorted(seqs)
+            reads += 1
+        reader.close()
+    finally:
+        stop.set()
+        thread.join()
+        writer.close()
+    assert reads > 0
@@ -0,0 +1,76 @@
+import json
+import numpy as np
+from diabetes_regression.scoring.drift import \
+    DriftMonitor, FeatureSketch, drift_statistics
+from diabetes_regression.training.train import build_feature_profile
+
+
+def test_sketch_running_moments_match_numpy():
+    data = np.random.RandomState(0).normal(size=(1000, 3))
+    sketch = FeatureSketch([[-1.0, 0.0, 1.0]] * 3)
+
+    for batch in np.array_split(data, 7):
+        sketch.update(batch)
+
+    assert sketch.n == 1000
+    np.testing.assert_allclose(sketch.mean, data.mean(axis=0))
+    np.testing.assert_allclose(sketch.std(), data.std(axis=0))
+    assert (sketch.counts.sum(axis=1) == 1000).all()
+
+
+def test_sketch_skips_rows_with_missing_values():
+    sketch = FeatureSketch([[0.0]])
+
+    sketch.update(np.array([[1.0], [np.nan]]))
+
+    assert sketch.n == 1
+    assert sketch.counts.tolist() == [[0, 1]]
+
+
+def test_drift_statistics():
+    reference = [[25, 25, 25, 25]]
+
+    psi, ks = drift_statistics([[50, 50, 50, 50]], reference)
+    assert psi[0] == 0
+    assert ks[0] == 0
+
+    psi, ks = drift_statistics([[0, 0, 50, 50]], reference)
+    assert psi[0] > 1
+    assert ks[0] == 0.5
+
+
+def test_monitor_reports_shifted_feature(tmp_path):
+    rng = np.random.RandomState(0)
+    training = rng.normal(size=(5000, 2))
+    path = str(tmp_path / "drift.json")
+    monitor = DriftMonitor(build_feature_profile(training), path=path,
+                           report_interval_seconds=None)
+    live = rng.normal(size=(2000, 2))
+    live[:, 1] += 1.0
+
+    for batch in np.array_split(live, 20):
+        monitor.submit(batch)
+    summary = monitor.report()
+    monitor._write(summary)
+    monitor.stop()
+
+    features = summary["window"]["features"]
+    assert summary["window_rows"] == 2000
+    assert features[0]["psi"] < 0.05
+    assert features[1]["psi"] > 0.5
+    assert 0.8 < features[1]["mean_shift_in_std"] < 1.2
+    assert monitor.report()["window_rows"] == 0
+    with open(path) as f:
+        assert json.loads(f.readline())["DataDrift"]["total_rows"] == 2000
+
+
+def test_monitor_drops_rows_beyond_pending_limit():
+    profile = build_feature_profile(np.arange(10.0).reshape(-1, 1))
+    monitor = DriftMonitor(profile, report_interval_seconds=None,
+                           max_pending_rows=5, aggregate_interval_seconds=60)
+
+    assert monitor.submit(np.zeros((4, 1)))
+    assert not monitor.submit(np.zeros((4, 1)))
+    monitor.stop()
+
+    assert monitor.dropped_rows == 4
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.tree import DecisionTreeRegressor
+from diabetes_regression.scoring.linear import (
+    extract_linear_predictor, matches_model)
+
+
+def make_data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(50, 4))
+    y = X @ np.array([1.0, -2.0, 0.5, 3.0]) + 7.0
+    return X, y
+
+
+def test_ridge_fast_path_matches_predict():
+    X, y = make_data()
+    reg = Ridge(alpha=0.4).fit(X, y)
+
+    predictor = extract_linear_predictor(reg)
+
+    assert predictor is not None
+    np.testing.assert_allclose(predictor.predict(X), reg.predict(X))
+    assert matches_model(predictor, reg, X[:2], 1e-9)
+
+
+def test_multi_target_fast_path_matches_predict():
+    X, y = make_data()
+    Y = np.column_stack([y, 2 * y])
+    reg = Ridge(alpha=0.4).fit(X, Y)
+
+    predictor = extract_linear_predictor(reg)
+
+    np.testing.assert_allclose(predictor.predict(X), reg.predict(X))
+
+
+def test_non_linear_models_have_no_fast_path():
+    X, y = make_data()
+    tree = DecisionTreeRegressor().fit(X, y)
+    classifier = LogisticRegression().fit(X, y > 7)
+
+    assert extract_linear_predictor(tree) is None
+    assert extract_linear_predictor(classifier) is None
+
+
+def test_wrong_feature_count_is_rejected():
+    X, y = make_data()
+    predictor = extract_linear_predictor(Ridge().fit(X, y))
+
+    with pytest.raises(ValueError):
+        predictor.predict(X[:, :3])
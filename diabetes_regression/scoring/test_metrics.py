@@ -0,0 +1,122 @@
+import json
+import time
+import urllib.request
+from diabetes_regression.scoring.metrics import (
+    LatencyHistogram, ScoringMetrics, serve_metrics)
+
+
+def test_histogram_quantiles_within_relative_error():
+    histogram = LatencyHistogram()
+    for _ in range(90):
+        histogram.record(0.001)
+    for _ in range(10):
+        histogram.record(0.1)
+
+    assert abs(histogram.quantile(0.5) - 0.001) < 0.001 * 0.04
+    assert abs(histogram.quantile(0.95) - 0.1) < 0.1 * 0.04
+    assert histogram.total == 100
+
+
+def test_histogram_clamps_out_of_range_values():
+    histogram = LatencyHistogram()
+    histogram.record(0.0)
+    histogram.record(1e-9)
+    histogram.record(1e6)
+
+    assert histogram.cumulative_counts([1e-6, 1.0, 1e3]) == [2, 2, 3]
+    assert histogram.total == 3
+
+
+def test_prometheus_export():
+    metrics = ScoringMetrics()
+    metrics.observe({"predict": 0.002, "serialize": 0.0002}, 10)
+    metrics.observe({"predict": 0.02, "serialize": 0.0002}, 5)
+
+    text = metrics.to_prometheus()
+
+    assert "scoring_requests_total 2" in text
+    assert "scoring_rows_total 15" in text
+    assert 'scoring_phase_seconds_bucket{phase="predict",le="0.005"} 1' \
+        in text
+    assert 'scoring_phase_seconds_bucket{phase="predict",le="+Inf"} 2' \
+        in text
+    assert 'scoring_phase_seconds_count{phase="serialize"} 2' in text
+
+
+def test_registered_gauges_are_exported():
+    metrics = ScoringMetrics()
+    depth = [3]
+    metrics.register_gauge("scoring_queue_depth", "Requests waiting.",
+                           lambda: depth[0])
+    depth[0] = 4
+
+    assert "# TYPE scoring_queue_depth gauge\nscoring_queue_depth 4" \
+        in metrics.to_prometheus()
+    assert metrics.to_dict()["gauges"] == {"scoring_queue_depth": 4.0}
+
+
+def test_labelled_gauges_share_their_description():
+    metrics = ScoringMetrics()
+    for version, count in (("blue", 2), ("green", 1)):
+        metrics.register_gauge(
+            'scoring_version_requests_total{version="%s"}' % version,
+            "Requests per version.", lambda count=count: count,
+            metric_type="counter")
+
+    text = metrics.to_prometheus()
+
+    assert "# HELP scoring_version_requests_total Requests per version.\n" \
+        "# TYPE scoring_version_requests_total counter\n" \
+        'scoring_version_requests_total{version="blue"} 2\n' \
+        'scoring_version_requests_total{version="green"} 1\n' in text
+
+
+def test_metrics_endpoint():
+    metrics = ScoringMetrics()
+    metrics.observe({"predict": 0.002}, 3)
+    server = serve_metrics(metrics, 0, host="127.0.0.1")
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    try:
+        text = urllib.request.urlopen(url + "/metrics").read().decode()
+        summary = json.loads(
+            urllib.request.urlopen(url + "/metrics.json").read().decode())
+    finally:
+        server.shutdown()
+
+    assert "scoring_rows_total 3" in text
+    assert summary["requests"] == 1
+    assert summary["phases_ms"]["predict"]["count"] == 1
+
+
+def test_observations_evicted_before_aggregation_are_counted():
+    metrics = ScoringMetrics(max_pending=3)
+    for _ in range(5):
+        metrics.observe({"predict": 0.001}, 1)
+
+    text = metrics.to_prometheus()
+
+    assert "scoring_observations_dropped_total 2" in text
+    assert "scoring_requests_total 3" in text
+    assert metrics.to_dict()["dropped_observations"] == 2
+
+
+def test_aggregator_thread_starts_on_demand():
+    metrics = ScoringMetrics(aggregate_interval_seconds=0.01)
+    assert metrics._aggregator is None
+    metrics.observe({"predict": 0.001}, 1)
+
+    metrics.start()
+    metrics.start()
+
+    deadline = time.time() + 5
+    while metrics.requests == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert metrics.requests == 1
+    aggregator = metrics._aggregator
+    assert aggregator.is_alive()
+
+    metrics.observe({"predict": 0.001}, 1)
+    metrics.stop()
+    assert not aggregator.is_alive()
+    assert metrics._aggregator is None
+    assert metrics.requests == 2
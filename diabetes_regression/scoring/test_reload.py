@@ -0,0 +1,76 @@
+import os
+import pytest
+from unittest.mock import Mock
+from diabetes_regression.scoring.reload import (
+    ModelWatcher, latest_version, read_version_pointer)
+
+
+def test_latest_version_picks_highest_numeric_folder(tmp_path):
+    for name in ["1", "2", "10", "tmp"]:
+        os.makedirs(os.path.join(str(tmp_path), name))
+    open(os.path.join(str(tmp_path), "11"), "w").close()
+
+    assert latest_version(str(tmp_path)) == "10"
+    assert latest_version(os.path.join(str(tmp_path), "missing")) is None
+
+
+def test_read_version_pointer(tmp_path):
+    pointer = os.path.join(str(tmp_path), "version")
+    assert read_version_pointer(pointer) is None
+
+    with open(pointer, "w") as f:
+        f.write("7\n")
+
+    assert read_version_pointer(pointer) == "7"
+
+
+def test_watcher_swaps_in_new_versions_only():
+    versions = iter(["1", "2", "2"])
+    on_new_version = Mock()
+    watcher = ModelWatcher(
+        lambda: next(versions), on_new_version, "1", interval_seconds=3600)
+    try:
+        assert not watcher.poll()
+        assert watcher.poll()
+        assert not watcher.poll()
+    finally:
+        watcher.stop()
+
+    on_new_version.assert_called_once_with("2")
+    assert watcher.current_version == "2"
+
+
+def test_failed_reload_keeps_current_version():
+    on_new_version = Mock(side_effect=ValueError("warm-up failed"))
+    watcher = ModelWatcher(
+        lambda: "2", on_new_version, "1", interval_seconds=3600)
+    try:
+        with pytest.raises(ValueError):
+            watcher.poll()
+    finally:
+        watcher.stop()
+
+    assert watcher.current_version == "1"
+
+
+def test_failed_version_is_not_retried_until_another_is_resolved():
+    versions = iter(["2", "2", "1", "2", "3"])
+    on_new_version = Mock(side_effect=[ValueError("warm-up failed"),
+                                       ValueError("warm-up failed"), None])
+    watcher = ModelWatcher(
+        lambda: next(versions), on_new_version, "1", interval_seconds=3600)
+    try:
+        with pytest.raises(ValueError):
+            watcher.poll()
+        assert not watcher.poll()
+        assert not watcher.poll()
+        # Back to the served version in between: "2" is tried again.
+        with pytest.raises(ValueError):
+            watcher.poll()
+        assert watcher.poll()
+    finally:
+        watcher.stop()
+
+    assert [c[0][0] for c in on_new_version.call_args_list] == \
+        ["2", "2", "3"]
+    assert watcher.current_version == "3"
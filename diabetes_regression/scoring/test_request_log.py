@@ -0,0 +1,46 @@
+import io
+import json
+import pytest
+from diabetes_regression.scoring.request_log import RequestLogger
+
+
+def test_records_are_written_as_json_lines():
+    stream = io.StringIO()
+    logger = RequestLogger(batch_size=2, stream=stream)
+
+    logger.log({"RequestId": "1"})
+    logger.log({"RequestId": "2"})
+    logger.log({"RequestId": "3"})
+    logger.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["RequestId"] for line in lines] == \
+        ["1", "2", "3"]
+    assert logger.stats()["logged"] == 3
+
+
+def test_full_buffer_drops_records():
+    stream = io.StringIO()
+    logger = RequestLogger(batch_size=100, buffer_size=2,
+                           flush_interval_seconds=3600, stream=stream)
+
+    accepted = [logger.log({"RequestId": str(i)}) for i in range(5)]
+    logger.stop()
+
+    assert accepted == [True, True, False, False, False]
+    assert logger.stats()["dropped"] == 3
+    assert len(stream.getvalue().splitlines()) == 2
+
+
+def test_sampling():
+    logger = RequestLogger(sample_rate=0.0, stream=io.StringIO())
+
+    assert not any(logger.sample() for _ in range(10))
+    logger.stop()
+
+    assert logger.stats()["sampled_out"] == 10
+
+
+def test_invalid_sample_rate_is_rejected():
+    with pytest.raises(ValueError):
+        RequestLogger(sample_rate=2)
@@ -0,0 +1,51 @@
+import random
+import pytest
+from diabetes_regression.scoring.routing import VersionRouter
+
+
+def make_router(weights):
+    return VersionRouter(
+        {"blue": "model 1", "green": "model 2"}, weights,
+        rng=random.Random(0))
+
+
+def test_header_selects_the_version():
+    router = make_router({"blue": 0, "green": 1})
+
+    label, target = router.choose({"X-Api-Version": "blue"})
+
+    assert (label, target) == ("blue", "model 1")
+
+
+def test_unknown_or_missing_header_uses_weights():
+    router = make_router({"blue": 0, "green": 1})
+
+    assert router.choose({"X-Api-Version": "red"})[0] == "green"
+    assert router.choose({})[0] == "green"
+    assert router.choose(None)[0] == "green"
+    assert router.default_label == "green"
+
+
+def test_weighted_split():
+    router = make_router({"blue": 1, "green": 3})
+
+    labels = [router.choose({})[0] for _ in range(4000)]
+
+    assert 800 < labels.count("blue") < 1200
+
+
+def test_counters_per_label():
+    router = make_router({"blue": 1, "green": 1})
+
+    router.record("blue", 2)
+    router.record("blue", 3)
+
+    assert router.stats() == {"blue": {"requests": 2, "rows": 5},
+                              "green": {"requests": 0, "rows": 0}}
+
+
+def test_invalid_weights_are_rejected():
+    with pytest.raises(ValueError):
+        make_router({"red": 1})
+    with pytest.raises(ValueError):
+        make_router({"blue": 0})
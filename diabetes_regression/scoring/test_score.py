@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+import joblib
+import numpy
+from sklearn.linear_model import Ridge
+from diabetes_regression.scoring.benchmark_cold_start import \
+    MODEL_NAME, make_model, prepare_app
+
+# score.py imports its siblings as scoring.*, so it runs in a fresh
+# process laid out like a deployed service (see benchmark_cold_start.py).
+_CHILD_HEADER = """
+import json, multiprocessing, os, sys, threading
+import numpy
+sys.path.insert(0, os.getcwd())
+from scoring import score
+"""
+
+
+def run_scoring(tmp_path, code, config=None, models=None):
+    """
+    Runs code after importing score.py in an app folder holding the
+    diabetes model as version 1, and the models of models (version ->
+    model) next to it. Returns the JSON the code prints last.
+    """
+    app_dir = str(tmp_path / "app")
+    os.makedirs(app_dir)
+    model_dir = prepare_app(app_dir, make_model(0), mmap_enabled=False)
+    config_path = os.path.join(app_dir, "config.json")
+    with open(config_path) as f:
+        full_config = json.load(f)
+    full_config["scoring"].update(config or {})
+    with open(config_path, "w") as f:
+        json.dump(full_config, f)
+    for version, model in (models or {}).items():
+        version_dir = os.path.join(app_dir, "azureml-models", MODEL_NAME,
+                                   str(version))
+        os.makedirs(version_dir)
+        joblib.dump(model, os.path.join(version_dir, MODEL_NAME))
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD_HEADER + code], cwd=app_dir,
+        env=dict(os.environ, AZUREML_MODEL_DIR=model_dir), check=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_failed_reloads_stop_the_new_model(tmp_path):
+    broken = Ridge().fit(numpy.ones((4, 5)), numpy.arange(4.0))
+
+    counts = run_scoring(tmp_path, """
+score.init()
+def counts():
+    return [len(multiprocessing.active_children()),
+            threading.active_count()]
+before = counts()
+failures = 0
+for _ in range(3):
+    try:
+        score.reload_model("%s", "2")
+    except Exception:
+        failures += 1
+print(json.dumps({"before": before, "after": counts(),
+                  "failures": failures,
+                  "version": score.served.version}))
+""" % MODEL_NAME, {"batching_enabled": True, "workers_enabled": True,
+                   "workers_processes": 2,
+                   "metrics_dump_interval_seconds": 0},
+        {2: broken})
+
+    assert counts["failures"] == 3
+    assert counts["after"] == counts["before"]
+    assert counts["before"][0] == 2
+    assert counts["version"] == "1"
+
+
+def test_memory_mapped_models_predict_like_loaded_ones(tmp_path):
+    rows = numpy.random.RandomState(0).uniform(-0.1, 0.1, (20, 10))
+    code = """
+score.init()
+rows = numpy.array(%s)
+print(json.dumps({
+    "mapped": isinstance(score.model.coef_, numpy.memmap),
+    "predictions": score.score_rows(rows).result.tolist(),
+    "model_predictions": score.model.predict(rows).tolist()}))
+""" % rows.tolist()
+    results = {}
+    for mmap_enabled in (False, True):
+        folder = tmp_path / str(mmap_enabled)
+        folder.mkdir()
+        results[mmap_enabled] = run_scoring(
+            folder, code, {"model_mmap_enabled": mmap_enabled,
+                           "metrics_dump_interval_seconds": 0})
+
+    assert results[True]["mapped"] and not results[False]["mapped"]
+    expected = make_model(0).predict(rows)
+    for result in results.values():
+        numpy.testing.assert_allclose(result["predictions"], expected)
+        numpy.testing.assert_allclose(result["model_predictions"], expected)
+
+
+def test_requests_routed_to_each_version_are_exported(tmp_path):
+    text = run_scoring(tmp_path, """
+score.init()
+rows = numpy.ones((3, 10))
+for version in ("blue", "blue", "green"):
+    score.score_rows(rows, {"x-api-version": version})
+print(json.dumps(score.metrics.to_prometheus()))
+""", {"routing_enabled": True, "routing_model_name": MODEL_NAME,
+      "routing_versions": {"blue": "1", "green": "2"},
+      "metrics_dump_interval_seconds": 0}, {2: make_model(0)})
+
+    assert 'scoring_version_requests_total{version="blue"} 2\n' in text
+    assert 'scoring_version_requests_total{version="green"} 1\n' in text
+    assert 'scoring_version_rows_total{version="blue"} 6\n' in text
+    assert text.count("# TYPE scoring_version_requests_total counter") == 1
@@ -0,0 +1,60 @@
+import threading
+import numpy as np
+from diabetes_regression.scoring.shadow import Reservoir, ShadowScorer
+
+
+def test_reservoir_keeps_a_bounded_uniform_sample():
+    reservoir = Reservoir(size=1000, seed=0)
+
+    for start in range(0, 100000, 1000):
+        reservoir.add(np.arange(start, start + 1000, dtype=float))
+
+    quantiles = reservoir.quantiles((0.5,))
+    assert reservoir.seen == 100000
+    assert 45000 < quantiles["0.5"] < 55000
+
+
+def test_empty_reservoir_has_no_quantiles():
+    assert Reservoir(size=10).quantiles((0.5,)) == {"0.5": None}
+
+
+def test_divergence_statistics():
+    shadow = ShadowScorer(lambda X: X.sum(axis=1) + 1.0, "2",
+                          report_interval_seconds=None)
+
+    shadow.submit(np.array([[1.0, 2.0], [3.0, 4.0]]), np.array([3.0, 5.0]))
+    shadow.stop()
+
+    stats = shadow.stats()
+    assert stats["requests"] == 1
+    assert stats["rows"] == 2
+    assert stats["mean_abs_diff"] == 2.0
+    assert stats["max_abs_diff"] == 3.0
+    assert stats["latency_ms_quantiles"]["0.5"] >= 0
+
+
+def test_full_queue_drops_work():
+    release = threading.Event()
+
+    def slow_predict(X):
+        release.wait()
+        return X.sum(axis=1)
+
+    shadow = ShadowScorer(slow_predict, "2", max_queue=1,
+                          report_interval_seconds=None)
+    data = np.ones((1, 2))
+    accepted = [shadow.submit(data, np.array([2.0])) for _ in range(5)]
+    release.set()
+    shadow.stop()
+
+    assert not all(accepted)
+    assert shadow.stats()["dropped"] == accepted.count(False)
+
+
+def test_shadow_errors_are_counted():
+    shadow = ShadowScorer(lambda X: 1 / 0, "2", report_interval_seconds=None)
+
+    shadow.submit(np.ones((1, 2)), np.array([2.0]))
+    shadow.stop()
+
+    assert shadow.stats()["errors"] == 1
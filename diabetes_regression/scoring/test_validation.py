@@ -0,0 +1,62 @@
+import json
+import numpy as np
+from sklearn.linear_model import Ridge
+from diabetes_regression.scoring.validation import \
+    FeatureValidator, load_profile
+
+profile = {"n_features": 2, "min": [0.0, -1.0], "max": [1.0, 1.0]}
+
+
+def test_valid_batch_has_no_rejections():
+    validator = FeatureValidator(profile, range_tolerance=0)
+
+    valid, rejected = validator.validate(np.array([[0.5, 0.0], [1.0, -1.0]]))
+
+    assert valid is None
+    assert rejected == []
+
+
+def test_bad_rows_get_reasons():
+    validator = FeatureValidator(profile, range_tolerance=0.5)
+    data = np.array([[0.5, 0.0], [np.nan, 0.0], [2.0, -2.5], [1.4, 1.9]])
+
+    valid, rejected = validator.validate(data)
+
+    np.testing.assert_equal(valid, [True, False, False, True])
+    assert [r["row"] for r in rejected] == [1, 2]
+    assert rejected[0]["reason"] == "missing value in feature 0"
+    assert "feature 0 above" in rejected[1]["reason"]
+    assert "feature 1 below" in rejected[1]["reason"]
+
+
+def test_bad_row_in_a_large_batch_is_found():
+    validator = FeatureValidator(profile)
+    data = np.zeros((10000, 2))
+    data[7777, 1] = np.inf
+
+    valid, rejected = validator.validate(data)
+
+    assert valid.sum() == 9999
+    assert rejected == [{"row": 7777, "reason": "missing value in feature 1"}]
+
+
+def test_wrong_feature_count_rejects_every_row():
+    validator = FeatureValidator(profile)
+
+    valid, rejected = validator.validate(np.zeros((2, 3)))
+
+    assert not valid.any()
+    assert rejected[1]["reason"] == "expected 2 features, got 3"
+
+
+def test_profile_pickled_with_model_or_saved_next_to_it(tmp_path):
+    model_path = str(tmp_path / "model.pkl")
+    model = Ridge()
+    assert load_profile(model, model_path) is None
+
+    with open(str(tmp_path / "model_profile.json"), "w") as f:
+        json.dump(profile, f)
+    assert load_profile(model, model_path) == profile
+
+    model.feature_profile_ = {"n_features": 5}
+    assert load_profile(model, model_path) == {"n_features": 5}
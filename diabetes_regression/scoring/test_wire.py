@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from diabetes_regression.scoring.wire import (
+    ARROW_CONTENT_TYPE, RAW_CONTENT_TYPE, decode_request, encode_response,
+    parse_content_type)
+
+
+def test_parse_content_type():
+    media_type, parameters = parse_content_type(
+        "Application/Octet-Stream; dtype=float32; cols=\"3\"")
+    assert media_type == RAW_CONTENT_TYPE
+    assert parameters == {"dtype": "float32", "cols": "3"}
+
+
+def test_raw_float64_round_trip():
+    rows = np.arange(20, dtype="<f8").reshape(2, 10)
+
+    data = decode_request(rows.tobytes(), RAW_CONTENT_TYPE, 10)
+    body, content_type = encode_response(data.sum(axis=1), RAW_CONTENT_TYPE)
+
+    np.testing.assert_equal(data, rows)
+    np.testing.assert_equal(np.frombuffer(body, "<f8"), [45, 145])
+    assert content_type == RAW_CONTENT_TYPE + "; dtype=float64"
+
+
+def test_raw_float32_with_explicit_columns():
+    rows = np.arange(6, dtype="<f4").reshape(3, 2)
+    content_type = RAW_CONTENT_TYPE + "; dtype=float32; cols=2"
+
+    data = decode_request(rows.tobytes(), content_type, 10)
+    body, _ = encode_response(np.array([1.5, 2.5, 3.5]), content_type)
+
+    np.testing.assert_equal(data, rows)
+    np.testing.assert_equal(np.frombuffer(body, "<f4"), [1.5, 2.5, 3.5])
+
+
+def test_raw_partial_row_is_rejected():
+    with pytest.raises(ValueError):
+        decode_request(b"\x00" * 12, RAW_CONTENT_TYPE, 10)
+
+
+def test_unsupported_content_type_is_rejected():
+    with pytest.raises(ValueError):
+        decode_request(b"", "text/csv", 10)
+
+
+def test_arrow_round_trip():
+    pyarrow = pytest.importorskip("pyarrow")
+    batch = pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array([1.0, 2.0]), pyarrow.array([3.0, 4.0])],
+        names=["a", "b"])
+    sink = pyarrow.BufferOutputStream()
+    writer = pyarrow.ipc.new_stream(sink, batch.schema)
+    writer.write_batch(batch)
+    writer.close()
+
+    data = decode_request(
+        sink.getvalue().to_pybytes(), ARROW_CONTENT_TYPE, 10)
+    body, _ = encode_response(data.sum(axis=1), ARROW_CONTENT_TYPE)
+    table = pyarrow.ipc.open_stream(body).read_all()
+
+    np.testing.assert_equal(data, [[1, 3], [2, 4]])
+    np.testing.assert_equal(table.column("result").to_numpy(), [4, 6])
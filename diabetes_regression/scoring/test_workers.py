@@ -0,0 +1,172 @@
+import os
+import signal
+import threading
+import numpy
+import pytest
+from diabetes_regression.scoring.linear import LinearPredictor
+from diabetes_regression.scoring import workers
+from diabetes_regression.scoring.workers import WorkerPool, shared_array
+
+
+def make_predictor(n_features=10):
+    rng = numpy.random.RandomState(0)
+    return LinearPredictor(rng.standard_normal(n_features), 1.5)
+
+
+# Workers are started by a fork server, so predict functions are
+# pickled: they are module-level functions here.
+def sum_or_fail(data):
+    if numpy.isnan(data).any():
+        raise ValueError("NaN in input")
+    if (data < 0).any():
+        os.kill(os.getpid(), signal.SIGKILL)
+    return data.sum(axis=1)
+
+
+def row_sums(data):
+    return data.sum(axis=1)
+
+
+def parent_pid(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        return int(f.read().rsplit(")", 1)[1].split()[1])
+
+
+def test_pool_matches_predict_across_chunks():
+    predictor = make_predictor()
+    expected_coef = predictor.coef.copy()
+    pool = WorkerPool(predictor.predict, 10, processes=2, max_rows=7)
+    try:
+        # The coefficients now live in shared memory, unchanged.
+        assert not predictor.coef.flags.writeable
+        numpy.testing.assert_array_equal(predictor.coef, expected_coef)
+        assert pool.stats()["shared_model_bytes"] > 0
+        rng = numpy.random.RandomState(1)
+        for n_rows in (1, 7, 8, 100):
+            data = rng.uniform(size=(n_rows, 10))
+            numpy.testing.assert_allclose(
+                pool.predict(data), data @ expected_coef + 1.5)
+    finally:
+        pool.stop()
+
+
+def test_concurrent_callers_share_the_workers():
+    predictor = make_predictor()
+    pool = WorkerPool(predictor.predict, 10, processes=2, max_rows=16)
+    rng = numpy.random.RandomState(2)
+    batches = [rng.uniform(size=(n, 10)) for n in (1, 40, 5, 100, 33, 2)]
+    results = [None] * len(batches)
+
+    def score(i):
+        for _ in range(20):
+            results[i] = pool.predict(batches[i])
+
+    threads = [threading.Thread(target=score, args=(i,))
+               for i in range(len(batches))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.stop()
+
+    for data, result in zip(batches, results):
+        numpy.testing.assert_allclose(result, predictor.predict(data))
+    assert pool.stats()["idle"] == 2
+
+
+def test_worker_errors_are_raised_and_crashed_workers_restarted():
+    pool = WorkerPool(sum_or_fail, 3, processes=1)
+    try:
+        with pytest.raises(RuntimeError, match="NaN in input"):
+            pool.predict(numpy.full((2, 3), numpy.nan))
+        with pytest.raises(RuntimeError, match="restarted"):
+            pool.predict(-numpy.ones((2, 3)))
+        assert pool.stats()["restarts"] == 1
+        numpy.testing.assert_allclose(
+            pool.predict(numpy.ones((2, 3))), [3.0, 3.0])
+    finally:
+        pool.stop()
+
+
+def test_stopped_pool_scores_in_process():
+    pool = WorkerPool(row_sums, 2, processes=1)
+    pool.stop()
+
+    numpy.testing.assert_allclose(pool.predict(numpy.ones((3, 2))), [2.0] * 3)
+    with pytest.raises(ValueError):
+        pool.predict(numpy.ones((3, 4)))
+
+
+def test_shared_array_is_shared_with_forked_processes():
+    array = shared_array(4)
+    pid = os.fork()
+    if pid == 0:
+        array[:] = 7.0
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    numpy.testing.assert_array_equal(array, [7.0] * 4)
+
+
+def test_workers_are_not_forked_from_the_scoring_process():
+    # The scoring process runs threads, whose locks a forked child could
+    # inherit held: workers come from a single-threaded fork server.
+    stopping = threading.Event()
+    busy = threading.Thread(target=stopping.wait)
+    busy.start()
+    pool = WorkerPool(row_sums, 2, processes=1)
+    try:
+        worker = pool._slots[0].process
+        assert parent_pid(worker.pid) != os.getpid()
+        numpy.testing.assert_allclose(
+            pool.predict(numpy.ones((3, 2))), [2.0] * 3)
+    finally:
+        pool.stop()
+        stopping.set()
+        busy.join()
+
+
+def test_shared_arrays_are_released_with_their_array():
+    array = shared_array((2, 3))
+    path = workers._shared[id(array)][1]
+    assert os.path.exists(path)
+
+    del array
+
+    assert not os.path.exists(path)
+
+
+def test_worker_count_follows_the_cgroup_cpu_quota(tmp_path):
+    v2 = tmp_path / "v2"
+    v2.mkdir()
+    (v2 / "cpu.max").write_text("150000 100000\n")
+    v1 = tmp_path / "v1"
+    (v1 / "cpu").mkdir(parents=True)
+    (v1 / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+    (v1 / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+
+    assert workers.cgroup_cpu_quota(str(v2)) == 1.5
+    assert workers.cgroup_cpu_quota(str(v1)) is None
+    assert workers.cgroup_cpu_quota(str(tmp_path)) is None
+    cpus = len(os.sched_getaffinity(0))
+    assert workers.available_cpus(str(v2)) == min(cpus, 2)
+    assert workers.available_cpus(str(v1)) == cpus
+    with pytest.raises(ValueError):
+        WorkerPool(row_sums, 3, processes=0)
+
+
+def test_arrays_larger_than_free_shared_memory_go_to_disk(tmp_path,
+                                                          monkeypatch):
+    # A tiny tmpfs-like folder: statvfs of tmp_path reports its file
+    # system, so the array is made larger than what is free there.
+    stats = os.statvfs(str(tmp_path))
+    monkeypatch.setattr(workers, "_SHM_DIR", str(tmp_path))
+
+    small = shared_array(16)
+    assert os.path.dirname(workers._shared[id(small)][1]) == str(tmp_path)
+    n_large = stats.f_bavail * stats.f_frsize // 8 + 1
+    large = shared_array(n_large)
+    path = workers._shared[id(large)][1]
+    assert os.path.dirname(path) != str(tmp_path)
+    large[-1] = 1.0
+    assert os.path.isfile(path)
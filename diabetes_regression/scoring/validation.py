@@ -0,0 +1,108 @@
+"""
+validation.py
+
+Checks scoring inputs against the feature profile saved at training time
+(see training/train.py): the number of features, and the range of each
+feature. A batch is checked with a couple of vectorized comparisons, and
+reasons are only worked out for the rows that fail, so that the check can
+run on every request.
+
+Rows with missing values, or with features beyond the training range
+widened by validation_range_tolerance, get a null prediction and a
+reason in the rejected list of the response; the other rows are scored.
+The check costs about as much as the linear fast path.
+"""
+import json
+import os
+import numpy
+
+# Rows per block of the fast check. The bounds are tiled to this many
+# rows, so that a block is checked with flat comparisons of contiguous
+# memory, which are several times faster than broadcasting the bounds
+# over short rows.
+_BLOCK_ROWS = 2048
+
+
+def load_profile(model, model_path):
+    """
+    Returns the feature profile of a model: the one pickled with it, or
+    else the one saved next to its file, or None.
+    """
+    profile = getattr(model, "feature_profile_", None)
+    if profile is not None:
+        return profile
+    path = os.path.splitext(model_path)[0] + "_profile.json"
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class FeatureValidator(object):
+    """
+    Flags rows with missing values or features out of the training range.
+
+    Parameters:
+    profile (dict): feature profile with n_features, min and max
+    range_tolerance (float): how far beyond the training range a feature
+        may go, as a fraction of that range
+    """
+
+    def __init__(self, profile, range_tolerance=0.5):
+        self.n_features = int(profile["n_features"])
+        low = numpy.asarray(profile["min"], dtype=float)
+        high = numpy.asarray(profile["max"], dtype=float)
+        margin = (high - low) * range_tolerance
+        self.low = low - margin
+        self.high = high + margin
+        self._low_block = numpy.tile(self.low, _BLOCK_ROWS)
+        self._high_block = numpy.tile(self.high, _BLOCK_ROWS)
+
+    def validate(self, data):
+        """
+        Checks a 2-D array of rows.
+
+        Return:
+        (valid, rejected): valid is None when all rows pass, or else a
+        boolean mask of the rows that do; rejected lists a
+        {"row": index, "reason": text} dict for each row that does not.
+        """
+        data = numpy.asarray(data)
+        if data.ndim != 2 or data.shape[1] != self.n_features:
+            shape = data.shape[1] if data.ndim == 2 else data.shape
+            return numpy.zeros(len(data), dtype=bool), [
+                {"row": row, "reason": "expected %d features, got %s" % (
+                    self.n_features, shape)}
+                for row in range(len(data))]
+        if self._all_in_range(data):
+            return None, []
+        # Some rows failed: find them, and why.
+        valid = ((data >= self.low) & (data <= self.high)).all(axis=1)
+        return valid, [{"row": int(row), "reason": self._reason(data[row])}
+                       for row in numpy.flatnonzero(~valid)]
+
+    def _all_in_range(self, data):
+        # NaN compares false, so missing values fail the check too.
+        flat = numpy.ravel(data)
+        step = len(self._low_block)
+        for start in range(0, len(flat), step):
+            block = flat[start:start + step]
+            n = len(block)
+            if not ((block >= self._low_block[:n]).all()
+                    and (block <= self._high_block[:n]).all()):
+                return False
+        return True
+
+    def _reason(self, row):
+        missing = numpy.flatnonzero(~numpy.isfinite(row))
+        if len(missing):
+            return "missing value in feature %s" % ", ".join(
+                str(i) for i in missing)
+        reasons = []
+        for i in numpy.flatnonzero(row < self.low):
+            reasons.append("feature %d below the training range "
+                           "(%.6g < %.6g)" % (i, row[i], self.low[i]))
+        for i in numpy.flatnonzero(row > self.high):
+            reasons.append("feature %d above the training range "
+                           "(%.6g > %.6g)" % (i, row[i], self.high[i]))
+        return "; ".join(reasons)
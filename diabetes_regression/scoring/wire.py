@@ -0,0 +1,142 @@
+"""
+wire.py
+
+Binary request/response formats for the scoring service, as an
+alternative to the JSON contract for large batches:
+
+- application/octet-stream: raw little-endian, row-major float64 values.
+  A "dtype=float32" content type parameter selects float32 instead, and
+  "cols=N" overrides the expected number of columns.
+- application/vnd.apache.arrow.stream: an Arrow IPC stream with one
+  column per feature. Requires pyarrow.
+
+Raw buffers are decoded with numpy.frombuffer, without creating a Python
+object per value, and predictions are returned in the request's format.
+
+These formats are served by run_binary in score.py, which only
+ml_service/util/local_scoring_server.py calls: Azure ML deployments
+serve the JSON contract of run() alone.
+"""
+import numpy
+
+RAW_CONTENT_TYPE = "application/octet-stream"
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+_RAW_DTYPES = {
+    "float64": numpy.dtype("<f8"),
+    "float32": numpy.dtype("<f4"),
+}
+
+
+def parse_content_type(content_type):
+    """
+    Splits a Content-Type header into its media type and parameters.
+
+    Parameters:
+    content_type (str): the header value, e.g.
+        "application/octet-stream; dtype=float32"
+
+    Return:
+    A (media_type, parameters) tuple, with the media type lower-cased.
+    """
+    parts = (content_type or "").split(";")
+    media_type = parts[0].strip().lower()
+    parameters = {}
+    for part in parts[1:]:
+        key, _, value = part.partition("=")
+        if key.strip():
+            parameters[key.strip().lower()] = value.strip().strip('"')
+    return media_type, parameters
+
+
+def is_binary(content_type):
+    media_type, _ = parse_content_type(content_type)
+    return media_type in (RAW_CONTENT_TYPE, ARROW_CONTENT_TYPE)
+
+
+def decode_request(body, content_type, n_features):
+    """
+    Decodes a binary request body into a 2-D array of rows.
+
+    Parameters:
+    body (bytes): the request body
+    content_type (str): the request Content-Type header
+    n_features (int): default number of columns per row
+
+    Return:
+    A numpy.ndarray of shape (n_rows, n_features). For raw bodies the
+    array is a read-only view of body.
+    """
+    media_type, parameters = parse_content_type(content_type)
+    if media_type == RAW_CONTENT_TYPE:
+        dtype = _raw_dtype(parameters)
+        n_cols = int(parameters.get("cols", n_features))
+        row_size = dtype.itemsize * n_cols
+        if n_cols < 1 or len(body) % row_size != 0:
+            raise ValueError(
+                "Body of {0} bytes is not a whole number of {1} rows of "
+                "{2} columns".format(len(body), dtype.name, n_cols))
+        return numpy.frombuffer(body, dtype=dtype).reshape(-1, n_cols)
+    if media_type == ARROW_CONTENT_TYPE:
+        return _decode_arrow(body)
+    raise ValueError("Unsupported content type: %s" % content_type)
+
+
+def encode_response(result, content_type):
+    """
+    Encodes predictions in the format of the request.
+
+    Parameters:
+    result (numpy.ndarray): the predictions
+    content_type (str): the request Content-Type header
+
+    Return:
+    A (body, content_type) tuple. Raw bodies are a memoryview on the
+    result array, not a copy of it, whenever its layout allows.
+    """
+    media_type, parameters = parse_content_type(content_type)
+    if media_type == RAW_CONTENT_TYPE:
+        dtype = _raw_dtype(parameters)
+        body = numpy.ascontiguousarray(result, dtype=dtype).data
+        return body, "%s; dtype=%s" % (RAW_CONTENT_TYPE, dtype.name)
+    if media_type == ARROW_CONTENT_TYPE:
+        return _encode_arrow(result), ARROW_CONTENT_TYPE
+    raise ValueError("Unsupported content type: %s" % content_type)
+
+
+def _raw_dtype(parameters):
+    name = parameters.get("dtype", "float64").lower()
+    try:
+        return _RAW_DTYPES[name]
+    except KeyError:
+        raise ValueError("Unsupported dtype: %s" % name)
+
+
+def _decode_arrow(body):
+    import pyarrow
+
+    table = pyarrow.ipc.open_stream(pyarrow.py_buffer(body)).read_all()
+    if table.num_columns == 0:
+        raise ValueError("Arrow stream has no columns")
+    # Columns without nulls and in a single chunk convert without a copy;
+    # the only copy is the transposition into row-major order.
+    columns = [column.to_numpy() for column in table.columns]
+    return numpy.column_stack(columns).astype(numpy.float64, copy=False)
+
+
+def _encode_arrow(result):
+    import pyarrow
+
+    result = numpy.asarray(result)
+    if result.ndim == 1:
+        names = ["result"]
+        arrays = [pyarrow.array(result)]
+    else:
+        names = ["result_%d" % i for i in range(result.shape[1])]
+        arrays = [pyarrow.array(result[:, i]) for i in range(result.shape[1])]
+    batch = pyarrow.RecordBatch.from_arrays(arrays, names=names)
+    sink = pyarrow.BufferOutputStream()
+    writer = pyarrow.ipc.new_stream(sink, batch.schema)
+    writer.write_batch(batch)
+    writer.close()
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,455 @@
+"""
+workers.py
+
+Multi-process scoring inside one container. A WorkerPool starts a fixed
+number of worker processes once the model is loaded, so that a container
+with several cores scores requests in parallel behind the single entry
+script. By default there is one worker per CPU the container may use:
+the CPU quota of its cgroup, i.e. the pod's cpu limit, rather than the
+cores of the node it runs on.
+
+Workers are forked by a multiprocessing fork server, a single-threaded
+process started from a fresh interpreter, not by the scoring process:
+that one runs threads (request logger, batcher, metrics), and a child
+forked from it could inherit a lock one of them held, and deadlock.
+
+Only references to the model's arrays are pickled: they are moved to
+shared memory before the workers start, and the workers map the same
+memory. Each worker also owns a slot of shared memory that request rows
+are copied into and predictions read back from. Only the number of rows
+goes through the worker's pipe.
+
+Shared memory lives in files in /dev/shm, which works on Python 3.7
+(multiprocessing.shared_memory needs 3.8). A file is removed once the
+array in the scoring process is garbage collected, or at exit; workers
+keep their mapping. Docker gives containers 64 MB of /dev/shm by
+default: an array that does not fit in what is free there goes to a file
+in the temporary folder instead, shared through the page cache all the
+same but written back to disk. Give the container more (docker run
+--shm-size, or a Kubernetes emptyDir volume with medium: Memory mounted
+on /dev/shm, see charts/abtest-model) to keep large models in memory.
+
+Batches are split into chunks of at most workers_max_rows rows, scored
+in parallel by the idle workers. Each call costs a few tens of
+microseconds of inter-process signalling, so workers pay off for batches
+that take longer than that to score, on as many cores as workers: raise
+cpu and maxConcurrentRequestsPerContainer in deployment_config_aks.yml to
+run fewer, larger pods. benchmark_workers.py reports throughput and
+latency against the number of workers.
+"""
+import atexit
+import io
+import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
+import struct
+import tempfile
+import threading
+import weakref
+import numpy
+
+_ROWS = struct.Struct("<q")
+
+_SHM_DIR = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+
+# id of each shared array of this process -> (weak reference, file path)
+_shared = {}
+_shm_warned = False
+
+_CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cgroup_cpu_quota(root=_CGROUP_ROOT):
+    """
+    Returns the CPU quota of this process's cgroup in CPUs, e.g. 1.5 for
+    a Kubernetes cpu limit of 1500m, None if there is none.
+    """
+    # cgroup v2 exposes "<quota> <period>", or "max <period>".
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    # cgroup v1 uses a quota of -1 for none.
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(cgroup_root=_CGROUP_ROOT):
+    """
+    Returns the number of CPUs this process may use: those it may run on,
+    capped by its cgroup's CPU quota rounded up.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = multiprocessing.cpu_count()
+    quota = cgroup_cpu_quota(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, max(1, int(math.ceil(quota))))
+    return cpus
+
+
+def shared_array(shape, dtype=numpy.float64):
+    """
+    Returns a zeroed array in shared memory, which pickles as a reference
+    to that memory for the workers of a WorkerPool.
+    """
+    dtype = numpy.dtype(dtype)
+    shape = tuple(shape) if isinstance(shape, (tuple, list)) \
+        else (int(shape),)
+    size = max(int(numpy.prod(shape)) * dtype.itemsize, 1)
+    fd, path = _create(size)
+    try:
+        # The array keeps a reference to the mapping.
+        array = numpy.ndarray(shape, dtype, mmap.mmap(fd, size))
+    except Exception:
+        _unlink(path)
+        raise
+    finally:
+        os.close(fd)
+    key = id(array)
+
+    def release(_):
+        _shared.pop(key, None)
+        _unlink(path)
+
+    _shared[key] = (weakref.ref(array, release), path)
+    return array
+
+
+def _create(size):
+    # Returns the descriptor and path of a new file of size bytes, in
+    # /dev/shm if they fit in it, else in the temporary folder. Pages in
+    # /dev/shm are allocated up front: files there are otherwise sparse,
+    # and running out of room would only show up as a SIGBUS when the
+    # array is first written.
+    global _shm_warned
+    if _SHM_DIR is not None:
+        try:
+            stats = os.statvfs(_SHM_DIR)
+            free = stats.f_bavail * stats.f_frsize
+        except OSError:
+            free = 0
+        if free >= size:
+            fd, path = tempfile.mkstemp(prefix="scoring-", dir=_SHM_DIR)
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return fd, path
+            except OSError:
+                os.close(fd)
+                _unlink(path)
+        if not _shm_warned:
+            _shm_warned = True
+            print("%s has less than %d bytes free, sharing scoring arrays "
+                  "through files in %s instead" % (
+                      _SHM_DIR, size, tempfile.gettempdir()))
+    fd, path = tempfile.mkstemp(prefix="scoring-")
+    try:
+        os.ftruncate(fd, size)
+    except OSError:
+        os.close(fd)
+        _unlink(path)
+        raise
+    return fd, path
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+@atexit.register
+def _release_all():
+    for _, path in list(_shared.values()):
+        _unlink(path)
+
+
+def _attach(path, shape, dtype, writeable):
+    # Maps a shared array of the scoring process, in a worker.
+    with open(path, "r+b") as f:
+        size = max(int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize, 1)
+        array = numpy.ndarray(shape, dtype, mmap.mmap(f.fileno(), size))
+    array.flags.writeable = writeable
+    return array
+
+
+class _Pickler(pickle.Pickler):
+    # Pickles shared arrays as references to their memory.
+
+    def persistent_id(self, obj):
+        if type(obj) is not numpy.ndarray:
+            return None
+        entry = _shared.get(id(obj))
+        if entry is None or entry[0]() is not obj:
+            return None
+        return (entry[1], obj.shape, obj.dtype.str,
+                bool(obj.flags.writeable))
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        return _attach(*pid)
+
+
+def _dumps(obj):
+    buffer = io.BytesIO()
+    _Pickler(buffer, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+
+def share_arrays(obj):
+    """
+    Moves the array attributes of obj, e.g. the coefficients of a model or
+    of a LinearPredictor, to shared memory, so that forked workers read
+    the same pages instead of copies. Memory-mapped arrays are already
+    shared through the page cache and are left alone.
+
+    Return:
+    The number of bytes moved.
+    """
+    moved = 0
+    for name, value in list(vars(obj).items()):
+        if not isinstance(value, numpy.ndarray) \
+                or isinstance(value, numpy.memmap) \
+                or value.dtype.hasobject:
+            continue
+        shared = shared_array(value.shape, value.dtype)
+        shared[...] = value
+        shared.flags.writeable = False
+        setattr(obj, name, shared)
+        moved += value.nbytes
+    return moved
+
+
+def _serve(payload, connection):
+    # Worker process: scores the rows written to its slot until an empty
+    # message asks it to stop.
+    predict, rows, predictions = _Unpickler(io.BytesIO(payload)).load()
+    while True:
+        try:
+            message = connection.recv_bytes()
+        except EOFError:
+            return
+        if not message:
+            return
+        n_rows = _ROWS.unpack(message)[0]
+        try:
+            predictions[:n_rows] = predict(rows[:n_rows])
+        except Exception as e:
+            connection.send_bytes(
+                ("%s: %s" % (type(e).__name__, e)).encode("utf-8"))
+        else:
+            connection.send_bytes(b"")
+
+
+class _Slot(object):
+
+    def __init__(self, index, n_features, max_rows):
+        self.index = index
+        self.rows = shared_array((max_rows, n_features))
+        self.predictions = shared_array(max_rows)
+        self.connection = None
+        self.process = None
+
+
+class WorkerPool(object):
+    """
+    Scores rows with a predict function in worker processes.
+
+    A call is split into chunks of at most max_rows rows, and chunks are
+    scored in parallel by the idle workers. Calls from several threads
+    share the workers; the calling threads wait on pipes and do not hold
+    the GIL while the workers score.
+
+    Parameters:
+    predict (callable): picklable function mapping a 2-D array to a 1-D
+        result. The arrays of the object it is bound to are moved to
+        shared memory; other arrays it refers to are copied into each
+        worker.
+    n_features (int): columns of the rows to score
+    processes (int): number of worker processes, available_cpus() by
+        default
+    max_rows (int): rows of each worker's shared buffer
+    """
+
+    def __init__(self, predict, n_features, processes=None, max_rows=8192):
+        if max_rows < 1:
+            raise ValueError("max_rows must be at least 1")
+        if processes is None:
+            processes = available_cpus()
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self.processes = processes
+        self.n_features = n_features
+        self.max_rows = max_rows
+        owner = getattr(predict, "__self__", None)
+        self.shared_bytes = share_arrays(owner) if owner is not None else 0
+        self._predict = predict
+        self._context = multiprocessing.get_context("forkserver")
+        # Imported once by the fork server, when the first pool starts it,
+        # rather than by each worker. Not __main__: in the scoring
+        # container that is the web server's launcher.
+        preload = [__name__]
+        if isinstance(getattr(predict, "__module__", None), str):
+            preload.append(predict.__module__)
+        self._context.set_forkserver_preload(preload)
+        self._slots = [_Slot(i, n_features, max_rows)
+                       for i in range(self.processes)]
+        self._free = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self.restarts = 0
+        for slot in self._slots:
+            self._start(slot)
+            self._free.put(slot)
+
+    def _start(self, slot):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(
+            target=_serve,
+            args=(_dumps((self._predict, slot.rows, slot.predictions)),
+                  child),
+            name="ScoringWorker-%d" % slot.index, daemon=True)
+        process.start()
+        # The worker holds the only other end, so that its exit shows up
+        # as EOF here.
+        child.close()
+        slot.connection = parent
+        slot.process = process
+
+    def predict(self, data):
+        """
+        Scores a 2-D array of rows.
+
+        Return:
+        The predictions for the rows in data, in order.
+
+        Raises:
+        ValueError if data does not have n_features columns, RuntimeError
+        if a worker failed.
+        """
+        data = numpy.asarray(data, dtype=numpy.float64)
+        if data.ndim != 2 or data.shape[1] != self.n_features:
+            raise ValueError(
+                "X has shape {0}, expected (n_rows, {1})".format(
+                    data.shape, self.n_features))
+        if self._stopped:
+            # A caller may still hold on to a pool that was stopped, e.g.
+            # when the model it scores with was swapped out.
+            return self._predict(data)
+        result = numpy.empty(len(data))
+        # Spread large calls over all workers, in chunks that fit a slot.
+        chunk = max(1, min(self.max_rows,
+                           -(-len(data) // self.processes)))
+        pending = []
+        error = None
+        try:
+            for start in range(0, len(data), chunk):
+                slot = self._acquire(pending, result)
+                rows = data[start:start + chunk]
+                if slot.connection is None:
+                    # The pool was stopped meanwhile.
+                    self._free.put(slot)
+                    result[start:start + len(rows)] = self._predict(rows)
+                    continue
+                slot.rows[:len(rows)] = rows
+                pending.append((slot, start, len(rows)))
+                try:
+                    slot.connection.send_bytes(_ROWS.pack(len(rows)))
+                except OSError:
+                    # The worker is gone: waiting for it restarts it.
+                    pass
+        finally:
+            # Collect every chunk sent, even after a failure, so that all
+            # slots go back to the pool.
+            while pending:
+                try:
+                    self._collect(pending.pop(0), result)
+                except RuntimeError as e:
+                    error = error or e
+        if error is not None:
+            raise error
+        return result
+
+    def _acquire(self, pending, result):
+        # Holding slots while blocking for more could deadlock with
+        # another caller doing the same: reuse our oldest slot instead.
+        if pending:
+            try:
+                return self._free.get_nowait()
+            except queue.Empty:
+                chunk = pending.pop(0)
+                try:
+                    self._wait(*chunk, result=result)
+                except RuntimeError:
+                    self._free.put(chunk[0])
+                    raise
+                return chunk[0]
+        return self._free.get()
+
+    def _collect(self, chunk, result):
+        slot = chunk[0]
+        try:
+            self._wait(*chunk, result=result)
+        finally:
+            self._free.put(slot)
+
+    def _wait(self, slot, start, n_rows, result):
+        try:
+            reply = slot.connection.recv_bytes()
+        except (EOFError, OSError):
+            slot.process.join(1)
+            exit_code = slot.process.exitcode
+            with self._lock:
+                self.restarts += 1
+                slot.connection.close()
+                self._start(slot)
+            raise RuntimeError(
+                "Scoring worker %d exited (exit code %s) and was "
+                "restarted" % (slot.index, exit_code))
+        if reply:
+            raise RuntimeError("Scoring worker %d failed: %s" % (
+                slot.index, reply.decode("utf-8")))
+        result[start:start + n_rows] = slot.predictions[:n_rows]
+
+    def stats(self):
+        return {"processes": self.processes, "restarts": self.restarts,
+                "idle": self._free.qsize(),
+                "shared_model_bytes": self.shared_bytes}
+
+    def stop(self):
+        """
+        Stops the workers once the calls in flight are done. Later calls
+        to predict score their data in the calling process.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        # Callers that got past the check above find the slots stopped
+        # once they are handed back, and score in their own process.
+        slots = [self._free.get() for _ in self._slots]
+        for slot in slots:
+            try:
+                slot.connection.send_bytes(b"")
+            except OSError:
+                pass
+            slot.process.join()
+            slot.connection.close()
+            slot.connection = slot.process = None
+        for slot in slots:
+            self._free.put(slot)
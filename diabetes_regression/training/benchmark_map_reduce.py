@@ -0,0 +1,123 @@
+"""
+benchmark_map_reduce.py
+
+Measures how distributed training scales with the number of workers: a
+synthetic dataset is written as a folder of Parquet (or CSV) files, and
+the map-reduce training of training_statistics.py runs on it with the
+local multiprocessing backend, from 1 to N worker processes. The
+pipeline runs the same map and reduce code in one step per shard, each
+on its own node.
+
+Usage:
+    python -m diabetes_regression.training.benchmark_map_reduce \\
+        --rows 2000000 --workers 1 2 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from unittest.mock import Mock
+import numpy as np
+import pandas as pd
+from diabetes_regression.training.training_statistics import \
+    train_streaming
+
+
+def make_dataset(folder, rows, features, files, file_format):
+    """Writes rows of a noisy linear target over files files."""
+    rng = np.random.RandomState(0)
+    coef = rng.standard_normal(features)
+    for part, part_rows in enumerate(np.array_split(np.arange(rows), files)):
+        X = rng.uniform(-0.1, 0.1, size=(len(part_rows), features))
+        df = pd.DataFrame(X, columns=["f%d" % i for i in range(features)])
+        df["Y"] = X @ coef * 100 + 150 + rng.standard_normal(len(X))
+        path = os.path.join(folder, "part%03d.%s" % (part, file_format))
+        if file_format == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+
+
+def measure(path, workers, chunk_rows):
+    start = time.perf_counter()
+    reg = train_streaming(Mock(), path, 0.4, chunk_rows, workers=workers)
+    return time.perf_counter() - start, reg
+
+
+def main():
+    cores = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser("benchmark_map_reduce")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=2000000,
+        help="rows of the synthetic dataset",
+    )
+    parser.add_argument(
+        "--features",
+        type=int,
+        default=10,
+        help="features of the synthetic dataset",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=16,
+        help="files the dataset is split into",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["parquet", "csv"],
+        default="parquet",
+        help="file format of the dataset",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, cores} | set(range(4, cores + 1, 4))),
+        help="worker process counts to measure",
+    )
+    parser.add_argument(
+        "--chunk_rows",
+        type=int,
+        default=100000,
+        help="rows read at a time by each worker",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="optional JSON file to write the results to",
+    )
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        make_dataset(folder, args.rows, args.features, args.files,
+                     args.format)
+        print("%d cores, %d rows x %d features in %d %s files" % (
+            cores, args.rows, args.features, args.files, args.format))
+        print("%8s %10s %14s %8s" % ("workers", "seconds", "rows/s",
+                                     "speedup"))
+        reference = None
+        for workers in args.workers:
+            seconds, reg = measure(folder, workers, args.chunk_rows)
+            if reference is None:
+                reference = (seconds, reg.coef_)
+            # Every worker count must train the same model.
+            np.testing.assert_allclose(reg.coef_, reference[1])
+            results.append({"workers": workers, "seconds": seconds,
+                            "rows_per_second": args.rows / seconds})
+            print("%8d %10.3f %14.0f %8.2f" % (
+                workers, seconds, args.rows / seconds,
+                reference[0] / seconds))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
 import numpy as np
+import pandas as pd
+import pytest
 from azureml.core.run import Run
 from unittest.mock import Mock
-from diabetes_regression.training.train import train_model
+from sklearn.datasets import load_diabetes
+from sklearn.linear_model import Ridge
+from diabetes_regression.training.train import \
+    load_previous_model, save_model, statistics_path, train_model
+from diabetes_regression.training.training_statistics import \
+    build_feature_profile, is_test_row, load_partial, parse_alphas, \
+    reduce_statistics, save_partial, shard_statistics, train_incremental, \
+    train_streaming
 
 
 def test_train_model():
@@ -25,3 +34,212 @@ def test_train_model():
 
     preds = reg.predict([[1], [2]])
     np.testing.assert_equal(preds, [9.93939393939394, 9.03030303030303])
+
+
+def test_train_model_sweeps_alphas():
+    X, y = load_diabetes(return_X_y=True)
+    data = {"train": {"X": X[:350], "y": y[:350]},
+            "test": {"X": X[350:], "y": y[350:]}}
+    alphas = parse_alphas({"min": 0.001, "max": 10, "num": 20})
+
+    run = Mock(Run)
+    reg = train_model(run, data, alpha=alphas)
+
+    (name, sweep), _ = run.log_table.call_args
+    assert name == "alpha_sweep"
+    assert sweep["alpha"] == alphas
+    best = int(np.argmin(sweep["mse"]))
+    assert reg.alpha == alphas[best]
+    for alpha, mse in zip(sweep["alpha"], sweep["mse"]):
+        expected = Ridge(alpha=alpha).fit(X[:350], y[:350])
+        np.testing.assert_allclose(
+            np.mean((expected.predict(X[350:]) - y[350:]) ** 2), mse)
+    expected = Ridge(alpha=reg.alpha).fit(X[:350], y[:350])
+    np.testing.assert_allclose(reg.coef_, expected.coef_)
+    np.testing.assert_allclose(reg.intercept_, expected.intercept_)
+
+
+def test_build_feature_profile():
+    X = np.array([[1.0, 10.0], [3.0, np.nan], [2.0, 30.0]])
+
+    profile = build_feature_profile(X)
+
+    assert profile["n_features"] == 2
+    assert profile["n_rows"] == 3
+    assert profile["min"] == [1.0, 10.0]
+    assert profile["max"] == [3.0, 30.0]
+    assert profile["mean"] == [2.0, 20.0]
+    assert len(profile["bin_edges"][0]) == 9
+    assert sum(profile["bin_counts"][0]) == 3
+    assert sum(profile["bin_counts"][1]) == 2
+
+
+def test_test_rows_do_not_depend_on_order():
+    X, y = load_diabetes(return_X_y=True)
+    order = np.random.RandomState(0).permutation(len(X))
+
+    test_rows = is_test_row(X, y)
+
+    np.testing.assert_array_equal(is_test_row(X[order], y[order]),
+                                  test_rows[order])
+    assert 0.15 < test_rows.mean() < 0.25
+
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet"])
+def test_train_streaming_matches_in_memory_fit(tmp_path, extension):
+    X, y = load_diabetes(return_X_y=True)
+    df = pd.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    df["Y"] = y
+    path = str(tmp_path / ("diabetes" + extension))
+    if extension == ".csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False, row_group_size=100)
+    # What the file reads back as, for the in-memory fit.
+    if extension == ".csv":
+        df = pd.read_csv(path)
+    X = df.drop("Y", axis=1).values
+    test_rows = is_test_row(X, y)
+
+    run = Mock(Run)
+    reg = train_streaming(run, path, alpha=0.4, chunk_rows=64)
+
+    expected = Ridge(alpha=0.4).fit(X[~test_rows], y[~test_rows])
+    np.testing.assert_allclose(reg.coef_, expected.coef_)
+    np.testing.assert_allclose(reg.intercept_, expected.intercept_)
+    name, mse = run.log.call_args_list[-1][0]
+    assert name == "mse"
+    np.testing.assert_allclose(
+        mse, np.mean((expected.predict(X[test_rows]) - y[test_rows]) ** 2))
+    profile = reg.feature_profile_
+    assert profile["n_rows"] == (~test_rows).sum()
+    np.testing.assert_allclose(profile["max"], X[~test_rows].max(axis=0))
+    np.testing.assert_allclose(profile["std"], X[~test_rows].std(axis=0))
+    assert sum(profile["bin_counts"][0]) == (~test_rows).sum()
+
+
+@pytest.mark.parametrize("layout", ["file", "folder"])
+def test_shards_reduce_to_the_whole(tmp_path, layout):
+    X, y = load_diabetes(return_X_y=True)
+    df = pd.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    df["Y"] = y
+    if layout == "file":
+        path = str(tmp_path / "diabetes.csv")
+        df.to_csv(path, index=False)
+    else:
+        path = str(tmp_path / "diabetes")
+        (tmp_path / "diabetes").mkdir()
+        for part in range(5):
+            df.iloc[part::5].to_parquet(
+                str(tmp_path / "diabetes" / ("part%d.parquet" % part)),
+                index=False)
+    whole, _, whole_profile = reduce_statistics(
+        [shard_statistics(path, chunk_rows=50)])
+
+    partials = []
+    for shard in range(3):
+        partial_path = str(tmp_path / ("partial_%d.npz" % shard))
+        save_partial(shard_statistics(path, shard, 3, chunk_rows=50),
+                     partial_path)
+        partials.append(load_partial(partial_path))
+    train, test, profile = reduce_statistics(partials)
+
+    assert train.n == whole.n
+    np.testing.assert_allclose(train.solve([0.4])[0], whole.solve([0.4])[0])
+    np.testing.assert_allclose(train.xx, whole.xx)
+    for key in ("n_rows", "min", "max", "bin_edges", "bin_counts"):
+        assert profile[key] == whole_profile[key]
+    np.testing.assert_allclose(profile["std"], whole_profile["std"])
+
+
+def test_train_streaming_in_worker_processes(tmp_path):
+    X, y = load_diabetes(return_X_y=True)
+    df = pd.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    df["Y"] = y
+    path = str(tmp_path / "diabetes.parquet")
+    df.to_parquet(path, index=False, row_group_size=50)
+
+    reg = train_streaming(Mock(Run), path, 0.4, chunk_rows=50, workers=2)
+
+    expected = train_streaming(Mock(Run), path, 0.4, chunk_rows=50)
+    np.testing.assert_allclose(reg.coef_, expected.coef_)
+    np.testing.assert_allclose(reg.intercept_, expected.intercept_)
+
+
+def test_incremental_training_matches_training_on_all_rows(tmp_path):
+    X, y = load_diabetes(return_X_y=True)
+    df = pd.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    df["Y"] = y
+    for name, rows in (("all", df), ("old", df[:300]), ("new", df[300:])):
+        rows.to_parquet(str(tmp_path / (name + ".parquet")), index=False)
+    model_path = str(tmp_path / "model.pkl")
+    save_model(train_streaming(Mock(Run), str(tmp_path / "old.parquet"),
+                               0.4), model_path)
+    previous = load_previous_model(model_path)
+
+    reg = train_incremental(Mock(Run), previous,
+                            str(tmp_path / "new.parquet"), 0.4)
+
+    expected = train_streaming(Mock(Run), str(tmp_path / "all.parquet"), 0.4)
+    np.testing.assert_allclose(reg.coef_, expected.coef_)
+    np.testing.assert_allclose(reg.intercept_, expected.intercept_)
+    with np.load(statistics_path(model_path)) as saved:
+        np.testing.assert_allclose(
+            saved["train_xx"], previous.training_statistics_["train_xx"])
+    profile = reg.feature_profile_
+    assert profile["n_rows"] == expected.feature_profile_["n_rows"]
+    assert profile["bin_edges"] == previous.feature_profile_["bin_edges"]
+    assert abs(sum(profile["bin_counts"][0]) - profile["n_rows"]) < 10
+    np.testing.assert_allclose(profile["std"],
+                               expected.feature_profile_["std"])
+
+
+def test_incremental_training_forgets_decayed_rows(tmp_path):
+    X, y = load_diabetes(return_X_y=True)
+    df = pd.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    df["Y"] = y
+    df[:300].to_parquet(str(tmp_path / "old.parquet"), index=False)
+    df[300:].to_parquet(str(tmp_path / "new.parquet"), index=False)
+    previous = train_streaming(Mock(Run), str(tmp_path / "old.parquet"), 0.4)
+    new = shard_statistics(str(tmp_path / "new.parquet"))
+
+    forgotten = train_incremental(Mock(Run), previous,
+                                  str(tmp_path / "new.parquet"), 0.4,
+                                  decay=0)
+    halved = train_incremental(Mock(Run), previous,
+                               str(tmp_path / "new.parquet"), 0.4, decay=0.5)
+
+    expected = train_streaming(Mock(Run), str(tmp_path / "new.parquet"), 0.4)
+    np.testing.assert_allclose(forgotten.coef_, expected.coef_)
+    assert forgotten.feature_profile_["n_rows"] == new["train_n"]
+    assert halved.feature_profile_["n_rows"] == round(
+        previous.feature_profile_["n_rows"] / 2 + new["train_n"])
+
+
+def test_incremental_training_skips_data_already_trained_on(tmp_path):
+    X, y = load_diabetes(return_X_y=True)
+    df = pd.DataFrame(X, columns=["f%d" % i for i in range(10)])
+    df["Y"] = y
+    (tmp_path / "new").mkdir()
+    df[:300].to_parquet(str(tmp_path / "old.parquet"), index=False)
+    df[300:].to_parquet(str(tmp_path / "new" / "a.parquet"), index=False)
+    previous = train_streaming(Mock(Run), str(tmp_path / "old.parquet"), 0.4)
+    once = train_incremental(Mock(Run), previous, str(tmp_path / "new"), 0.4)
+
+    # Neither the new rows, nor the rows of the first model, count twice.
+    twice = train_incremental(Mock(Run), once, str(tmp_path / "new"), 0.4)
+    old = train_incremental(Mock(Run), once, str(tmp_path / "old.parquet"),
+                            0.4, decay=0.5)
+
+    for reg in (twice, old):
+        for name, value in once.training_statistics_.items():
+            np.testing.assert_array_equal(reg.training_statistics_[name],
+                                          value)
+        np.testing.assert_allclose(reg.coef_, once.coef_)
+    assert len(once.training_statistics_["sources"]) == 2
+    # Files added to the folder since are the only ones read.
+    df[:50].to_parquet(str(tmp_path / "new" / "b.parquet"), index=False)
+    more = train_incremental(Mock(Run), twice, str(tmp_path / "new"), 0.4)
+    added = shard_statistics(str(tmp_path / "new" / "b.parquet"))
+    assert more.training_statistics_["train_n"] == (
+        once.training_statistics_["train_n"] + added["train_n"])
@@ -23,26 +23,122 @@ IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 ARISING IN ANY WAY OUT OF THE USE OF THE SOFTWARE CODE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
+from azureml.core.model import Model
 from azureml.core.run import Run
+from azureml.exceptions import WebserviceException
 import os
 import argparse
-from sklearn.linear_model import Ridge
-from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
 import joblib
 import json
+import numpy as np
+try:
+    # Run as a pipeline step, from the sources directory.
+    from training.training_statistics import \
+        RidgeStatistics, build_feature_profile, load_partial, save_partial, \
+        shard_statistics, train_from_statistics, train_incremental, \
+        train_on_partials, train_streaming
+except ImportError:
+    # Imported from the root of the repository, by the tests.
+    from diabetes_regression.training.training_statistics import \
+        RidgeStatistics, build_feature_profile, load_partial, save_partial, \
+        shard_statistics, train_from_statistics, train_incremental, \
+        train_on_partials, train_streaming
 
 
 def train_model(run, data, alpha):
-    run.log("alpha", alpha)
-    run.parent.log("alpha", alpha)
-    reg = Ridge(alpha=alpha)
-    reg.fit(data["train"]["X"], data["train"]["y"])
-    preds = reg.predict(data["test"]["X"])
-    run.log("mse", mean_squared_error(
-        preds, data["test"]["y"]), description="Mean squared error metric")
-    run.parent.log("mse", mean_squared_error(
-        preds, data["test"]["y"]), description="Mean squared error metric")
+    # alpha is a single value or a list of them. All of them are fitted
+    # from one decomposition of the training data, each one's test MSE is
+    # logged in the alpha_sweep table, and the model with the lowest one
+    # is returned, its alpha and MSE logged as alpha and mse.
+    return train_from_statistics(
+        run,
+        RidgeStatistics.from_arrays(data["train"]["X"], data["train"]["y"]),
+        RidgeStatistics.from_arrays(data["test"]["X"], data["test"]["y"]),
+        alpha)
+
+
+def load_previous_model(path):
+    # The model incremental training starts from, None if it predates
+    # the pickling of training statistics with the model.
+    previous = joblib.load(path)
+    if getattr(previous, "training_statistics_", None) is None:
+        print("%s holds no training statistics" % path)
+        return None
+    return previous
+
+
+def download_previous_model(run, model_name):
+    # Downloads the latest registered version of the model, returning
+    # its path, or None if there is none yet.
+    try:
+        model = Model(run.experiment.workspace, name=model_name)
+    except WebserviceException:
+        print("No registered model %s to train from" % model_name)
+        return None
+    print("Training from %s version %s" % (model_name, model.version))
+    return model.download(target_dir="previous_model", exist_ok=True)
+
+
+def profile_path(model_path):
+    # The feature profile is saved next to the model file.
+    return os.path.splitext(model_path)[0] + "_profile.json"
+
+
+def statistics_path(model_path):
+    # So are the training statistics, also pickled with it.
+    return os.path.splitext(model_path)[0] + "_statistics.npz"
+
+
+def save_model(reg, model_path):
+    joblib.dump(value=reg, filename=model_path)
+    with open(profile_path(model_path), "w") as f:
+        json.dump(reg.feature_profile_, f, indent=2)
+    np.savez(statistics_path(model_path), **reg.training_statistics_)
+
+
+def open_dataset_cache(config):
+    # The local dataset cache of the training section of config.json,
+    # None unless dataset_cache_enabled is set.
+    if not config.get("dataset_cache_enabled", False):
+        return None
+    from util.dataset_cache import DatasetCache, DEFAULT_MAX_BYTES
+    return DatasetCache(
+        config.get("dataset_cache_dir") or None,
+        config.get("dataset_cache_max_bytes", DEFAULT_MAX_BYTES))
+
+
+def load_training_dataset(run, cache=None):
+    # Get the dataset
+    dataset = run.input_datasets['training_data']
+    if (dataset):
+        if cache is not None and dataset.name is not None:
+            # A registered version of a dataset is keyed on its id, new
+            # data only being picked up by registering a new version.
+            cached = cache.load(dataset.name, dataset.version, dataset.id,
+                                dataset.to_pandas_dataframe, label='Y')
+            return cached.X, cached.y
+        df = dataset.to_pandas_dataframe()
+        X = df.drop('Y', axis=1).values
+        y = df['Y'].values
+    else:
+        e = ("No dataset provided")
+        print(e)
+        raise Exception(e)
+    return X, y
+
+
+def train_in_memory(run, alpha, cache=None):
+    X, y = load_training_dataset(run, cache)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=0)
+    data = {"train": {"X": X_train, "y": y_train},
+            "test": {"X": X_test, "y": y_test}}
+
+    reg = train_model(run, data, alpha)
+    # The profile is pickled with the model, so that it follows it through
+    # registration and deployment, and saved as JSON for inspection.
+    reg.feature_profile_ = build_feature_profile(X_train)
     return reg
 
 
@@ -68,11 +164,63 @@ def main():
         help=("output for passing data to next step")
     )
 
+    parser.add_argument(
+        "--data_file",
+        type=str,
+        help=("CSV or Parquet file, or folder of them, to train on in "
+              "chunks, instead of loading the training_data dataset in "
+              "memory")
+    )
+
+    parser.add_argument(
+        "--shard",
+        type=int,
+        help=("map step of distributed training: only compute the partial "
+              "statistics of this shard of data_file into step_output")
+    )
+
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=1,
+        help=("number of shards data_file is split into")
+    )
+
+    parser.add_argument(
+        "--partials",
+        type=str,
+        nargs="+",
+        help=("reduce step of distributed training: train on the partial "
+              "statistics written by the map steps to these folders")
+    )
+
+    parser.add_argument(
+        "--new_data",
+        type=str,
+        help=("incremental training: CSV or Parquet file, or folder of "
+              "them, of rows added since the previous model was trained, "
+              "to retrain it with")
+    )
+
+    parser.add_argument(
+        "--previous_model",
+        type=str,
+        help=("model file new_data retrains, instead of the latest "
+              "registered model")
+    )
+
     args = parser.parse_args()
+    if args.previous_model and not args.new_data:
+        parser.error("--previous_model requires --new_data")
 
     print("Argument [build_id]: %s" % args.build_id)
     print("Argument [model_name]: %s" % args.model_name)
     print("Argument [step_output]: %s" % args.step_output)
+    print("Argument [data_file]: %s" % args.data_file)
+    print("Argument [shard]: %s/%s" % (args.shard, args.num_shards))
+    print("Argument [partials]: %s" % args.partials)
+    print("Argument [new_data]: %s" % args.new_data)
+    print("Argument [previous_model]: %s" % args.previous_model)
 
     model_name = args.model_name
     build_id = args.build_id
@@ -91,33 +239,60 @@ def main():
 
     run = Run.get_context()
 
-    # Get the dataset
-    dataset = run.input_datasets['training_data']
-    if (dataset):
-        df = dataset.to_pandas_dataframe()
-        X = df.drop('Y', axis=1).values
-        y = df['Y'].values
+    chunk_rows = pars.get("training", {}).get("chunk_rows", 100000)
+    if args.shard is not None:
+        # Map step: the reduce step trains on the partial statistics.
+        os.makedirs(step_output_path, exist_ok=True)
+        partial_path = os.path.join(
+            step_output_path, "partial_%d.npz" % args.shard)
+        save_partial(shard_statistics(
+            args.data_file, args.shard, args.num_shards, chunk_rows),
+            partial_path)
+        print("Saved the statistics of shard %d to %s" % (
+            args.shard, partial_path))
+        run.tag("run_type", value="train_shard")
+        run.complete()
+        return
+    dataset_cache = open_dataset_cache(pars.get("training", {}))
+    previous = None
+    if args.new_data:
+        previous_path = (args.previous_model
+                         or download_previous_model(run, model_name))
+        if previous_path is not None:
+            previous = load_previous_model(previous_path)
+    if previous is not None:
+        # Incremental training only reads the new rows.
+        reg = train_incremental(
+            run, previous, args.new_data, alpha, chunk_rows,
+            decay=pars.get("training", {}).get("decay", 1.0))
+    elif args.new_data:
+        # No model to start from: the first one is trained on new_data.
+        reg = train_streaming(run, args.new_data, alpha, chunk_rows)
+    elif args.partials:
+        # Reduce step.
+        reg = train_on_partials(
+            run, [load_partial(os.path.join(folder, name))
+                  for folder in args.partials
+                  for name in sorted(os.listdir(folder))
+                  if name.startswith("partial_")], alpha)
+    elif args.data_file:
+        # Out-of-core training, in memory independent of the number of
+        # rows, in workers local processes: see train_streaming.
+        reg = train_streaming(
+            run, args.data_file, alpha, chunk_rows,
+            workers=pars.get("training", {}).get("workers", 1))
     else:
-        e = ("No dataset provided")
-        print(e)
-        raise Exception(e)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=0)
-    data = {"train": {"X": X_train, "y": y_train},
-            "test": {"X": X_test, "y": y_test}}
-
-    reg = train_model(run, data, alpha)
+        reg = train_in_memory(run, alpha, dataset_cache)
 
     # Pass model file to next step
     os.makedirs(step_output_path, exist_ok=True)
     model_output_path = os.path.join(step_output_path, model_name)
-    joblib.dump(value=reg, filename=model_output_path)
+    save_model(reg, model_output_path)
 
     # Also upload model file to run outputs for history
     os.makedirs('outputs', exist_ok=True)
     output_path = os.path.join('outputs', model_name)
-    joblib.dump(value=reg, filename=output_path)
+    save_model(reg, output_path)
 
     # Add properties to identify this specific training run
     run.parent.tag("BuildId", value=build_id)
@@ -0,0 +1,498 @@
+"""
+training_statistics.py
+
+Training on the sufficient statistics of Ridge regression rather than on
+the rows themselves. The row count, the feature and target means, and the
+centered Gram matrix and cross-products of a set of rows (RidgeStatistics)
+take memory proportional to the square of the number of features, merge
+exactly across chunks of rows, and solve the model for any number of
+alphas from one eigendecomposition.
+
+This is what lets train.py train out of core: a data path (a CSV or
+Parquet file, or a folder of them) is read in chunks, rows are split
+between train and test by a hash of their values rather than by their
+position, and each chunk is folded into the statistics of its train and
+test rows. Training is a map-reduce: each shard of the data, a subset of
+the files or of the chunks of a single file, is mapped to its partial
+statistics (shard_statistics), with the range of its features and a
+hash-based sample of its rows, and the partials are reduced into the
+model and its feature profile (reduce_statistics). Shards are mapped by
+local processes (train_streaming), or by one pipeline step each.
+
+The statistics are pickled with the model, with the SHA-256 fingerprints
+of the files they were computed from, so that incremental training
+(train_incremental) merges the statistics of new files only into them,
+weighing old rows by a decay factor, and solves the model again.
+"""
+import hashlib
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Ridge
+
+
+def parse_alphas(value):
+    # The training alpha in config.json is either a number, a list of
+    # numbers, or a log-spaced range {"min": ..., "max": ..., "num": ...}.
+    if isinstance(value, dict):
+        return np.logspace(np.log10(value["min"]), np.log10(value["max"]),
+                           int(value.get("num", 10))).tolist()
+    return [float(alpha) for alpha in np.atleast_1d(value)]
+
+
+class RidgeStatistics(object):
+    # Sufficient statistics of Ridge regression over a set of rows: the
+    # row count, the feature and target means, and the centered Gram
+    # matrix and cross-products. Statistics of separate chunks of rows
+    # merge exactly (Chan et al.), so that a model can be fitted without
+    # holding the rows, in memory proportional to the square of the
+    # number of features.
+
+    def __init__(self, n_features):
+        self.n = 0
+        self.x_mean = np.zeros(n_features)
+        self.y_mean = 0.0
+        self.xx = np.zeros((n_features, n_features))
+        self.xy = np.zeros(n_features)
+        self.yy = 0.0
+
+    @classmethod
+    def from_arrays(cls, X, y):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        stats = cls(X.shape[1])
+        if not len(X):
+            return stats
+        stats.n = len(X)
+        stats.x_mean = X.mean(axis=0)
+        stats.y_mean = y.mean()
+        X_centered = X - stats.x_mean
+        y_centered = y - stats.y_mean
+        stats.xx = X_centered.T @ X_centered
+        stats.xy = X_centered.T @ y_centered
+        stats.yy = y_centered @ y_centered
+        return stats
+
+    def to_dict(self, prefix=""):
+        # Arrays to save the statistics with numpy.savez.
+        return {prefix + name: np.asarray(getattr(self, name))
+                for name in ("n", "x_mean", "y_mean", "xx", "xy", "yy")}
+
+    @classmethod
+    def from_dict(cls, arrays, prefix=""):
+        stats = cls(len(arrays[prefix + "x_mean"]))
+        for name in ("n", "x_mean", "y_mean", "xx", "xy", "yy"):
+            value = np.asarray(arrays[prefix + name], dtype=float)
+            setattr(stats, name, value if value.ndim else value.item())
+        return stats
+
+    def decay(self, factor):
+        """Weighs the rows added so far by factor."""
+        self.n = self.n * factor
+        self.xx = self.xx * factor
+        self.xy = self.xy * factor
+        self.yy = self.yy * factor
+        return self
+
+    def update(self, X, y):
+        """Adds rows."""
+        return self.merge(RidgeStatistics.from_arrays(X, y))
+
+    def merge(self, other):
+        """Adds the rows of other."""
+        if not other.n:
+            return self
+        n = self.n + other.n
+        dx = other.x_mean - self.x_mean
+        dy = other.y_mean - self.y_mean
+        weight = self.n * other.n / n
+        self.xx = self.xx + other.xx + weight * np.outer(dx, dx)
+        self.xy = self.xy + other.xy + weight * dx * dy
+        self.yy = self.yy + other.yy + weight * dy * dy
+        self.x_mean = self.x_mean + dx * other.n / n
+        self.y_mean = self.y_mean + dy * other.n / n
+        self.n = n
+        return self
+
+    def solve(self, alphas):
+        # Ridge coefficients and intercepts for all alphas from a single
+        # eigendecomposition of the centered Gram matrix Xt X = V diag(w)
+        # Vt: the coefficients for alpha are V diag(1 / (w + alpha)) Vt
+        # Xt y, so each further alpha only costs products with the small
+        # matrix V.
+        w, V = np.linalg.eigh(self.xx)
+        Vt_xy = V.T @ self.xy
+        alphas = np.asarray(alphas, dtype=float)[:, np.newaxis]
+        # Directions with a null eigenvalue do not contribute, as with
+        # scikit-learn's svd solver.
+        nonzero = w > 1e-12 * max(w.max(), 1.0)
+        shrink = np.zeros((len(alphas), len(w)))
+        shrink[:, nonzero] = 1.0 / (w[nonzero] + alphas)
+        coefs = (shrink * Vt_xy) @ V.T
+        intercepts = self.y_mean - coefs @ self.x_mean
+        return coefs, intercepts
+
+    def mse(self, coefs, intercepts):
+        # Mean squared error of each model (row of coefs) on these rows,
+        # without a pass over them: the variance of the residuals plus
+        # their squared mean.
+        coefs = np.atleast_2d(coefs)
+        bias = coefs @ self.x_mean + intercepts - self.y_mean
+        variance = (np.einsum("ij,jk,ik->i", coefs, self.xx, coefs)
+                    - 2.0 * coefs @ self.xy + self.yy) / self.n
+        return variance + bias ** 2
+
+
+def ridge_path(X, y, alphas):
+    # Ridge coefficients and intercepts of X and y for all alphas.
+    return RidgeStatistics.from_arrays(X, y).solve(alphas)
+
+
+def train_from_statistics(run, train, test, alpha, sources=()):
+    # train_model from the RidgeStatistics of the train and test sets,
+    # and the fingerprints of the data files they were computed from.
+    alphas = parse_alphas(alpha)
+    coefs, intercepts = train.solve(alphas)
+    mses = test.mse(coefs, intercepts)
+    best = int(np.argmin(mses))
+
+    if len(alphas) > 1:
+        sweep = {"alpha": alphas, "mse": mses.tolist()}
+        run.log_table("alpha_sweep", sweep)
+        run.parent.log_table("alpha_sweep", sweep)
+    run.log("alpha", alphas[best])
+    run.parent.log("alpha", alphas[best])
+    reg = Ridge(alpha=alphas[best])
+    reg.coef_ = coefs[best]
+    reg.intercept_ = intercepts[best]
+    reg.n_features_in_ = coefs.shape[1]
+    mse = float(mses[best])
+    run.log("mse", mse, description="Mean squared error metric")
+    run.parent.log("mse", mse, description="Mean squared error metric")
+    # Pickled with the model, like its feature profile, for incremental
+    # retraining to start from (see train_incremental).
+    reg.training_statistics_ = dict(train.to_dict("train_"),
+                                    **test.to_dict("test_"))
+    reg.training_statistics_["sources"] = np.array(sorted(set(sources)),
+                                                   dtype=str)
+    return reg
+
+
+def row_hashes(X, y):
+    # 64-bit hash of the values of each row (splitmix64 steps over the
+    # bits of each value), independent of the row's position.
+    values = np.column_stack([np.asarray(X, dtype=float),
+                              np.asarray(y, dtype=float)])
+    bits = np.ascontiguousarray(values + 0.0).view(np.uint64)
+    h = np.full(len(values), 0x9E3779B97F4A7C15, dtype=np.uint64)
+    for column in bits.T:
+        h ^= column
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(31)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(29)
+    return h
+
+
+def is_test_row(X, y, test_size=0.2, hashes=None):
+    # Assigns rows to the test set by a hash of their values, so that the
+    # split does not depend on the order of the rows, on how they are
+    # chunked or on which shard they are in.
+    if hashes is None:
+        hashes = row_hashes(X, y)
+    return (hashes >> np.uint64(11)) < np.uint64(test_size * 2.0 ** 53)
+
+
+def list_data_files(path):
+    # A data path is a CSV or Parquet file, or a folder of them, or a
+    # list of files.
+    if isinstance(path, list):
+        return path
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if os.path.splitext(name)[1].lower() in (".csv", ".parquet", ".pq"))
+
+
+def file_fingerprint(path, block_size=1 << 20):
+    # SHA-256 of a data file's bytes, recorded in the training statistics
+    # so that incremental training does not fold the same file in twice.
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def shard_files(path, shard=0, n_shards=1):
+    # The files of a data path read by the shard-th of n_shards shards.
+    # With at least as many files as shards, shards are sets of files
+    # (by_file); otherwise each file is shared out by chunks, or by row
+    # groups for Parquet.
+    files = list_data_files(path)
+    by_file = len(files) >= n_shards
+    if by_file:
+        files = files[shard::n_shards]
+    return files, by_file
+
+
+def read_training_chunks(path, chunk_rows, label="Y", shard=0, n_shards=1):
+    # Yields (X, y) chunks of at most chunk_rows rows of the shard-th of
+    # n_shards shards of a data path (see shard_files), reading no more
+    # than a chunk (or a Parquet row group) at once.
+    files, by_file = shard_files(path, shard, n_shards)
+    for file in files:
+        if os.path.splitext(file)[1].lower() in (".parquet", ".pq"):
+            import pyarrow.parquet
+            parquet = pyarrow.parquet.ParquetFile(file)
+            groups = range(parquet.num_row_groups)
+            if not by_file:
+                groups = groups[shard::n_shards]
+            frames = (parquet.read_row_group(group).to_pandas()
+                      for group in groups)
+        else:
+            frames = pd.read_csv(file, chunksize=chunk_rows)
+            if not by_file:
+                frames = (frame for index, frame in enumerate(frames)
+                          if index % n_shards == shard)
+        for frame in frames:
+            for start in range(0, len(frame), chunk_rows):
+                chunk = frame.iloc[start:start + chunk_rows]
+                yield chunk.drop(label, axis=1).values, chunk[label].values
+
+
+def shard_statistics(path, shard=0, n_shards=1, chunk_rows=100000,
+                     test_size=0.2, sample_rows=10000):
+    # Map step of out-of-core and distributed training: folds the rows of
+    # a shard into the RidgeStatistics of its train and test rows, and
+    # keeps the range of the train features and the sample_rows train
+    # rows of lowest hash, a uniform sample that merges across shards.
+    # Returns a dict of arrays, saved by save_partial, with the
+    # fingerprints of the files read (all of them by the first shard
+    # when files are shared out by chunks).
+    partial = partial_statistics(
+        read_training_chunks(path, chunk_rows, shard=shard,
+                             n_shards=n_shards),
+        test_size, sample_rows)
+    files, by_file = shard_files(path, shard, n_shards)
+    if partial and (by_file or shard == 0):
+        partial["sources"] = np.array(
+            [file_fingerprint(file) for file in files], dtype=str)
+    return partial
+
+
+def partial_statistics(chunks, test_size=0.2, sample_rows=10000):
+    # shard_statistics over an iterable of (X, y) chunks of rows.
+    train = test = None
+    low = high = sample = sample_hashes = None
+    for X, y in chunks:
+        if train is None:
+            train = RidgeStatistics(X.shape[1])
+            test = RidgeStatistics(X.shape[1])
+            low = np.full(X.shape[1], np.inf)
+            high = np.full(X.shape[1], -np.inf)
+            sample = np.empty((0, X.shape[1]))
+            sample_hashes = np.empty(0, dtype=np.uint64)
+        hashes = row_hashes(X, y)
+        test_rows = is_test_row(X, y, test_size, hashes)
+        train.update(X[~test_rows], y[~test_rows])
+        test.update(X[test_rows], y[test_rows])
+        if test_rows.all():
+            continue
+        X_train = X[~test_rows]
+        low = np.fmin(low, np.nanmin(X_train, axis=0))
+        high = np.fmax(high, np.nanmax(X_train, axis=0))
+        sample, sample_hashes = _lowest_hashes(
+            np.concatenate([sample, X_train]),
+            np.concatenate([sample_hashes, hashes[~test_rows]]),
+            sample_rows)
+    if train is None:
+        return {}
+    partial = dict(train.to_dict("train_"), **test.to_dict("test_"))
+    partial.update(min=low, max=high, sample=sample,
+                   sample_hashes=sample_hashes)
+    return partial
+
+
+def _lowest_hashes(rows, hashes, count):
+    keep = np.argsort(hashes, kind="stable")[:count]
+    return rows[keep], hashes[keep]
+
+
+def save_partial(partial, path):
+    np.savez(path, **partial)
+
+
+def load_partial(path):
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def reduce_statistics(partials, sample_rows=10000):
+    # Reduce step: merges the partial statistics of the shards into the
+    # train and test RidgeStatistics and the feature profile of the whole
+    # data. The profile's range, mean and std are exact; its bin edges
+    # and counts come from the merged sample of train rows.
+    partials = [partial for partial in partials if partial]
+    if not partials:
+        raise Exception("No rows to train on")
+    train = RidgeStatistics.from_dict(partials[0], "train_")
+    test = RidgeStatistics.from_dict(partials[0], "test_")
+    for partial in partials[1:]:
+        train.merge(RidgeStatistics.from_dict(partial, "train_"))
+        test.merge(RidgeStatistics.from_dict(partial, "test_"))
+    if not train.n or not test.n:
+        raise Exception("Not enough rows to train and test")
+    sample, _ = _lowest_hashes(
+        np.concatenate([partial["sample"] for partial in partials]),
+        np.concatenate([partial["sample_hashes"] for partial in partials]),
+        sample_rows)
+    profile = build_feature_profile(sample)
+    profile.update(
+        n_rows=int(train.n),
+        min=np.min([partial["min"] for partial in partials],
+                   axis=0).tolist(),
+        max=np.max([partial["max"] for partial in partials],
+                   axis=0).tolist(),
+        mean=train.x_mean.tolist(),
+        std=np.sqrt(np.diag(train.xx) / train.n).tolist())
+    return train, test, profile
+
+
+def train_on_partials(run, partials, alpha):
+    # Solves the model from the partial statistics of the shards.
+    train, test, profile = reduce_statistics(partials)
+    print("Trained on %d rows, tested on %d rows" % (train.n, test.n))
+    reg = train_from_statistics(run, train, test, alpha,
+                                partial_sources(partials))
+    reg.feature_profile_ = profile
+    return reg
+
+
+def partial_sources(partials):
+    return [str(source) for partial in partials
+            for source in partial.get("sources", ())]
+
+
+def update_feature_profile(profile, partials, train, decay=1.0):
+    # The feature profile of the previous model with the train rows of
+    # the partials added, in the previous bins: counts of the previous
+    # rows are weighed by decay, and those of the new rows estimated from
+    # their sample. The range only grows, as old rows do not leave it.
+    profile = dict(profile)
+    counts = np.asarray(profile["bin_counts"], dtype=float) * decay
+    low = np.asarray(profile["min"], dtype=float)
+    high = np.asarray(profile["max"], dtype=float)
+    for partial in partials:
+        sample = partial["sample"]
+        if not len(sample):
+            continue
+        for i, edges in enumerate(profile["bin_edges"]):
+            column = sample[:, i][~np.isnan(sample[:, i])]
+            counts[i] += np.bincount(
+                np.searchsorted(edges, column, side="right"),
+                minlength=counts.shape[1]) * partial["train_n"] / len(sample)
+        low = np.fmin(low, partial["min"])
+        high = np.fmax(high, partial["max"])
+    profile.update(
+        n_rows=int(round(train.n)),
+        min=low.tolist(),
+        max=high.tolist(),
+        mean=train.x_mean.tolist(),
+        std=np.sqrt(np.diag(train.xx) / train.n).tolist(),
+        bin_counts=np.round(counts).astype(int).tolist())
+    return profile
+
+
+def train_incremental(run, previous, new_data, alpha, chunk_rows=100000,
+                      decay=1.0):
+    # Retrains the previous model with the rows of new_data, a data path
+    # of rows added since: the statistics of the rows it was trained and
+    # tested on, pickled with it, are weighed by decay (1 keeps old rows
+    # at full weight, lower values forget them exponentially over
+    # retrainings) and merged with the statistics of the new rows, and
+    # the model is solved again. Files whose fingerprint is among the
+    # sources of the previous statistics were folded in already, and are
+    # skipped. The cost is that of reading the new files.
+    statistics = previous.training_statistics_
+    seen = set(str(source) for source in statistics.get("sources", ()))
+    new_files = []
+    sources = list(seen)
+    for file in list_data_files(new_data):
+        fingerprint = file_fingerprint(file)
+        if fingerprint in seen:
+            print("Skipping %s, already trained on" % file)
+            continue
+        new_files.append(file)
+        sources.append(fingerprint)
+        seen.add(fingerprint)
+    if not new_files:
+        # The model is solved again from unchanged statistics.
+        print("No new data in %s" % new_data)
+        decay = 1.0
+    train = RidgeStatistics.from_dict(statistics, "train_").decay(decay)
+    test = RidgeStatistics.from_dict(statistics, "test_").decay(decay)
+    partials = []
+    if new_files:
+        partial = partial_statistics(
+            read_training_chunks(new_files, chunk_rows))
+        if partial:
+            partials.append(partial)
+            train.merge(RidgeStatistics.from_dict(partial, "train_"))
+            test.merge(RidgeStatistics.from_dict(partial, "test_"))
+    print("Trained on %d new rows, %d rows in all" % (
+        sum(partial["train_n"] for partial in partials), train.n))
+    reg = train_from_statistics(run, train, test, alpha, sources)
+    reg.feature_profile_ = update_feature_profile(
+        previous.feature_profile_, partials, train, decay)
+    return reg
+
+
+def train_streaming(run, path, alpha, chunk_rows=100000, workers=1):
+    # Trains on a data path too large for memory, in memory proportional
+    # to the square of the number of features: each chunk is split into
+    # train and test rows by is_test_row and folded into their
+    # RidgeStatistics, and the model is solved from those. With several
+    # workers the data is split into as many shards, mapped in parallel
+    # processes: the local stand-in for the map steps of the pipeline.
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            partials = pool.starmap(
+                shard_statistics,
+                [(path, shard, workers, chunk_rows)
+                 for shard in range(workers)])
+    else:
+        partials = [shard_statistics(path, chunk_rows=chunk_rows)]
+    return train_on_partials(run, partials, alpha)
+
+
+def build_feature_profile(X, n_bins=10):
+    # Compact profile of the training features, checked by the scoring
+    # service against each batch it scores (see scoring/validation.py),
+    # and used as the reference of its drift monitor (scoring/drift.py).
+    # bin_edges holds the inner quantile edges of each feature, and
+    # bin_counts the number of training rows per bin, a value v falling
+    # in bin searchsorted(edges, v, side="right").
+    X = np.asarray(X, dtype=float)
+    quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+    bin_edges = []
+    bin_counts = []
+    for column in X.T:
+        column = column[~np.isnan(column)]
+        edges = np.quantile(column, quantiles)
+        bin_edges.append(edges.tolist())
+        bin_counts.append(np.bincount(
+            np.searchsorted(edges, column, side="right"),
+            minlength=n_bins).tolist())
+    return {
+        "n_features": X.shape[1],
+        "n_rows": X.shape[0],
+        "min": np.nanmin(X, axis=0).tolist(),
+        "max": np.nanmax(X, axis=0).tolist(),
+        "mean": np.nanmean(X, axis=0).tolist(),
+        "std": np.nanstd(X, axis=0).tolist(),
+        "bin_edges": bin_edges,
+        "bin_counts": bin_counts,
+    }
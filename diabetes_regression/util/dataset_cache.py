@@ -0,0 +1,230 @@
+"""
+dataset_cache.py
+
+Local cache of tabular datasets, so that training and the data tests do
+not download and parse the same data on every run. Each entry holds the
+features and the label of one version of a dataset as .npy files, the
+features in column-major order: np.load memory-maps them, so that a warm
+read parses nothing and copies nothing, and each column is contiguous on
+disk.
+
+Entries are keyed on the dataset's name, version and a hash of its
+content, and live in <root>/<name>/<version>-<hash>/ next to a
+manifest.json of the columns and the SHA-256 of each file, checked when
+the entry is read. Once the cache grows beyond max_bytes, the entries
+read least recently are removed.
+
+train.py reads the training dataset through the cache when
+dataset_cache_enabled is set in the training section of config.json,
+under dataset_cache_dir (by default $DATASET_CACHE_DIR, or
+~/.cache/diabetes_regression/datasets) and within
+dataset_cache_max_bytes. data/data_test.py reads its CSV files through
+it too, in a temporary folder unless DATASET_CACHE_DIR is set, so that
+warm runs skip parsing.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROOT = os.path.join(
+    os.path.expanduser("~"), ".cache", "diabetes_regression", "datasets")
+DEFAULT_MAX_BYTES = 1 << 30
+MANIFEST = "manifest.json"
+
+# X and y are read-only memory maps of the cached arrays.
+CachedDataset = namedtuple("CachedDataset", ["X", "y", "columns", "label"])
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 of a file's bytes, in hex."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _safe(value) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(value))
+
+
+class DatasetCache(object):
+    """
+    Size-bounded LRU cache of datasets as memory-mapped .npy files.
+
+    Parameters:
+    root (str): folder of the cache, DATASET_CACHE_DIR or
+        ~/.cache/diabetes_regression/datasets by default
+    max_bytes (int): size the cache is kept under
+    """
+
+    def __init__(self, root: str = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = (root or os.environ.get("DATASET_CACHE_DIR")
+                     or DEFAULT_ROOT)
+        self.max_bytes = max_bytes
+
+    def entry_path(self, name: str, version, content_hash: str) -> str:
+        return os.path.join(self.root, _safe(name), "%s-%s" % (
+            _safe(version), _safe(content_hash)[:32]))
+
+    def get(self, name: str, version, content_hash: str,
+            verify: bool = True) -> CachedDataset:
+        """
+        Returns the cached dataset, None if it is not cached. An entry
+        failing its integrity check is removed, and None returned.
+        """
+        path = self.entry_path(name, version, content_hash)
+        try:
+            with open(os.path.join(path, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._check(path, manifest, verify):
+            print("Removing corrupt dataset cache entry %s" % path)
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        # The manifest's modification time records the last read.
+        os.utime(os.path.join(path, MANIFEST))
+        return CachedDataset(
+            np.load(os.path.join(path, "X.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "y.npy"), mmap_mode="r"),
+            manifest["columns"], manifest["label"])
+
+    def put(self, name: str, version, content_hash: str,
+            frame: pd.DataFrame, label: str = "Y") -> CachedDataset:
+        """
+        Caches the features and label of a DataFrame, then evicts the
+        least recently read entries beyond max_bytes, and returns the
+        cached dataset.
+        """
+        path = self.entry_path(name, version, content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary folder and renamed, so that readers only
+        # ever see complete entries.
+        staging = tempfile.mkdtemp(prefix=".staging-",
+                                   dir=os.path.dirname(path))
+        try:
+            features = frame.drop(columns=[label])
+            np.save(os.path.join(staging, "X.npy"), np.asfortranarray(
+                features.to_numpy(dtype=np.float64)))
+            np.save(os.path.join(staging, "y.npy"),
+                    frame[label].to_numpy(dtype=np.float64))
+            manifest = {
+                "name": str(name),
+                "version": str(version),
+                "content_hash": content_hash,
+                "columns": [str(column) for column in features.columns],
+                "label": label,
+                "files": {
+                    file_name: {
+                        "bytes": os.path.getsize(
+                            os.path.join(staging, file_name)),
+                        "sha256": file_hash(os.path.join(staging, file_name))
+                    } for file_name in ("X.npy", "y.npy")},
+            }
+            with open(os.path.join(staging, MANIFEST), "w") as f:
+                json.dump(manifest, f, indent=2)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # Cached meanwhile by another process.
+                pass
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=path)
+        return self.get(name, version, content_hash, verify=False)
+
+    def load(self, name: str, version, content_hash: str, read,
+             label: str = "Y", verify: bool = True) -> CachedDataset:
+        """
+        Returns the cached dataset, caching the DataFrame returned by
+        read() first if it is not cached.
+        """
+        cached = self.get(name, version, content_hash, verify)
+        if cached is not None:
+            print("Read %s version %s from the dataset cache" % (
+                name, version))
+            return cached
+        return self.put(name, version, content_hash, read(), label)
+
+    def load_file(self, path: str, label: str = "Y",
+                  verify: bool = True) -> CachedDataset:
+        """load for a CSV or Parquet file, keyed on its content."""
+        if os.path.splitext(path)[1].lower() in (".parquet", ".pq"):
+            def read():
+                return pd.read_parquet(path)
+        else:
+            def read():
+                return pd.read_csv(path)
+        return self.load(os.path.basename(path), "file", file_hash(path),
+                         read, label, verify)
+
+    def entries(self) -> list:
+        """Returns (path, bytes, last read time) for each entry."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for name in os.listdir(self.root):
+            folder = os.path.join(self.root, name)
+            if not os.path.isdir(folder):
+                continue
+            for entry in os.listdir(folder):
+                path = os.path.join(folder, entry)
+                manifest = os.path.join(path, MANIFEST)
+                if entry.startswith(".") or not os.path.isfile(manifest):
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, file_name))
+                           for file_name in os.listdir(path))
+                entries.append((path, size, os.path.getmtime(manifest)))
+        return entries
+
+    def evict(self, keep: str = None) -> int:
+        """
+        Removes the least recently read entries, except keep, until the
+        cache is under max_bytes. Returns the number of entries removed.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def verify(self) -> list:
+        """Checks every entry in full, returning the corrupt ones."""
+        corrupt = []
+        for path, _, _ in self.entries():
+            try:
+                with open(os.path.join(path, MANIFEST)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                corrupt.append(path)
+                continue
+            if not self._check(path, manifest, True):
+                corrupt.append(path)
+        return corrupt
+
+    @staticmethod
+    def _check(path, manifest, verify):
+        # Sizes are always checked, and hashes when verify is set.
+        for file_name, expected in manifest["files"].items():
+            file_path = os.path.join(path, file_name)
+            if (not os.path.isfile(file_path)
+                    or os.path.getsize(file_path) != expected["bytes"]):
+                return False
+            if verify and file_hash(file_path) != expected["sha256"]:
+                return False
+        return True
@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pandas as pd
+from diabetes_regression.util.dataset_cache import DatasetCache
+
+
+def make_frame(rows=100, seed=0):
+    rng = np.random.RandomState(seed)
+    frame = pd.DataFrame(rng.standard_normal((rows, 3)),
+                         columns=["a", "b", "c"])
+    frame["Y"] = rng.standard_normal(rows)
+    return frame
+
+
+def test_warm_reads_are_memory_mapped_without_parsing(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    frame = make_frame()
+    reads = []
+
+    def read():
+        reads.append(1)
+        return frame
+
+    cache.load("diabetes", 1, "abc", read)
+    cached = cache.load("diabetes", 1, "abc", read)
+
+    assert len(reads) == 1
+    assert isinstance(cached.X, np.memmap)
+    assert cached.X.flags.f_contiguous and not cached.X.flags.writeable
+    np.testing.assert_array_equal(cached.X, frame[["a", "b", "c"]].values)
+    np.testing.assert_array_equal(cached.y, frame["Y"].values)
+    assert cached.columns == ["a", "b", "c"]
+    # A new version or content is cached apart.
+    cache.load("diabetes", 2, "abc", read)
+    cache.load("diabetes", 1, "def", read)
+    assert len(reads) == 3
+
+
+def test_corrupt_entries_are_dropped(tmp_path):
+    cache = DatasetCache(str(tmp_path))
+    frame = make_frame()
+    cache.put("diabetes", 1, "abc", frame)
+    path = os.path.join(cache.entry_path("diabetes", 1, "abc"), "X.npy")
+    with open(path, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"\xff" * 8)
+
+    assert cache.verify() == [os.path.dirname(path)]
+    assert cache.get("diabetes", 1, "abc") is None
+    assert cache.entries() == []
+
+
+def test_least_recently_read_entries_are_evicted(tmp_path):
+    frame = make_frame(1000)
+    cache = DatasetCache(str(tmp_path), max_bytes=1 << 30)
+    for version in (1, 2, 3):
+        cache.put("diabetes", version, "abc", frame)
+        os.utime(os.path.join(cache.entry_path("diabetes", version, "abc"),
+                              "manifest.json"), (version, version))
+    entry_bytes = cache.entries()[0][1]
+    cache.get("diabetes", 1, "abc")
+
+    cache.max_bytes = 3 * entry_bytes - 1
+    assert cache.evict() == 1
+
+    assert cache.get("diabetes", 2, "abc") is None
+    assert cache.get("diabetes", 1, "abc") is not None
+    assert cache.get("diabetes", 3, "abc") is not None
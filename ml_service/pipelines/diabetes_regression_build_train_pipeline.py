@@ -1,6 +1,7 @@
 from azureml.pipeline.core.graph import PipelineParameter
 from azureml.pipeline.steps import PythonScriptStep
 from azureml.pipeline.core import Pipeline, PipelineData
+from azureml.data.data_reference import DataReference
 from azureml.core import Workspace, Environment
 from azureml.core.runconfig import RunConfiguration
 from azureml.core import Dataset
@@ -9,6 +10,7 @@ from ml_service.util.env_variables import Env
 from sklearn.datasets import load_diabetes
 import pandas as pd
 import os
+import posixpath
 
 
 def main():
@@ -90,18 +92,78 @@ def main():
         'pipeline_data',
         datastore=aml_workspace.get_default_datastore())
 
+    train_inputs = [dataset.as_named_input('training_data')]
+    train_arguments = [
+        "--build_id", build_id_param,
+        "--model_name", model_name_param,
+        "--step_output", pipeline_data
+    ]
+    shard_steps = []
+    # With a training data file set, the train step streams it in chunks
+    # instead of loading the dataset in memory.
+    if e.training_data_path:
+        training_data_file = DataReference(
+            datastore=aml_workspace.get_default_datastore(),
+            data_reference_name="training_data_file",
+            path_on_datastore=e.training_data_path)
+        train_inputs.append(training_data_file)
+        train_arguments += ["--data_file", training_data_file]
+    # With several training shards, the statistics of each shard of the
+    # file are computed by its own step, on its own node, and the train
+    # step solves the model from all of them.
+    if (e.training_data_path and e.training_shards > 1
+            and not e.training_new_data_path):
+        shard_outputs = []
+        for shard in range(e.training_shards):
+            shard_output = PipelineData(
+                'train_shard_%d' % shard,
+                datastore=aml_workspace.get_default_datastore())
+            shard_steps.append(PythonScriptStep(
+                name="Train Shard %d" % shard,
+                script_name=e.train_script_path,
+                compute_target=aml_compute,
+                source_directory=e.sources_directory_train,
+                inputs=[training_data_file],
+                outputs=[shard_output],
+                arguments=[
+                    "--build_id", build_id_param,
+                    "--model_name", model_name_param,
+                    "--data_file", training_data_file,
+                    "--shard", shard,
+                    "--num_shards", e.training_shards,
+                    "--step_output", shard_output
+                ],
+                runconfig=run_config,
+                allow_reuse=False,
+            ))
+            shard_outputs.append(shard_output)
+        print("Steps Train Shard created")
+        train_inputs = shard_outputs
+        train_arguments = [
+            "--build_id", build_id_param,
+            "--model_name", model_name_param,
+            "--step_output", pipeline_data,
+            "--partials"
+        ] + shard_outputs
+
+    # With new data set, the train step retrains the latest registered
+    # model with the files of it that model was not trained on.
+    if e.training_new_data_path:
+        training_new_data = DataReference(
+            datastore=aml_workspace.get_default_datastore(),
+            data_reference_name="training_new_data",
+            path_on_datastore=e.training_new_data_path)
+        train_inputs.append(training_new_data)
+        train_arguments += ["--new_data", training_new_data]
+
     train_step = PythonScriptStep(
         name="Train Model",
         script_name=e.train_script_path,
         compute_target=aml_compute,
         source_directory=e.sources_directory_train,
-        inputs=[dataset.as_named_input('training_data')],
+        inputs=train_inputs,
         outputs=[pipeline_data],
-        arguments=[
-            "--build_id", build_id_param,
-            "--model_name", model_name_param,
-            "--step_output", pipeline_data
-        ],
+        arguments=train_arguments,
         runconfig=run_config,
         allow_reuse=False,
     )
@@ -147,6 +209,45 @@ def main():
         print("Exclude evaluation step and directly run register step.")
         register_step.run_after(train_step)
         steps = [train_step, register_step]
+    steps = shard_steps + steps
+
+    # Check run_batch_scoring flag to score a file on the default datastore
+    # with the newly registered model after the register step.
+    if ((e.run_batch_scoring).lower() == 'true'):
+        batch_scoring_data = DataReference(
+            datastore=aml_workspace.get_default_datastore(),
+            data_reference_name="batch_scoring_data",
+            path_on_datastore=e.batch_scoring_data_path)
+        # The predictions and their progress file go to a fixed folder
+        # per input, mounted read-write, rather than to a new PipelineData
+        # folder per run, so that a run after an interrupted one resumes
+        # it. The input is named by its datastore path, as its mount
+        # point changes from run to run.
+        batch_scores = DataReference(
+            datastore=aml_workspace.get_default_datastore(),
+            data_reference_name="batch_scores",
+            path_on_datastore=posixpath.join(
+                e.batch_scoring_output_path,
+                os.path.splitext(e.batch_scoring_data_path)[0]))
+        batch_score_step = PythonScriptStep(
+            name="Batch Score ",
+            script_name=e.batch_score_script_path,
+            compute_target=aml_compute,
+            source_directory=e.sources_directory_train,
+            inputs=[batch_scoring_data, batch_scores],
+            arguments=[
+                "--model_name", model_name_param,
+                "--input", batch_scoring_data,
+                "--input_key", e.batch_scoring_data_path,
+                "--output_dir", batch_scores,
+                "--drop_columns", "Y",
+            ],
+            runconfig=run_config,
+            allow_reuse=False,
+        )
+        print("Step Batch Score created")
+        batch_score_step.run_after(register_step)
+        steps.append(batch_score_step)
 
     train_pipeline = Pipeline(workspace=aml_workspace, steps=steps)
     train_pipeline._set_experiment_name
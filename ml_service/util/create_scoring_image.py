@@ -3,7 +3,6 @@ import argparse
 from azureml.core import Workspace
 from azureml.core.image import ContainerImage, Image
 from azureml.core.model import Model
-import shutil
 from ml_service.util.env_variables import Env
 
 e = Env()
@@ -28,18 +27,15 @@ model = Model(ws, name=e.model_name, version=e.model_version)
 sources_dir = e.sources_directory_train
 if (sources_dir is None):
     sources_dir = 'diabetes_regression'
-score_script = os.path.join(".", sources_dir, e.score_script)
-score_file = os.path.basename(score_script)
-path_to_scoring = os.path.dirname(score_script)
 cwd = os.getcwd()
-# Copy conda_dependencies.yml into scoring as this method does not accept relative paths. # NOQA: E501
-shutil.copy(os.path.join(".", sources_dir,
-                         "conda_dependencies.yml"), path_to_scoring)
-os.chdir(path_to_scoring)
+# The score script imports its helper modules relative to sources_dir, and
+# reads config.json from there, so ship them along with the script.
+os.chdir(os.path.join(".", sources_dir))
 image_config = ContainerImage.image_configuration(
-    execution_script=score_file,
+    execution_script=e.score_script,
     runtime="python",
     conda_file="conda_dependencies.yml",
+    dependencies=[os.path.dirname(e.score_script), "config.json"],
     description="Image with ridge regression model",
     tags={"area": "diabetes_regression"},
 )
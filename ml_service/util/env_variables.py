@@ -44,6 +44,18 @@ class Env(Singleton):
         self._run_evaluation = os.environ.get("RUN_EVALUATION", "true")
         self._allow_run_cancel = os.environ.get(
             "ALLOW_RUN_CANCEL", "true")
+        self._training_data_path = os.environ.get("TRAINING_DATA_PATH")
+        self._training_shards = int(os.environ.get("TRAINING_SHARDS", 1))
+        self._training_new_data_path = os.environ.get(
+            "TRAINING_NEW_DATA_PATH")
+        self._run_batch_scoring = os.environ.get(
+            "RUN_BATCH_SCORING", "false")
+        self._batch_score_script_path = os.environ.get(
+            "BATCH_SCORE_SCRIPT_PATH", "scoring/batch_score.py")
+        self._batch_scoring_data_path = os.environ.get(
+            "BATCH_SCORING_DATA_PATH", "training-data/diabetes.csv")
+        self._batch_scoring_output_path = os.environ.get(
+            "BATCH_SCORING_OUTPUT_PATH", "batch-scores")
 
     @property
     def workspace_name(self):
@@ -156,3 +168,31 @@ class Env(Singleton):
     @property
     def allow_run_cancel(self):
         return self._allow_run_cancel
+
+    @property
+    def training_data_path(self):
+        return self._training_data_path
+
+    @property
+    def training_shards(self):
+        return self._training_shards
+
+    @property
+    def training_new_data_path(self):
+        return self._training_new_data_path
+
+    @property
+    def run_batch_scoring(self):
+        return self._run_batch_scoring
+
+    @property
+    def batch_score_script_path(self):
+        return self._batch_score_script_path
+
+    @property
+    def batch_scoring_data_path(self):
+        return self._batch_scoring_data_path
+
+    @property
+    def batch_scoring_output_path(self):
+        return self._batch_scoring_output_path
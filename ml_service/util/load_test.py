@@ -0,0 +1,350 @@
+"""
+load_test.py
+
+Open-loop load generator for scoring services. Requests are started on a
+fixed schedule at the target rate, whether or not earlier ones have
+completed, so that a slow service shows up as higher latency rather than
+as a lower request rate. Latency is measured from the scheduled start of
+each request, and so includes any time spent waiting for a free
+connection.
+
+Traffic can be split across the x-api-version values of a blue/green
+deployment (see docs/canary_ab_deployment.md). Latency quantiles, errors
+and achieved throughput are reported for each version.
+
+With --capture, the batches recorded by the scoring service's capture
+mode (see diabetes_regression/scoring/capture.py) are sent in turn, to
+replay real traffic.
+
+Usage:
+    python -m ml_service.util.load_test --url http://$GATEWAY_IP/score \\
+        --rps 50 --duration 60 --rows 10 --split blue=90,green=10
+"""
+import argparse
+import collections
+import json
+import queue
+import random
+import threading
+import time
+import numpy
+import requests
+
+QUANTILES = (50, 90, 99, 99.9)
+
+# Requests without an x-api-version header are reported under this name.
+NO_VERSION = "-"
+
+
+def parse_split(split):
+    """
+    Parses a traffic split such as "blue=90,green=10".
+
+    Return:
+    A list of (version, weight) pairs, [(NO_VERSION, 1)] for no split.
+    """
+    if not split:
+        return [(NO_VERSION, 1.0)]
+    weights = []
+    for part in split.split(","):
+        version, _, weight = part.partition("=")
+        weights.append((version.strip(), float(weight or 1)))
+    if any(weight < 0 for _, weight in weights) or \
+            not sum(weight for _, weight in weights):
+        raise ValueError("Invalid traffic split: %s" % split)
+    return weights
+
+
+def scoring_url(url):
+    """
+    Returns url with an http:// scheme if it has none, so that a bare
+    $GATEWAY_IP/score can be given.
+    """
+    if "://" not in url:
+        return "http://" + url
+    return url
+
+
+def make_payload(rows, features, seed=0):
+    """Returns a JSON scoring body of random rows."""
+    data = numpy.random.RandomState(seed).uniform(size=(rows, features))
+    return json.dumps({"data": data.tolist()}).encode("utf-8")
+
+
+def capture_payloads(path, max_batches=None):
+    """Returns a JSON scoring body for each batch of a capture file."""
+    from diabetes_regression.scoring.capture import CaptureReader
+    reader = CaptureReader(path)
+    payloads = []
+    for batch in reader:
+        payloads.append(json.dumps({"data": batch.data.tolist()}).encode(
+            "utf-8"))
+        if max_batches and len(payloads) >= max_batches:
+            break
+    reader.close()
+    if not payloads:
+        raise ValueError("No batches captured in %s" % path)
+    return payloads
+
+
+def summarize(latencies_ms, errors, elapsed):
+    """
+    Summarizes the requests of one version.
+
+    Parameters:
+    latencies_ms (list): latency of each successful request
+    errors (int): number of failed requests
+    elapsed (float): duration of the test in seconds
+    """
+    summary = {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        "throughput_rps": len(latencies_ms) / elapsed if elapsed else 0.0,
+    }
+    if latencies_ms:
+        values = numpy.percentile(latencies_ms, QUANTILES)
+    else:
+        values = [None] * len(QUANTILES)
+    for q, value in zip(QUANTILES, values):
+        summary["p%g_ms" % q] = None if value is None else float(value)
+    return summary
+
+
+class LoadTest(object):
+    """
+    Sends requests to url at a fixed rate over a pool of connections.
+
+    Parameters:
+    url (str): scoring URL, http:// if it has no scheme
+    rps (float): target rate of requests per second
+    duration (float): test duration in seconds
+    payload (bytes): JSON body of each request, or None for GET requests;
+        a list of bodies is sent in turn
+    split (list): (version, weight) pairs, see parse_split
+    connections (int): maximal number of requests in flight
+    headers (dict): headers sent with every request
+    timeout (float): request timeout in seconds
+    seed (int): seed of the traffic split
+    count_responses (bool): count the distinct response bodies, e.g. to
+        see which image of the canary sample answered
+    """
+
+    def __init__(self, url, rps, duration, payload=None, split=None,
+                 connections=32, headers=None, timeout=30, seed=0,
+                 count_responses=False):
+        self.url = scoring_url(url)
+        self.rps = rps
+        self.duration = duration
+        self.payloads = payload if isinstance(payload, list) else [payload]
+        self.split = split or [(NO_VERSION, 1.0)]
+        self.connections = connections
+        self.headers = dict(headers or {})
+        if self.payloads[0] is not None:
+            self.headers.setdefault("Content-Type", "application/json")
+        self.timeout = timeout
+        self.count_responses = count_responses
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(list)
+        self._errors = collections.Counter()
+        self._error_samples = collections.Counter()
+        self._responses = collections.Counter()
+
+    def run(self):
+        """
+        Runs the test.
+
+        Return:
+        A dict with a summary per version and for all requests.
+        """
+        work = queue.Queue()
+        workers = [threading.Thread(target=self._worker, args=(work,),
+                                    daemon=True)
+                   for _ in range(self.connections)]
+        for worker in workers:
+            worker.start()
+
+        versions, weights = zip(*self.split)
+        n_requests = int(self.rps * self.duration)
+        start = time.perf_counter()
+        for i in range(n_requests):
+            scheduled = start + i / self.rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            version = self._random.choices(versions, weights)[0]
+            work.put((scheduled, version,
+                      self.payloads[i % len(self.payloads)]))
+        for _ in workers:
+            work.put(None)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        report = {
+            version: summarize(self._latencies[version],
+                               self._errors[version], elapsed)
+            for version in versions
+        }
+        report["all"] = summarize(
+            [latency for version in versions
+             for latency in self._latencies[version]],
+            sum(self._errors.values()), elapsed)
+        report["target_rps"] = self.rps
+        report["elapsed_seconds"] = elapsed
+        report["error_samples"] = dict(self._error_samples.most_common(5))
+        if self.count_responses:
+            report["responses"] = dict(self._responses.most_common(10))
+        return report
+
+    def _worker(self, work):
+        session = requests.Session()
+        while True:
+            item = work.get()
+            if item is None:
+                session.close()
+                return
+            scheduled, version, payload = item
+            headers = self.headers
+            if version != NO_VERSION:
+                headers = dict(headers, **{"x-api-version": version})
+            error = None
+            try:
+                if payload is None:
+                    response = session.get(
+                        self.url, headers=headers, timeout=self.timeout)
+                else:
+                    response = session.post(
+                        self.url, data=payload, headers=headers,
+                        timeout=self.timeout)
+                body = response.content
+                if response.status_code >= 400:
+                    error = "HTTP %d" % response.status_code
+            except requests.exceptions.RequestException as e:
+                error = type(e).__name__
+            latency_ms = (time.perf_counter() - scheduled) * 1000.0
+            with self._lock:
+                if error is None:
+                    self._latencies[version].append(latency_ms)
+                    if self.count_responses:
+                        self._responses[body[:80].decode(
+                            "utf-8", "replace")] += 1
+                else:
+                    self._errors[version] += 1
+                    self._error_samples[error] += 1
+
+
+def print_report(report):
+    columns = ["requests", "errors", "throughput_rps"] + \
+        ["p%g_ms" % q for q in QUANTILES]
+    print("%-10s" % "version" + "".join("%15s" % c for c in columns))
+    for version, summary in report.items():
+        if not isinstance(summary, dict) or \
+                version in ("error_samples", "responses"):
+            continue
+        cells = []
+        for column in columns:
+            value = summary[column]
+            if value is None:
+                cells.append("%15s" % "-")
+            elif isinstance(value, int):
+                cells.append("%15d" % value)
+            else:
+                cells.append("%15.2f" % value)
+        print("%-10s" % version + "".join(cells))
+    print("target %.1f rps over %.1f s" % (
+        report["target_rps"], report["elapsed_seconds"]))
+    if report["error_samples"]:
+        print("errors: %s" % report["error_samples"])
+    for body, count in report.get("responses", {}).items():
+        print("%6d  %s" % (count, body))
+
+
+def main():
+    parser = argparse.ArgumentParser("load_test")
+    parser.add_argument(
+        "--url",
+        type=str,
+        required=True,
+        help="Scoring URL, e.g. http://$GATEWAY_IP/score; http:// is "
+             "assumed if no scheme is given",
+    )
+    parser.add_argument(
+        "--rps",
+        type=float,
+        default=10,
+        help="Target rate of requests per second",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30,
+        help="Test duration in seconds",
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1,
+        help="Rows per request, 0 to send GET requests without a body",
+    )
+    parser.add_argument(
+        "--features",
+        type=int,
+        default=10,
+        help="Features per row",
+    )
+    parser.add_argument(
+        "--capture",
+        type=str,
+        help="Capture file whose batches are replayed, in place of --rows",
+    )
+    parser.add_argument(
+        "--split",
+        type=str,
+        help="x-api-version traffic split, e.g. blue=90,green=10",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=32,
+        help="Maximal number of requests in flight",
+    )
+    parser.add_argument(
+        "--key",
+        type=str,
+        help="Service key, sent as a Bearer Authorization header",
+    )
+    parser.add_argument(
+        "--count_responses",
+        action="store_true",
+        help="Count the distinct response bodies",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="File the JSON report is written to",
+    )
+    args = parser.parse_args()
+
+    headers = {}
+    if args.key:
+        headers["Authorization"] = "Bearer " + args.key
+    if args.capture:
+        payload = capture_payloads(args.capture)
+    elif args.rows:
+        payload = make_payload(args.rows, args.features)
+    else:
+        payload = None
+    load_test = LoadTest(args.url, args.rps, args.duration, payload=payload,
+                         split=parse_split(args.split),
+                         connections=args.connections, headers=headers,
+                         count_responses=args.count_responses)
+    report = load_test.run()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
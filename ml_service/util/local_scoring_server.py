@@ -0,0 +1,275 @@
+"""
+local_scoring_server.py
+
+Serves a scoring entry script (score.py) over HTTP on the local machine,
+without Azure, to profile and load test scoring changes. It follows the
+Azure ML scoring contract closely enough for the same clients to work:
+
+- POST /score with a JSON body {"data": [...]} calls run(data,
+  request_headers); raw float and Arrow bodies (see scoring/wire.py) call
+  run_binary(body, request_headers) when the script defines it. Azure ML
+  deployments have no such path: binary scoring is local only.
+- request headers are passed with Title-Cased names, and an
+  X-Ms-Request-Id is generated when the caller did not send one.
+- AZUREML_MODEL_DIR points to ./azureml-models/$MODEL_NAME/$VERSION in a
+  working folder laid out from a local model file.
+- GET / answers "Healthy", and GET /metrics returns the script's metrics
+  when it keeps a ScoringMetrics object.
+
+Requests are accepted concurrently on an asyncio event loop and scored on
+a pool of worker threads, like the concurrent requests of a container.
+
+Usage:
+    python -m ml_service.util.local_scoring_server \\
+        --model_path sklearn_regression_model.pkl --port 5001
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+BINARY_CONTENT_TYPES = ("application/octet-stream",
+                        "application/vnd.apache.arrow.stream")
+
+
+class HttpError(Exception):
+
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+def prepare_model_dir(model_path, model_name, model_version, work_dir):
+    """
+    Lays out model_path under work_dir as Azure ML does in a container.
+
+    Return:
+    The value of AZUREML_MODEL_DIR, relative to work_dir.
+    """
+    model_dir = os.path.join("azureml-models", model_name, str(model_version))
+    os.makedirs(os.path.join(work_dir, model_dir), exist_ok=True)
+    target = os.path.join(work_dir, model_dir, os.path.basename(model_path))
+    if not os.path.exists(target):
+        try:
+            os.symlink(os.path.abspath(model_path), target)
+        except OSError:
+            shutil.copy(model_path, target)
+    return model_dir
+
+
+def load_entry_script(sources_dir, score_script):
+    """
+    Imports the entry script with sources_dir on the path, as the scoring
+    container does with the deployment's source directory.
+    """
+    sources_dir = os.path.abspath(sources_dir)
+    if sources_dir not in sys.path:
+        sys.path.insert(0, sources_dir)
+    spec = importlib.util.spec_from_file_location(
+        "entry_script", os.path.join(sources_dir, score_script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalScoringServer(object):
+    """
+    Minimal asyncio HTTP/1.1 server for an entry script module.
+
+    Parameters:
+    entry_script: the imported entry script, already initialized
+    workers (int): number of threads running the entry script
+    max_body_bytes (int): largest request body accepted
+    """
+
+    def __init__(self, entry_script, workers=4,
+                 max_body_bytes=100 * 1024 * 1024):
+        self.entry_script = entry_script
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="scoring")
+        self.max_body_bytes = max_body_bytes
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving %s on http://%s:%d/score" % (
+            self.entry_script.__file__, host, port))
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, content_type, payload = await self._dispatch(
+                        method, path, headers, body)
+                except HttpError as e:
+                    status, content_type, payload = \
+                        e.status, "text/plain", str(e).encode("utf-8")
+                except Exception as e:
+                    # e.g. Overloaded, raised with the status to answer
+                    status, content_type, payload = \
+                        getattr(e, "status_code", 500), "text/plain", \
+                        str(e).encode("utf-8")
+                keep_alive = headers.get("Connection", "").lower() != "close"
+                self._write_response(
+                    writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except HttpError as e:
+            self._write_response(writer, e.status, "text/plain",
+                                 str(e).encode("utf-8"), False)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().title()] = value.strip()
+        length = int(headers.get("Content-Length", 0) or 0)
+        if length > self.max_body_bytes:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def _dispatch(self, method, path, headers, body):
+        if path == "/" and method == "GET":
+            return 200, "text/plain", b"Healthy"
+        if path == "/metrics" and method == "GET":
+            metrics = getattr(self.entry_script, "metrics", None)
+            if metrics is None:
+                raise HttpError(404, "The entry script keeps no metrics")
+            text = await self._call(metrics.to_prometheus)
+            return 200, "text/plain; version=0.0.4", text.encode("utf-8")
+        if path != "/score":
+            raise HttpError(404, "Not found: %s" % path)
+        if method != "POST":
+            raise HttpError(405, "Use POST to score")
+
+        headers.setdefault("X-Ms-Request-Id", str(uuid.uuid4()))
+        media_type = headers.get("Content-Type", "").split(";")[0].strip()
+        if media_type.lower() in BINARY_CONTENT_TYPES:
+            run_binary = getattr(self.entry_script, "run_binary", None)
+            if run_binary is None:
+                raise HttpError(400, "Binary requests are not supported")
+            payload, content_type = await self._call(
+                run_binary, body, headers)
+            return 200, content_type, bytes(payload)
+        return await self._call(self._run_json, body, headers)
+
+    def _run_json(self, body, headers):
+        try:
+            data = json.loads(body)["data"]
+        except (ValueError, KeyError, TypeError):
+            raise HttpError(400, 'Expected a JSON body {"data": [...]}')
+        result = self.entry_script.run(data, headers)
+        if hasattr(result, "status_code"):
+            # An AMLResponse, e.g. a 503 from admission control
+            return result.status_code, result.content_type, \
+                result.get_data()
+        return 200, "application/json", json.dumps(result).encode("utf-8")
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _write_response(self, writer, status, content_type, payload,
+                        keep_alive):
+        head = ("HTTP/1.1 {0} {1}\r\n"
+                "Content-Type: {2}\r\n"
+                "Content-Length: {3}\r\n"
+                "Connection: {4}\r\n\r\n").format(
+                    status, _REASONS.get(status, ""), content_type,
+                    len(payload), "keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1") + payload)
+
+
+def main():
+    parser = argparse.ArgumentParser("local_scoring_server")
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        required=True,
+        help="Path to the model file (e.g. a .pkl) to serve",
+    )
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        help="Name of the Model, the model file name by default",
+    )
+    parser.add_argument(
+        "--model_version",
+        type=int,
+        default=1,
+        help="Version of the Model",
+    )
+    parser.add_argument(
+        "--sources_dir",
+        type=str,
+        default=os.environ.get("SOURCES_DIR_TRAIN") or "diabetes_regression",
+        help="Source directory of the deployment",
+    )
+    parser.add_argument(
+        "--score_script",
+        type=str,
+        default=os.environ.get("SCORE_SCRIPT") or "scoring/score.py",
+        help="Entry script, relative to sources_dir",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of threads running the entry script",
+    )
+    args = parser.parse_args()
+
+    model_name = args.model_name or os.path.basename(args.model_path)
+    sources_dir = os.path.abspath(args.sources_dir)
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ["AZUREML_MODEL_DIR"] = prepare_model_dir(
+            args.model_path, model_name, args.model_version, work_dir)
+        # Model.get_model_path resolves ./azureml-models from the current
+        # directory, as in the scoring container.
+        os.chdir(work_dir)
+        entry_script = load_entry_script(sources_dir, args.score_script)
+        entry_script.init()
+        server = LocalScoringServer(entry_script, workers=args.workers)
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import argparse
+import math
+import random
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from azureml.core import Workspace
 from azureml.core.webservice import AksWebservice, AciWebservice
 from ml_service.util.env_variables import Env
@@ -12,13 +15,8 @@ input = {"data": [[1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
 output_len = 2
 
 
-def call_web_service(e, service_type, service_name):
-    aml_workspace = Workspace.get(
-        name=e.workspace_name,
-        subscription_id=e.subscription_id,
-        resource_group=e.resource_group
-    )
-    print("Fetching service")
+def get_web_service_endpoint(aml_workspace, service_type, service_name):
+    print("Fetching service %s" % service_name)
     headers = {}
     if service_type == "ACI":
         service = AciWebservice(aml_workspace, service_name)
@@ -27,33 +25,111 @@ def call_web_service(e, service_type, service_name):
     if service.auth_enabled:
         service_keys = service.get_keys()
         headers['Authorization'] = 'Bearer ' + service_keys[0]
-    print("Testing service")
-    print(". url: %s" % service.scoring_uri)
-    output = call_web_app(service.scoring_uri, headers)
+    return service.scoring_uri, headers
 
-    return output
 
+def call_web_service(e, service_type, service_name, **kwargs):
+    aml_workspace = Workspace.get(
+        name=e.workspace_name,
+        subscription_id=e.subscription_id,
+        resource_group=e.resource_group
+    )
+    url, headers = get_web_service_endpoint(
+        aml_workspace, service_type, service_name)
+    print("Testing service")
+    print(". url: %s" % url)
+    return call_web_app(url, headers, **kwargs)
 
-def call_web_app(url, headers):
 
+def trace_headers(headers):
     # Generate an HTTP 'traceparent' distributed tracing header
     # (per the W3C Trace Context proposed specification).
-    headers['traceparent'] = "00-{0}-{1}-00".format(
-        secrets.token_hex(16), secrets.token_hex(8))
-
-    retries = 600
-    for i in range(retries):
+    return dict(headers, traceparent="00-{0}-{1}-00".format(
+        secrets.token_hex(16), secrets.token_hex(8)))
+
+
+def call_web_app(url, headers, session=None, timeout_seconds=600,
+                 initial_delay_seconds=0.5, max_delay_seconds=15,
+                 sleep=time.sleep, monotonic=time.monotonic,
+                 uniform=random.uniform):
+    """
+    Waits for the service to answer, with exponential backoff and full
+    jitter between attempts. Connection errors, timeouts and HTTP errors
+    are all retried, as they are expected while a deployment rolls out.
+    sleep, monotonic and uniform stand for the time and random functions
+    of the same names, e.g. in tests.
+
+    Return:
+    The JSON response to the first successful request.
+    """
+    session = session or requests.Session()
+    deadline = monotonic() + timeout_seconds
+    attempt = 0
+    while True:
         try:
-            response = requests.post(
-                url, json=input, headers=headers)
+            response = session.post(
+                url, json=input, headers=trace_headers(headers), timeout=30)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.HTTPError as e:
-            if i == retries - 1:
+        except requests.exceptions.RequestException as e:
+            delay = uniform(0, min(
+                max_delay_seconds, initial_delay_seconds * 2 ** attempt))
+            if monotonic() + delay > deadline:
                 raise e
-            print(e)
-            print("Retrying...")
-            time.sleep(1)
+            print("%s: %s" % (url, e))
+            print("Retrying in %.1f s..." % delay)
+            sleep(delay)
+            attempt += 1
+
+
+def latency_burst(url, headers, session, requests_count=50, concurrency=4):
+    """
+    Sends requests_count scoring requests, concurrency at a time.
+
+    Return:
+    The latency of each request in milliseconds, sorted.
+    """
+    def score(_):
+        start = time.perf_counter()
+        response = session.post(
+            url, json=input, headers=trace_headers(headers), timeout=30)
+        response.raise_for_status()
+        return (time.perf_counter() - start) * 1000.0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sorted(executor.map(score, range(requests_count)))
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of sorted values, q between 0 and 100."""
+    rank = max(int(math.ceil(q * len(sorted_values) / 100.0)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def smoke_test(url, headers, session, args):
+    """
+    Waits for the service at url to be ready, verifies its output, and
+    with args.burst_requests, checks its p95 latency over a short burst
+    of requests. The latency check is off unless requested, as the p95 to
+    expect depends on the size of the deployment.
+    """
+    output = call_web_app(url, headers, session=session,
+                          timeout_seconds=args.timeout_seconds)
+    print("Verifying service output: %s" % url)
+    assert "result" in output
+    assert len(output["result"]) == output_len
+
+    if args.burst_requests:
+        latencies = latency_burst(url, headers, session,
+                                  requests_count=args.burst_requests,
+                                  concurrency=args.burst_concurrency)
+        p95 = percentile(latencies, 95)
+        print("%s: p50 %.1f ms, p95 %.1f ms over %d requests" % (
+            url, percentile(latencies, 50), p95, len(latencies)))
+        if args.max_p95_ms and p95 > args.max_p95_ms:
+            raise AssertionError(
+                "%s: p95 latency %.1f ms is above %.1f ms" % (
+                    url, p95, args.max_p95_ms))
 
 
 def main():
@@ -65,25 +141,75 @@ def main():
         type=str,
         choices=["AKS", "ACI", "Webapp"],
         required=True,
-        help="type of service"
+        action="append",
+        help="type of service, repeat along with --service to test "
+             "several services at the same time"
     )
     parser.add_argument(
         "--service",
         type=str,
         required=True,
+        action="append",
         help="Name of the image to test"
     )
+    parser.add_argument(
+        "--timeout_seconds",
+        type=float,
+        default=600,
+        help="How long to wait for each service to be ready"
+    )
+    parser.add_argument(
+        "--burst_requests",
+        type=int,
+        default=0,
+        help="Requests of the latency check, e.g. 50; by default the "
+             "latency is not checked"
+    )
+    parser.add_argument(
+        "--burst_concurrency",
+        type=int,
+        default=4,
+        help="Concurrent requests of the latency check"
+    )
+    parser.add_argument(
+        "--max_p95_ms",
+        type=float,
+        default=1000,
+        help="Fail when the p95 latency of the --burst_requests is above "
+             "this, 0 to never fail"
+    )
     args = parser.parse_args()
+    if len(args.type) != len(args.service):
+        parser.error("Give one --type for each --service")
 
     e = Env()
-    if args.type == "Webapp":
-        output = call_web_app(args.service, {})
-    else:
-        output = call_web_service(e, args.type, args.service)
-    print("Verifying service output")
-
-    assert "result" in output
-    assert len(output["result"]) == output_len
+    aml_workspace = None
+    endpoints = []
+    for service_type, service in zip(args.type, args.service):
+        if service_type == "Webapp":
+            endpoints.append((service, {}))
+        else:
+            if aml_workspace is None:
+                aml_workspace = Workspace.get(
+                    name=e.workspace_name,
+                    subscription_id=e.subscription_id,
+                    resource_group=e.resource_group
+                )
+            endpoints.append(get_web_service_endpoint(
+                aml_workspace, service_type, service))
+
+    # A single session keeps the connections to every service open
+    # between the readiness checks and the latency burst.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=max(args.burst_concurrency, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+        futures = [executor.submit(smoke_test, url, headers, session, args)
+                   for url, headers in endpoints]
+        for future in futures:
+            future.result()
     print("Smoke test successful.")
 
 
@@ -0,0 +1,86 @@
+import http.server
+import threading
+import pytest
+from ml_service.util.load_test import (
+    NO_VERSION, LoadTest, parse_split, scoring_url, summarize)
+
+
+def test_urls_without_a_scheme_default_to_http():
+    assert scoring_url("10.0.0.1/score") == "http://10.0.0.1/score"
+    assert scoring_url("https://example.com/score") == \
+        "https://example.com/score"
+    assert LoadTest("10.0.0.1/score", 1, 1).url == "http://10.0.0.1/score"
+
+
+def test_parse_split():
+    assert parse_split(None) == [(NO_VERSION, 1.0)]
+    assert parse_split("blue=90, green=10") == [("blue", 90.0),
+                                                ("green", 10.0)]
+    # A version without a weight weighs 1.
+    assert parse_split("blue,green=3") == [("blue", 1.0), ("green", 3.0)]
+    for split in ("blue=-1,green=2", "blue=0,green=0", "blue=x"):
+        with pytest.raises(ValueError):
+            parse_split(split)
+
+
+def test_summarize():
+    summary = summarize(list(range(1, 101)), errors=5, elapsed=10.0)
+
+    assert summary["requests"] == 105
+    assert summary["errors"] == 5
+    assert summary["throughput_rps"] == 10.0
+    assert summary["p50_ms"] == pytest.approx(50.5)
+    assert summary["p90_ms"] == pytest.approx(90.1)
+    assert summary["p99_ms"] == pytest.approx(99.01)
+    assert summary["p99.9_ms"] == pytest.approx(99.901)
+
+    empty = summarize([], errors=3, elapsed=0)
+    assert empty["requests"] == 3 and empty["throughput_rps"] == 0.0
+    assert empty["p50_ms"] is None and empty["p99.9_ms"] is None
+
+
+class VersionHandler(http.server.BaseHTTPRequestHandler):
+    # Answers with the image of the x-api-version requested, "green"
+    # failing.
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        version = self.headers.get("x-api-version", "default")
+        body = ('{"image": "%s"}' % version).encode("utf-8")
+        self.send_response(500 if version == "green" else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def service():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             VersionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "127.0.0.1:%d/score" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_responses_and_errors_are_counted_per_version(service):
+    load_test = LoadTest(service, rps=200, duration=0.2, payload=b"{}",
+                         split=parse_split("blue=1,green=1"),
+                         connections=4, count_responses=True)
+
+    report = load_test.run()
+
+    blue, green = report["blue"], report["green"]
+    assert blue["requests"] + green["requests"] == 40
+    assert report["all"]["requests"] == 40
+    assert blue["errors"] == 0 and blue["requests"] > 0
+    assert green["errors"] == green["requests"] > 0
+    assert report["all"]["errors"] == green["requests"]
+    assert green["p50_ms"] is None and blue["p50_ms"] is not None
+    assert report["error_samples"] == {"HTTP 500": green["requests"]}
+    # Only successful responses are counted.
+    assert report["responses"] == {'{"image": "blue"}': blue["requests"]}
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import types
+from diabetes_regression.scoring.admission import Overloaded
+from ml_service.util.local_scoring_server import LocalScoringServer
+
+
+class EntryScript(object):
+    # Records the calls of the server, and answers like score.py.
+
+    def __init__(self, metrics=None, error=None):
+        self.calls = []
+        self.metrics = metrics
+        self.error = error
+
+    def run(self, data, request_headers):
+        self.calls.append(("run", data, dict(request_headers)))
+        if self.error is not None:
+            raise self.error
+        return {"result": [sum(row) for row in data]}
+
+    def run_binary(self, body, request_headers):
+        self.calls.append(("run_binary", body, dict(request_headers)))
+        if self.error is not None:
+            raise self.error
+        return body[::-1], request_headers["Content-Type"]
+
+
+def request(entry_script, method, path, body=b"", headers=None):
+    """Sends one request to a LocalScoringServer, returns its response."""
+    async def exchange():
+        server = await asyncio.start_server(
+            LocalScoringServer(entry_script, workers=1).handle,
+            "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        head = "%s %s HTTP/1.1\r\nContent-Length: %d\r\n" \
+            "Connection: close\r\n" % (method, path, len(body))
+        for name, value in (headers or {}).items():
+            head += "%s: %s\r\n" % (name, value)
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    head, _, payload = asyncio.run(exchange()).partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    response_headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split(" ")[1]), response_headers, payload
+
+
+def test_json_requests_are_scored_by_run():
+    script = EntryScript()
+
+    status, headers, payload = request(
+        script, "POST", "/score", json.dumps({"data": [[1, 2], [3, 4]]})
+        .encode("utf-8"), {"content-type": "application/json"})
+
+    assert status == 200
+    assert headers["Content-Type"] == "application/json"
+    assert json.loads(payload) == {"result": [3, 7]}
+    name, data, request_headers = script.calls[0]
+    assert (name, data) == ("run", [[1, 2], [3, 4]])
+    # Title-cased like Azure ML, with a generated request id.
+    assert request_headers["Content-Type"] == "application/json"
+    assert request_headers["X-Ms-Request-Id"]
+
+
+def test_binary_content_types_are_scored_by_run_binary():
+    for content_type in ("application/octet-stream; dtype=float32",
+                         "application/vnd.apache.arrow.stream"):
+        script = EntryScript()
+
+        status, headers, payload = request(
+            script, "POST", "/score", b"\x01\x02\x03",
+            {"Content-Type": content_type})
+
+        assert status == 200
+        assert headers["Content-Type"] == content_type
+        assert payload == b"\x03\x02\x01"
+        assert script.calls[0][:2] == ("run_binary", b"\x01\x02\x03")
+
+
+def test_health_and_metrics():
+    metrics = types.SimpleNamespace(
+        to_prometheus=lambda: "scoring_requests_total 3\n")
+
+    assert request(EntryScript(), "GET", "/")[::2] == (200, b"Healthy")
+    status, headers, payload = request(
+        EntryScript(metrics), "GET", "/metrics")
+    assert status == 200
+    assert headers["Content-Type"].startswith("text/plain")
+    assert payload == b"scoring_requests_total 3\n"
+    assert request(EntryScript(), "GET", "/metrics")[0] == 404
+
+
+def test_error_statuses():
+    script = EntryScript()
+    assert request(script, "POST", "/score", b"not json")[0] == 400
+    assert request(script, "POST", "/score", b'{"rows": []}')[0] == 400
+    assert request(script, "GET", "/score")[0] == 405
+    assert request(script, "POST", "/predict", b"{}")[0] == 404
+    assert script.calls == []
+    # An entry script without run_binary only takes JSON.
+    json_only = types.SimpleNamespace(run=script.run)
+    assert request(json_only, "POST", "/score", b"\x00",
+                   {"Content-Type": "application/octet-stream"})[0] == 400
+
+
+def test_overloaded_requests_are_answered_503():
+    overloaded = EntryScript(error=Overloaded("queue full", 0.5))
+
+    status, _, payload = request(
+        overloaded, "POST", "/score", b'{"data": [[1]]}')
+    assert status == 503
+    assert b"queue full" in payload
+    status, _, _ = request(
+        overloaded, "POST", "/score", b"\x00" * 8,
+        {"Content-Type": "application/octet-stream"})
+    assert status == 503
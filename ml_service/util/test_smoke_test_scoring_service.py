@@ -0,0 +1,123 @@
+import argparse
+import time
+import pytest
+import requests
+from ml_service.util import smoke_test_scoring_service as smoke
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, result):
+        self.status_code = status_code
+        self.result = result
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError("HTTP %d" % self.status_code)
+
+    def json(self):
+        return {"result": self.result}
+
+
+class FakeSession(object):
+    # Fails the first failures requests, then answers after delay seconds.
+
+    def __init__(self, failures=0, delay=0.0):
+        self.failures = failures
+        self.delay = delay
+        self.requests = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.requests.append(headers)
+        if len(self.requests) <= self.failures:
+            if len(self.requests) % 2:
+                raise requests.exceptions.ConnectionError("refused")
+            return FakeResponse(502, None)
+        if self.delay:
+            time.sleep(self.delay)
+        return FakeResponse(200, [1.0] * smoke.output_len)
+
+
+class FakeClock(object):
+    # Stands for the clock of call_web_app, with full jitter at its upper
+    # bound so that delays are deterministic.
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def uniform(self, low, high):
+        return high
+
+    def functions(self):
+        return dict(sleep=self.sleep, monotonic=self.monotonic,
+                    uniform=self.uniform)
+
+
+def test_retries_back_off_exponentially_up_to_the_maximum():
+    clock = FakeClock()
+    session = FakeSession(failures=7)
+
+    output = smoke.call_web_app("http://service/score", {}, session=session,
+                                initial_delay_seconds=0.5,
+                                max_delay_seconds=15, **clock.functions())
+
+    assert output == {"result": [1.0, 1.0]}
+    assert clock.sleeps == [0.5, 1, 2, 4, 8, 15, 15]
+    # Each attempt is traced on its own.
+    assert len({headers["traceparent"] for headers in session.requests}) \
+        == 8
+
+
+def test_retries_stop_at_the_timeout():
+    clock = FakeClock()
+    session = FakeSession(failures=100)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        smoke.call_web_app("http://service/score", {}, session=session,
+                           timeout_seconds=20, **clock.functions())
+
+    # The next delay, 15 s, would have ended past the deadline.
+    assert clock.sleeps == [0.5, 1, 2, 4, 8]
+    assert len(session.requests) == 6
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 21))
+    assert smoke.percentile(values, 95) == 19
+    assert smoke.percentile(values, 50) == 10
+    assert smoke.percentile(values, 100) == 20
+    assert smoke.percentile(values, 0) == 1
+    assert smoke.percentile([7.0], 95) == 7.0
+
+
+def smoke_args(**kwargs):
+    args = dict(timeout_seconds=10, burst_requests=0, burst_concurrency=4,
+                max_p95_ms=1000)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_latency_is_only_checked_on_request():
+    session = FakeSession(delay=0.01)
+
+    smoke.smoke_test("http://service/score", {}, session,
+                     smoke_args(max_p95_ms=1))
+    assert len(session.requests) == 1
+
+    with pytest.raises(AssertionError, match="p95 latency"):
+        smoke.smoke_test("http://service/score", {}, session,
+                         smoke_args(burst_requests=8, max_p95_ms=1))
+    assert len(session.requests) == 10
+
+    smoke.smoke_test("http://service/score", {}, session,
+                     smoke_args(burst_requests=8, max_p95_ms=10000))
+    smoke.smoke_test("http://service/score", {}, session,
+                     smoke_args(burst_requests=8, max_p95_ms=0))